@@ -1,10 +1,18 @@
-from flask import Flask, abort, request
+import os
+
+from time import perf_counter
+
+from flask import Flask, Response, abort, g, request
+from jinja2 import FileSystemBytecodeCache
 
 from aquila._version import __version__
+from aquila.blob_storage import prune_bytecode_cache
 from aquila.endpoints.healthz import bp as healthz_bp
 from aquila.endpoints.metrics import bp as metrics_bp
 from aquila.endpoints.rewards import bp as rewards_bp
-from aquila.settings import METRICS_DEBUG, PROJECT_NAME
+from aquila.metrics import http_request_seconds
+from aquila.preload import start_background_threads, warm_templates
+from aquila.settings import METRICS_DEBUG, PRELOAD_APP, PROJECT_NAME, TEMPLATE_BYTECODE_CACHE_DIR
 
 
 def check_metrics_port() -> None:
@@ -15,12 +23,41 @@ def check_metrics_port() -> None:
         abort(404)
 
 
+def start_request_timer() -> None:
+    g.request_start = perf_counter()
+
+
+def observe_request_duration(response: Response) -> Response:
+    if (start := g.get("request_start")) is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "N/A"
+        http_request_seconds.labels(endpoint=endpoint, response_status=response.status_code).observe(
+            perf_counter() - start
+        )
+
+    return response
+
+
 def create_app() -> Flask:
     app = Flask(PROJECT_NAME)
+    if TEMPLATE_BYTECODE_CACHE_DIR:
+        # shared by the packaged templates and, through compile_template, by the blob templates
+        os.makedirs(TEMPLATE_BYTECODE_CACHE_DIR, exist_ok=True)
+        prune_bytecode_cache(TEMPLATE_BYTECODE_CACHE_DIR)
+        bytecode_cache = FileSystemBytecodeCache(TEMPLATE_BYTECODE_CACHE_DIR)
+        app.jinja_options = {**app.jinja_options, "bytecode_cache": bytecode_cache}
+
     app.register_blueprint(rewards_bp)
     app.register_blueprint(healthz_bp)
     app.register_blueprint(metrics_bp)
 
+    app.before_request(start_request_timer)
     app.before_request(check_metrics_port)
+    app.after_request(observe_request_duration)
+
+    if PRELOAD_APP:
+        warm_templates(app)
+    else:
+        # with PRELOAD_APP the background threads are started in each worker by aquila.preload.post_fork
+        start_background_threads()
 
     return app
@@ -0,0 +1,78 @@
+from collections.abc import Callable
+from threading import Semaphore
+from typing import TypeVar
+
+from aquila.metrics import admission_in_flight, admission_queue_depth, admission_shed_total
+from aquila.settings import ADMISSION_MAX_QUEUE_WAIT
+
+T = TypeVar("T")
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, service: str) -> None:
+        super().__init__(f"too many concurrent requests to {service}")
+        self.service = service
+
+
+class AdmissionLimiter:
+    """
+    Per-service limit on the concurrent upstream requests of a worker.
+
+    A call over `max_concurrent` waits up to `max_queue_wait` seconds for another call to finish and is then
+    rejected with AdmissionRejectedError, so that it can be answered straight away instead of queuing until
+    the upstream timeouts expire. A `max_concurrent` of 0 disables the limit.
+    """
+
+    def __init__(self, service: str, *, max_concurrent: int, max_queue_wait: float = ADMISSION_MAX_QUEUE_WAIT) -> None:
+        self.service = service
+        self.max_concurrent = max_concurrent
+        self.max_queue_wait = max_queue_wait
+        self._slots = Semaphore(max_concurrent)
+
+    def _acquire(self) -> bool:
+        if self._slots.acquire(blocking=False):
+            return True
+
+        if self.max_queue_wait <= 0:
+            return False
+
+        queue_depth = admission_queue_depth.labels(service=self.service)
+        queue_depth.inc()
+        try:
+            return self._slots.acquire(timeout=self.max_queue_wait)
+        finally:
+            queue_depth.dec()
+
+    def try_acquire(self) -> bool:
+        """Take a slot without waiting for an extra request of an admitted call, e.g. a hedge, see `release`."""
+        if self.max_concurrent <= 0:
+            return True
+
+        if not self._slots.acquire(blocking=False):
+            return False
+
+        admission_in_flight.labels(service=self.service).inc()
+        return True
+
+    def release(self) -> None:
+        if self.max_concurrent <= 0:
+            return
+
+        admission_in_flight.labels(service=self.service).dec()
+        self._slots.release()
+
+    def call(self, func: Callable[[], T]) -> T:
+        if self.max_concurrent <= 0:
+            return func()
+
+        if not self._acquire():
+            admission_shed_total.labels(service=self.service).inc()
+            raise AdmissionRejectedError(self.service)
+
+        in_flight = admission_in_flight.labels(service=self.service)
+        in_flight.inc()
+        try:
+            return func()
+        finally:
+            in_flight.dec()
+            self._slots.release()
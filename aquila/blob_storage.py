@@ -1,21 +1,293 @@
+import fcntl
+import hashlib
+import json
 import logging
+import os
+
+from collections import OrderedDict
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from datetime import datetime
 from os.path import splitext
-from typing import TYPE_CHECKING, Any, ClassVar
+from tempfile import NamedTemporaryFile
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter, sleep, time
+from typing import TYPE_CHECKING, Any
 
 from azure.storage.blob import BlobServiceClient
+from flask import current_app
 
-from aquila.settings import BLOB_CONTAINER, BLOB_STORAGE_DSN, TESTING
+from aquila.coalescing import RequestCoalescer
+from aquila.metrics import (
+    template_bytecode_cache_total,
+    template_cache_bytes,
+    template_cache_evictions_total,
+    template_compile_cache_total,
+    template_compile_seconds,
+    template_initial_load_seconds,
+    template_lookup_seconds,
+    template_sync_blobs_changed_total,
+    template_sync_seconds,
+    template_syncs_total,
+)
+from aquila.settings import (
+    BLOB_CONTAINER,
+    BLOB_STORAGE_DSN,
+    PRELOAD_APP,
+    TEMPLATE_BYTECODE_CACHE_DIR,
+    TEMPLATE_BYTECODE_CACHE_MAX_AGE,
+    TEMPLATE_CACHE_MAX_BYTES,
+    TEMPLATE_DOWNLOAD_CONCURRENCY,
+    TEMPLATE_LOADING_MODE,
+    TEMPLATE_MISS_TTL,
+    TEMPLATE_RELOAD_MIN_INTERVAL,
+    TEMPLATE_SNAPSHOT_DIR,
+    TEMPLATE_SNAPSHOT_MAX_AGE,
+    TEMPLATE_SYNC_INTERVAL,
+    TESTING,
+)
 
 if TYPE_CHECKING:  # pragma: no cover
-    from azure.storage.blob import ContainerClient
+    from azure.storage.blob import BlobProperties, ContainerClient
+    from jinja2 import Environment, Template
 
+logger = logging.getLogger("template-loader")
 
-class TemplateLoader:  # pragma: no cover
-    _templates: ClassVar[dict[str, dict[str, str]]] = {}
+MAX_TEMPLATE_MISSES = 10_000
+SNAPSHOT_MANIFEST_FILE_NAME = "manifest.json"
+SNAPSHOT_LOCK_FILE_NAME = ".lock"
+SNAPSHOT_SYNC_LOCK_FILE_NAME = ".sync.lock"
+# seconds between two attempts at taking a snapshot lock held by another worker
+SNAPSHOT_LOCK_POLL_INTERVAL = 0.05
+# file names given by jinja's FileSystemBytecodeCache to its cached bytecode
+BYTECODE_CACHE_FILE_PREFIX = "__jinja2_"
+BYTECODE_CACHE_FILE_SUFFIX = ".cache"
+# template slug recorded as missing for retailers without any template in blob storage
+ANY_TEMPLATE = "*"
+
+
+def template_checksum(content: str) -> str:
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass(frozen=True)
+class BlobTemplate:
+    content: str
+    checksum: str
+    etag: str | None = None
+    last_modified: datetime | None = None
+
+    def is_current(self, blob: "BlobProperties") -> bool:
+        return (self.etag, self.last_modified) == (blob.etag, blob.last_modified)
+
+
+# retailer_slug -> template_slug -> template
+Templates = dict[str, dict[str, BlobTemplate]]
+
+
+def templates_size(templates: dict[str, BlobTemplate]) -> int:
+    return sum(len(template.content.encode("utf-8")) for template in templates.values())
+
+
+def compile_template(env: "Environment", template: BlobTemplate) -> "Template":
+    """
+    Compile a blob template, through the environment's bytecode cache if it has one.
+
+    The bytecode is cached by content checksum, so workers and restarts share the compiled code of a
+    template for as long as its content does not change.
+    """
+    bytecode_cache = env.bytecode_cache
+    if bytecode_cache is None:
+        return env.from_string(template.content)
+
+    name = f"blob-template-{template.checksum}"
+    bucket = bytecode_cache.get_bucket(env, name, None, template.content)
+    if bucket.code is None:
+        template_bytecode_cache_total.labels(result="miss").inc()
+        bucket.code = env.compile(template.content, name)
+        bytecode_cache.set_bucket(bucket)
+    else:
+        template_bytecode_cache_total.labels(result="hit").inc()
+
+    return env.template_class.from_code(env, bucket.code, env.make_globals(None))
+
+
+def prune_bytecode_cache(directory: str, max_age: float = TEMPLATE_BYTECODE_CACHE_MAX_AGE) -> int:
+    """
+    Remove the bytecode cache files written more than max_age seconds ago, returning how many were removed.
+
+    Every template checksum adds a file to the cache, so without pruning the directory keeps the bytecode
+    of every version of every template. A pruned template still in use is compiled and cached again by the
+    next worker that needs it.
+    """
+    cutoff = time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+
+    for entry in entries:
+        if not (entry.name.startswith(BYTECODE_CACHE_FILE_PREFIX) and entry.name.endswith(BYTECODE_CACHE_FILE_SUFFIX)):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            # already pruned by another worker
+            continue
+
+    return removed
+
+
+def _write_atomic(path: str, content: str) -> None:
+    with NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path), delete=False) as tmp_file:
+        tmp_file.write(content)
+
+    os.replace(tmp_file.name, path)
+
+
+class TemplateSnapshot:
+    """
+    Snapshot of the loaded templates in a local directory, shared by the workers of a host.
+
+    `manifest.json` holds the blob etag, last_modified and checksum of every template and the time of the
+    last sync with blob storage, each distinct content is stored once under `templates/{checksum}.html`.
+    Files are replaced atomically, callers of `read` and `write` hold the directory's lock.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.contents_path = os.path.join(path, "templates")
+        self.manifest_path = os.path.join(path, SNAPSHOT_MANIFEST_FILE_NAME)
+        os.makedirs(self.contents_path, exist_ok=True)
+
+    @contextmanager
+    def lock(
+        self, operation: int = fcntl.LOCK_EX, file_name: str = SNAPSHOT_LOCK_FILE_NAME
+    ) -> Generator[None, None, None]:
+        """
+        Hold the flock of `file_name`, raising BlockingIOError at once if it is taken and `operation` has LOCK_NB.
+
+        Otherwise a lock held by another worker is polled with sleep rather than waited for in flock, which gevent
+        does not make cooperative: a gevent worker keeps serving requests while another worker syncs.
+        """
+        with open(os.path.join(self.path, file_name), "a") as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, operation | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if operation & fcntl.LOCK_NB:
+                        raise
+                    sleep(SNAPSHOT_LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _content_path(self, checksum: str) -> str:
+        return os.path.join(self.contents_path, f"{checksum}.html")
+
+    def _read_manifest(self) -> dict | None:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("invalid templates snapshot manifest '%s', ignoring it", self.manifest_path, exc_info=True)
+            return None
+
+    def synced_at(self) -> float | None:
+        """Unix time of the last sync of the snapshot with blob storage."""
+        manifest = self._read_manifest()
+        return manifest.get("synced_at") if manifest else None
+
+    def read(self) -> Templates | None:
+        """Return the snapshot templates, templates whose content is missing or corrupted are left out."""
+        if not (manifest := self._read_manifest()):
+            return None
 
+        templates: Templates = {}
+        try:
+            for retailer_slug, retailer_templates in manifest["templates"].items():
+                for template_slug, entry in retailer_templates.items():
+                    try:
+                        with open(self._content_path(entry["checksum"]), encoding="utf-8") as content_file:
+                            content = content_file.read()
+                    except (OSError, UnicodeDecodeError):
+                        content = None
+
+                    if content is None or template_checksum(content) != entry["checksum"]:
+                        logger.warning("invalid snapshot content for %s/%s, skipping", retailer_slug, template_slug)
+                        continue
+
+                    last_modified = entry["last_modified"]
+                    templates.setdefault(retailer_slug, {})[template_slug] = BlobTemplate(
+                        content=content,
+                        checksum=entry["checksum"],
+                        etag=entry["etag"],
+                        last_modified=datetime.fromisoformat(last_modified) if last_modified else None,
+                    )
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.warning("invalid templates snapshot manifest '%s', ignoring it", self.manifest_path, exc_info=True)
+            return None
+
+        return templates
+
+    def write(self, templates: Templates) -> None:
+        manifest_templates: dict[str, dict[str, dict]] = {}
+        contents = set()
+        for retailer_slug, retailer_templates in templates.items():
+            for template_slug, template in retailer_templates.items():
+                content_path = self._content_path(template.checksum)
+                if not os.path.exists(content_path):
+                    _write_atomic(content_path, template.content)
+
+                contents.add(os.path.basename(content_path))
+                manifest_templates.setdefault(retailer_slug, {})[template_slug] = {
+                    "checksum": template.checksum,
+                    "etag": template.etag,
+                    "last_modified": template.last_modified.isoformat() if template.last_modified else None,
+                }
+
+        _write_atomic(self.manifest_path, json.dumps({"synced_at": time(), "templates": manifest_templates}))
+        for name in os.listdir(self.contents_path):
+            if name not in contents:
+                os.remove(os.path.join(self.contents_path, name))
+
+
+class TemplateLoader:  # pragma: no cover
     def __init__(self) -> None:
         self.dont_fetch_templates = False
+        self.lazy = TEMPLATE_LOADING_MODE == "lazy"
         self.logger = logging.getLogger("template-loader")
+        # replaced as a whole on every load
+        self._templates: Templates = {}
+        # lazy loading only, retailer_slug -> size in bytes of its templates, least recently used first
+        self._retailer_sizes: OrderedDict[str, int] = OrderedDict()
+        self._cache_lock = Lock()
+        self._retailer_loads: RequestCoalescer[None] = RequestCoalescer()
+        # lazy loading only, retailers with a directory in the container and when they were last listed
+        self._listed_retailers: frozenset[str] = frozenset()
+        self._retailers_listed_at: float | None = None
+        self._compiled_templates: dict[tuple[str, str, str], Template] = {}
+        # (retailer_slug, template_slug) -> monotonic time until which the template is known to be missing
+        self._misses: dict[tuple[str, str], float] = {}
+        self._reload_lock = Lock()
+        self._last_reload = 0.0
+        self._sync_stop = Event()
+        self._sync_thread: Thread | None = None
+        self.snapshot: TemplateSnapshot | None = None
+        # a snapshot loaded at startup is revalidated against blob storage by the background sync
+        self._revalidate_snapshot = False
+        self.last_sync_duration: float | None = None
+        self.last_sync_changed: int | None = None
+        self.initial_load_duration: float | None = None
 
         if TESTING:
             self.dont_fetch_templates = True
@@ -23,10 +295,9 @@ class TemplateLoader:  # pragma: no cover
 
         try:
             self.container_name = BLOB_CONTAINER
-            # type hints are still somewhat broken for BlobServiceClient
-            blob_service_client: Any = BlobServiceClient.from_connection_string(BLOB_STORAGE_DSN, logger=self.logger)
-            self.container_client: "ContainerClient" = blob_service_client.get_container_client(self.container_name)
-            self._load_templates()
+            self.container_client = self._build_container_client()
+            if not self.lazy:
+                self._initial_load()
         except Exception:  # pylint: disable=broad-except
             self.dont_fetch_templates = True
             self.logger.exception(
@@ -36,15 +307,151 @@ class TemplateLoader:  # pragma: no cover
                 ),
                 BLOB_CONTAINER,
             )
+        else:
+            # with a preloaded app the background sync is started in each worker after the fork
+            if not PRELOAD_APP:
+                self.start_sync()
+
+    def _build_container_client(self) -> "ContainerClient":
+        # type hints are still somewhat broken for BlobServiceClient
+        blob_service_client: Any = BlobServiceClient.from_connection_string(BLOB_STORAGE_DSN, logger=self.logger)
+        return blob_service_client.get_container_client(self.container_name)
+
+    def after_fork(self) -> None:
+        """Replace the blob storage client, whose connections are shared with the master, and start the sync."""
+        if self.dont_fetch_templates:
+            return
+
+        self.container_client = self._build_container_client()
+        self._sync_thread = None
+        self.start_sync()
+
+    def precompile_templates(self, env: "Environment") -> None:
+        """Compile every loaded template ahead of the first request, e.g. once in a preloading master."""
+        for retailer_slug, retailer_templates in self._templates.items():
+            for template_slug, template in retailer_templates.items():
+                key = (retailer_slug, template_slug, template.checksum)
+                if key not in self._compiled_templates:
+                    self._compiled_templates[key] = compile_template(env, template)
+
+    def _initial_load(self) -> None:
+        """
+        Load all the templates when the worker starts.
 
-    def _load_templates(self) -> None:
+        With TEMPLATE_SNAPSHOT_DIR set the worker starts from the local snapshot, if there is one, and
+        revalidates it against blob storage in the background, so that neither the startup time nor the
+        availability of the templates depend on blob storage.
+        """
+        start = perf_counter()
+        if TEMPLATE_SNAPSHOT_DIR:
+            self.snapshot = TemplateSnapshot(TEMPLATE_SNAPSHOT_DIR)
+
+        if from_snapshot := self._load_snapshot():
+            self._revalidate_snapshot = True
+        else:
+            self._sync_templates()
+            self._last_reload = monotonic()
+
+        self.initial_load_duration = perf_counter() - start
+        template_initial_load_seconds.observe(self.initial_load_duration)
+        self.logger.info(
+            "initial templates load from %s in %.3fs",
+            "snapshot" if from_snapshot else "blob storage",
+            self.initial_load_duration,
+        )
+
+    def _load_snapshot(self) -> bool:
+        if self.snapshot is None:
+            return False
+
+        with self.snapshot.lock(fcntl.LOCK_SH):
+            templates = self.snapshot.read()
+
+        if templates is None:
+            return False
+
+        self._templates = templates
+        self._drop_stale_compiled_templates()
+        template_syncs_total.labels(source="snapshot").inc()
+        return True
+
+    def _download_template(self, blob: "BlobProperties") -> BlobTemplate | None:
+        blob_client = self.container_client.get_blob_client(blob.name)
+        try:
+            content: str | bytes = blob_client.download_blob().readall()
+            if isinstance(content, bytes):
+                content = content.decode("utf-8")
+        except (AttributeError, UnicodeDecodeError):
+            self.logger.exception("failed to decode file '%s' from container '%s'", blob.name, self.container_name)
+            return None
+
+        return BlobTemplate(
+            content=content,
+            checksum=template_checksum(content),
+            etag=blob.etag,
+            last_modified=blob.last_modified,
+        )
+
+    def _download_templates(self, blobs: list["BlobProperties"]) -> list[BlobTemplate | None]:
+        if len(blobs) <= 1 or TEMPLATE_DOWNLOAD_CONCURRENCY <= 1:
+            return [self._download_template(blob) for blob in blobs]
+
+        with ThreadPoolExecutor(
+            max_workers=min(TEMPLATE_DOWNLOAD_CONCURRENCY, len(blobs)), thread_name_prefix="template-download"
+        ) as executor:
+            return list(executor.map(self._download_template, blobs))
+
+    def _load_templates(self, retailer_slug: str | None = None) -> None:
+        """
+        Sync the loaded templates with the blob storage container, or only with the `retailer_slug/` prefix.
+
+        Only blobs whose etag or last_modified changed since the previous load are downloaded, using up to
+        TEMPLATE_DOWNLOAD_CONCURRENCY threads, blobs no longer in the container are dropped and the new
+        templates snapshot is swapped in at once.
+        """
         self.logger.info("loading aquila templates from '%s'", self.container_name)
+        start = perf_counter()
+        if retailer_slug is None:
+            current = self._templates
+            blobs = self.container_client.list_blobs()
+        else:
+            cached = self._templates.get(retailer_slug)
+            current = {retailer_slug: cached} if cached else {}
+            blobs = self.container_client.list_blobs(name_starts_with=f"{retailer_slug}/")
+
+        templates, downloaded = self._sync_blobs(blobs, current)
+        dropped = sum(
+            template_slug not in templates.get(current_retailer_slug, {})
+            for current_retailer_slug, retailer_templates in current.items()
+            for template_slug in retailer_templates
+        )
+        if retailer_slug is None:
+            self._templates = templates
+        else:
+            self._cache_retailer(retailer_slug, templates.get(retailer_slug, {}))
+        self._drop_stale_compiled_templates()
 
-        for blob in self.container_client.list_blobs():
+        self.last_sync_duration = perf_counter() - start
+        self.last_sync_changed = downloaded + dropped
+        template_sync_seconds.observe(self.last_sync_duration)
+        template_sync_blobs_changed_total.labels(change="downloaded").inc(downloaded)
+        template_sync_blobs_changed_total.labels(change="dropped").inc(dropped)
+        self.logger.info(
+            "loaded template slugs: %s, %d blobs changed in %.3fs",
+            list(templates),
+            self.last_sync_changed,
+            self.last_sync_duration,
+        )
+
+    def _sync_blobs(self, blobs: Iterable["BlobProperties"], current: Templates) -> tuple[Templates, int]:
+        """Return the templates for the listed blobs, reusing the current ones, and the number of downloads."""
+        templates: Templates = {}
+        to_download: list[tuple[str, str, BlobProperties]] = []
+
+        for blob in blobs:
             if blob.name == "healthz":
                 continue
 
-            blob_client = self.container_client.get_blob_client(blob.name)
             try:
                 retailer_slug, template_file = blob.name.split("/")
                 template_slug, extension = splitext(template_file)
@@ -54,46 +461,323 @@ class TemplateLoader:  # pragma: no cover
                 )
                 continue
 
-            if extension == ".html":
-                try:
-                    content: str | bytes = blob_client.download_blob().readall()
-                    if isinstance(content, bytes):
-                        content = content.decode("utf-8")
-
-                    if retailer_slug not in self._templates:
-                        self._templates[retailer_slug] = {}
-
-                    self._templates[retailer_slug][template_slug] = content
-                except (AttributeError, UnicodeDecodeError):
-                    self.logger.exception(
-                        "failed to decode file '%s' from container '%s'", blob.name, self.container_name
-                    )
-            else:
+            if extension != ".html":
                 self.logger.warning(
                     "invalid html file '%s' found in '%s' container, skipping.", blob.name, self.container_name
                 )
+                continue
+
+            template = current.get(retailer_slug, {}).get(template_slug)
+            if template is None or not template.is_current(blob):
+                to_download.append((retailer_slug, template_slug, blob))
+            else:
+                templates.setdefault(retailer_slug, {})[template_slug] = template
+
+        new_templates = self._download_templates([blob for _, _, blob in to_download])
+        for (retailer_slug, template_slug, _), new_template in zip(to_download, new_templates, strict=True):
+            # keep serving the previous version of a template that failed to download
+            if template := new_template or current.get(retailer_slug, {}).get(template_slug):
+                templates.setdefault(retailer_slug, {})[template_slug] = template
+
+        return templates, sum(new_template is not None for new_template in new_templates)
+
+    def _cache_retailer(self, retailer_slug: str, templates: dict[str, BlobTemplate]) -> None:
+        """
+        Swap in the lazily loaded templates of a retailer.
+
+        The least recently used retailers are evicted until the size of all the cached templates is within
+        TEMPLATE_CACHE_MAX_BYTES, the most recently used retailer is always kept. A retailer without any template
+        is not cached but remembered as missing for TEMPLATE_MISS_TTL seconds.
+        """
+        with self._cache_lock:
+            cached = dict(self._templates)
+            if templates:
+                cached[retailer_slug] = templates
+                # a retailer already cached keeps its position, syncing it is not a use
+                self._retailer_sizes[retailer_slug] = templates_size(templates)
+            else:
+                cached.pop(retailer_slug, None)
+                self._retailer_sizes.pop(retailer_slug, None)
+                self._record_miss(retailer_slug, ANY_TEMPLATE)
+
+            evicted = 0
+            while len(self._retailer_sizes) > 1 and sum(self._retailer_sizes.values()) > TEMPLATE_CACHE_MAX_BYTES:
+                evicted_slug, _ = self._retailer_sizes.popitem(last=False)
+                cached.pop(evicted_slug, None)
+                evicted += 1
+
+            self._templates = cached
+            template_cache_bytes.set(sum(self._retailer_sizes.values()))
+
+        if evicted:
+            template_cache_evictions_total.inc(evicted)
+            self.logger.info("evicted %d retailers from the template cache", evicted)
+
+    def _touch_retailer(self, retailer_slug: str) -> None:
+        with self._cache_lock:
+            if retailer_slug in self._retailer_sizes:
+                self._retailer_sizes.move_to_end(retailer_slug)
+
+    def _load_retailer_on_demand(self, retailer_slug: str) -> None:
+        """Load the templates of a retailer not cached yet, concurrent requests for it share the same load."""
+        try:
+            self._retailer_loads.call(retailer_slug, lambda: self._load_templates(retailer_slug))
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("failed to load templates of '%s' from '%s'", retailer_slug, self.container_name)
+            self._record_miss(retailer_slug, ANY_TEMPLATE)
+
+    def _list_retailers(self) -> None:
+        # set first, so that a failed listing is not retried straight away either
+        self._retailers_listed_at = monotonic()
+        prefixes = self.container_client.walk_blobs(delimiter="/")
+        self._listed_retailers = frozenset(prefix.name[:-1] for prefix in prefixes if prefix.name.endswith("/"))
+
+    def _is_listed_retailer(self, retailer_slug: str) -> bool:
+        """
+        Lazy loading only, whether the retailer has a directory in the container.
+
+        An unknown slug lists the container's retailers again at most once every TEMPLATE_RELOAD_MIN_INTERVAL
+        seconds, so that requests for made-up retailers can not each send a request to blob storage.
+        """
+        if retailer_slug in self._listed_retailers:
+            return True
+
+        listed_at = self._retailers_listed_at
+        if listed_at is not None and monotonic() - listed_at < TEMPLATE_RELOAD_MIN_INTERVAL:
+            return False
+
+        try:
+            self._retailer_loads.call(ANY_TEMPLATE, self._list_retailers)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("failed to list the retailers of '%s'", self.container_name)
+
+        return retailer_slug in self._listed_retailers
+
+    def _sync_templates(self, wait: bool = True) -> None:
+        if self.snapshot is not None:
+            self._sync_with_snapshot(self.snapshot, wait)
+            return
+
+        template_syncs_total.labels(source="blob_storage").inc()
+        if not self.lazy:
+            self._load_templates()
+            return
+
+        # only the retailers already in the cache are kept in sync
+        for retailer_slug in list(self._templates):
+            self._load_templates(retailer_slug)
+
+    def _sync_with_snapshot(self, snapshot: TemplateSnapshot, wait: bool = True) -> None:
+        """
+        Sync with blob storage and write the snapshot, once for all the workers sharing the snapshot.
+
+        Workers sync one at a time under the snapshot's sync lock, a worker finding a snapshot synced less than
+        TEMPLATE_SNAPSHOT_MAX_AGE seconds ago by another worker loads it instead of contacting blob storage.
+        Without `wait` a worker with templates keeps them rather than waiting for another worker's sync.
+        The snapshot's lock is only held to read or write the snapshot, never while listing and downloading
+        from blob storage, so that starting workers load the snapshot without waiting for a sync.
+        """
+        with ExitStack() as stack:
+            operation = fcntl.LOCK_EX if wait or not self._templates else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                stack.enter_context(snapshot.lock(operation, SNAPSHOT_SYNC_LOCK_FILE_NAME))
+            except BlockingIOError:
+                self.logger.info("templates snapshot being synced by another worker, keeping the current templates")
+                return
+
+            with snapshot.lock(fcntl.LOCK_SH):
+                synced_at = snapshot.synced_at()
+                fresh = synced_at is not None and time() - synced_at < TEMPLATE_SNAPSHOT_MAX_AGE
+                templates = snapshot.read() if fresh else None
+
+            if templates is not None:
+                self._templates = templates
+                self._drop_stale_compiled_templates()
+                template_syncs_total.labels(source="snapshot").inc()
+                return
+
+            self._load_templates()
+            with snapshot.lock():
+                snapshot.write(self._templates)
+            template_syncs_total.labels(source="blob_storage").inc()
+
+    def _drop_stale_compiled_templates(self) -> None:
+        for key in list(self._compiled_templates):
+            retailer_slug, template_slug, checksum = key
+            template = self._get_template(retailer_slug, template_slug)
+            if not template or template.checksum != checksum:
+                self._compiled_templates.pop(key, None)
 
-        self.logger.info("loaded template slugs: %s", list(self._templates))
+    def start_sync(self) -> None:
+        """
+        Start the background revalidation of a snapshot loaded at startup, if any, and the thread syncing
+        templates every TEMPLATE_SYNC_INTERVAL seconds, if enabled.
+        """
+        if self.dont_fetch_templates:
+            return
+
+        if self._revalidate_snapshot:
+            self._revalidate_snapshot = False
+            Thread(target=self._sync_once, name="template-revalidate", daemon=True).start()
+
+        if TEMPLATE_SYNC_INTERVAL <= 0:
+            return
+
+        if self._sync_thread and self._sync_thread.is_alive():
+            return
+
+        self._sync_stop.clear()
+        self._sync_thread = Thread(target=self._sync_forever, name="template-sync", daemon=True)
+        self._sync_thread.start()
+
+    def stop_sync(self) -> None:
+        """Stop the background sync, run when gunicorn stops the worker."""
+        self._sync_stop.set()
+        self._sync_thread = None
+
+    def _sync_forever(self) -> None:
+        while not self._sync_stop.wait(TEMPLATE_SYNC_INTERVAL):
+            self._sync_once()
 
-    def _get_template(self, retailer_slug: str, template_slug: str) -> str | None:
+    def _sync_once(self) -> None:
+        try:
+            with self._reload_lock:
+                self._sync_templates()
+                self._last_reload = monotonic()
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("background sync of templates from '%s' failed", self.container_name)
+
+        if TEMPLATE_BYTECODE_CACHE_DIR:
+            try:
+                prune_bytecode_cache(TEMPLATE_BYTECODE_CACHE_DIR)
+            except OSError:
+                self.logger.exception("pruning of the bytecode cache in '%s' failed", TEMPLATE_BYTECODE_CACHE_DIR)
+
+    def _get_template(self, retailer_slug: str, template_slug: str) -> BlobTemplate | None:
         try:
             return self._templates[retailer_slug][template_slug]
         except KeyError:
             return None
 
-    def get_template(self, retailer_slug: str, template_slug: str) -> str | None:
+    def lookup_template(self, retailer_slug: str, template_slug: str) -> BlobTemplate | None:
         if self.dont_fetch_templates:
             self.logger.debug("TESTING set to %s, returning None", TESTING)
             return None
 
         self.logger.debug("available templates: %s, requested: %s", list(self._templates), template_slug)
+        start = perf_counter()
         template = self._get_template(retailer_slug, template_slug)
-        if not template:
-            self.logger.info("template slug '%s' not found, trying to load templates again", template_slug)
-            self._load_templates()
+        loaded = unlisted = False
+        if self.lazy and retailer_slug in self._templates:
+            self._touch_retailer(retailer_slug)
+        elif self.lazy and not self._is_known_miss(retailer_slug, ANY_TEMPLATE):
+            if self._is_listed_retailer(retailer_slug):
+                loaded = True
+                self._load_retailer_on_demand(retailer_slug)
+                template = self._get_template(retailer_slug, template_slug)
+                if not template:
+                    self._record_miss(retailer_slug, template_slug)
+            else:
+                unlisted = True
+
+        # while the background sync is running new templates are picked up by it, not by the request
+        reload = not (
+            template
+            or loaded
+            or unlisted
+            or self._sync_thread
+            or self._is_known_miss(retailer_slug, template_slug)
+            or self._is_known_miss(retailer_slug, ANY_TEMPLATE)
+        )
+        if reload:
+            template = self._reload_for_miss(retailer_slug, template_slug)
+
+        template_lookup_seconds.labels(reload=str(reload or loaded).lower()).observe(perf_counter() - start)
+        return template
+
+    @property
+    def is_warm(self) -> bool:
+        """True once the templates were loaded from blob storage."""
+        return not self.dont_fetch_templates and (self.lazy or self.initial_load_duration is not None)
+
+    def has_retailer(self, retailer_slug: str) -> bool:
+        """
+        Whether the retailer has templates in blob storage.
+
+        With lazy loading this goes by the retailers listed in the container rather than by the cache, so that
+        the answer for a retailer does not change when its templates are evicted.
+        """
+        if self.lazy:
+            return self._is_listed_retailer(retailer_slug)
+
+        return retailer_slug in self._templates
+
+    def get_template(self, retailer_slug: str, template_slug: str) -> str | None:
+        template = self.lookup_template(retailer_slug, template_slug)
+        return template.content if template else None
+
+    def _is_known_miss(self, retailer_slug: str, template_slug: str) -> bool:
+        expires_at = self._misses.get((retailer_slug, template_slug))
+        return expires_at is not None and expires_at > monotonic()
+
+    def _record_miss(self, retailer_slug: str, template_slug: str) -> None:
+        now = monotonic()
+        if len(self._misses) >= MAX_TEMPLATE_MISSES:
+            self._misses = {key: expires_at for key, expires_at in self._misses.items() if expires_at > now}
+            if len(self._misses) >= MAX_TEMPLATE_MISSES:
+                self._misses = {}
+
+        self._misses[(retailer_slug, template_slug)] = now + TEMPLATE_MISS_TTL
+
+    def _reload_for_miss(self, retailer_slug: str, template_slug: str) -> BlobTemplate | None:
+        """
+        Reload the templates from blob storage after a miss.
+
+        Only one thread reloads at a time and reloads are at most one every TEMPLATE_RELOAD_MIN_INTERVAL
+        seconds, other threads keep serving from the currently loaded templates. A template still missing
+        after the reload is remembered for TEMPLATE_MISS_TTL seconds.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            self.logger.debug("template reload already in progress, template slug '%s' not found", template_slug)
+            return None
+
+        try:
+            if monotonic() - self._last_reload >= TEMPLATE_RELOAD_MIN_INTERVAL:
+                self.logger.info("template slug '%s' not found, trying to load templates again", template_slug)
+                self._last_reload = monotonic()
+                if self.lazy:
+                    self._load_templates(retailer_slug)
+                else:
+                    self._sync_templates(wait=False)
+                self._misses = {key: exp for key, exp in self._misses.items() if not self._get_template(*key)}
+
             template = self._get_template(retailer_slug, template_slug)
+            if not template:
+                self._record_miss(retailer_slug, template_slug)
+        finally:
+            self._reload_lock.release()
 
         return template
 
+    def compiled_template(self, retailer_slug: str, template_slug: str, template: BlobTemplate) -> "Template":
+        """
+        Return the compiled jinja2 Template for a blob template returned by `lookup_template`.
+
+        Compiled templates are cached by (retailer_slug, template_slug, content checksum) so that a
+        template is only compiled again once its content in blob storage changes.
+        """
+        key = (retailer_slug, template_slug, template.checksum)
+        if compiled := self._compiled_templates.get(key):
+            template_compile_cache_total.labels(result="hit").inc()
+            return compiled
+
+        template_compile_cache_total.labels(result="miss").inc()
+        start = perf_counter()
+        compiled = compile_template(current_app.jinja_env, template)
+        template_compile_seconds.observe(perf_counter() - start)
+
+        self._compiled_templates[key] = compiled
+        return compiled
+
 
 template_loader = TemplateLoader()
@@ -0,0 +1,153 @@
+import logging
+
+from collections import deque
+from collections.abc import Callable
+from enum import IntEnum
+from threading import Lock
+from time import monotonic, perf_counter
+from typing import TypeVar
+
+from aquila.metrics import circuit_breaker_rejected_total, circuit_breaker_state
+from aquila.settings import (
+    CIRCUIT_BREAKER_ENABLED,
+    CIRCUIT_BREAKER_FAILURE_RATE,
+    CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+    CIRCUIT_BREAKER_MIN_CALLS,
+    CIRCUIT_BREAKER_OPEN_SECONDS,
+    CIRCUIT_BREAKER_SLOW_CALL_RATE,
+    CIRCUIT_BREAKER_SLOW_CALL_SECONDS,
+    CIRCUIT_BREAKER_WINDOW_SIZE,
+)
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(IntEnum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, service: str) -> None:
+        super().__init__(f"circuit for {service} is open")
+        self.service = service
+
+
+class CircuitBreaker:
+    """
+    Per-service circuit breaker over the outcome of the last `window_size` calls.
+
+    The circuit opens once at least `min_calls` calls were recorded and either the failure rate or the rate
+    of calls slower than `slow_call_seconds` reaches its threshold. While open every call is rejected with
+    CircuitOpenError, after `open_seconds` up to `half_open_calls` probe calls are let through and the
+    circuit closes again if all of them succeed, or opens again on the first failed or slow probe.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        service: str,
+        *,
+        enabled: bool = CIRCUIT_BREAKER_ENABLED,
+        window_size: int = CIRCUIT_BREAKER_WINDOW_SIZE,
+        min_calls: int = CIRCUIT_BREAKER_MIN_CALLS,
+        failure_rate: float = CIRCUIT_BREAKER_FAILURE_RATE,
+        slow_call_seconds: float = CIRCUIT_BREAKER_SLOW_CALL_SECONDS,
+        slow_call_rate: float = CIRCUIT_BREAKER_SLOW_CALL_RATE,
+        open_seconds: float = CIRCUIT_BREAKER_OPEN_SECONDS,
+        half_open_calls: int = CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+    ) -> None:
+        self.service = service
+        self.enabled = enabled
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        # (failed, slow) outcome of the most recent calls
+        self._calls: deque[tuple[bool, bool]] = deque(maxlen=window_size)
+        self._lock = Lock()
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        circuit_breaker_state.labels(service=service).set(self._state)
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    def _set_state(self, state: CircuitState) -> None:
+        if state == self._state:
+            return
+
+        logger.warning("circuit for %s changed from %s to %s", self.service, self._state.name, state.name)
+        self._state = state
+        circuit_breaker_state.labels(service=self.service).set(state)
+        if state == CircuitState.OPEN:
+            self._opened_at = monotonic()
+        elif state == CircuitState.HALF_OPEN:
+            self._probes_started = self._probes_succeeded = 0
+        else:
+            self._calls.clear()
+
+    def allow_request(self) -> bool:
+        if not self.enabled:
+            return True
+
+        with self._lock:
+            if self._state == CircuitState.OPEN and monotonic() - self._opened_at >= self.open_seconds:
+                self._set_state(CircuitState.HALF_OPEN)
+
+            if self._state == CircuitState.HALF_OPEN and self._probes_started < self.half_open_calls:
+                self._probes_started += 1
+                return True
+
+            return self._state == CircuitState.CLOSED
+
+    def record(self, *, failed: bool, duration: float) -> None:
+        if not self.enabled:
+            return
+
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                if failed or slow:
+                    self._set_state(CircuitState.OPEN)
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.half_open_calls:
+                        self._set_state(CircuitState.CLOSED)
+                return
+
+            self._calls.append((failed, slow))
+            if self._state == CircuitState.CLOSED and self._should_open():
+                self._set_state(CircuitState.OPEN)
+
+    def _should_open(self) -> bool:
+        calls = len(self._calls)
+        if calls < self.min_calls:
+            return False
+
+        failures = sum(failed for failed, _ in self._calls)
+        slow_calls = sum(slow for _, slow in self._calls)
+        return failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate
+
+    def call(self, func: Callable[[], T], is_failure: Callable[[T], bool]) -> T:
+        if not self.allow_request():
+            circuit_breaker_rejected_total.labels(service=self.service).inc()
+            raise CircuitOpenError(self.service)
+
+        start = perf_counter()
+        try:
+            result = func()
+        except BaseException:
+            # BaseExceptions too (e.g. gevent's Timeout), a half-open probe must always be recorded
+            self.record(failed=True, duration=perf_counter() - start)
+            raise
+
+        self.record(failed=is_failure(result), duration=perf_counter() - start)
+        return result
@@ -0,0 +1,60 @@
+from collections.abc import Callable, Hashable
+from threading import Event, Lock
+from typing import Generic, TypeVar
+
+from aquila.metrics import upstream_coalesced_requests_total
+
+T = TypeVar("T")
+
+
+class _InFlightCall(Generic[T]):
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result: T | None = None
+        self.error: BaseException | None = None
+
+
+class RequestCoalescer(Generic[T]):
+    """
+    Coalesce concurrent calls for the same key into a single call.
+
+    The first caller for a key runs the function, callers arriving while it is still running wait for it
+    and get the same result, or have the same exception raised.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._lock = Lock()
+        self._in_flight: dict[Hashable, _InFlightCall[T]] = {}
+
+    def call(self, key: Hashable, func: Callable[[], T], service: str | None = None) -> T:
+        if not self.enabled:
+            return func()
+
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            is_leader = in_flight is None
+            if in_flight is None:
+                in_flight = self._in_flight[key] = _InFlightCall()
+
+        if not is_leader:
+            # only the upstream services' calls are counted
+            if service is not None:
+                upstream_coalesced_requests_total.labels(service=service).inc()
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+
+            return in_flight.result  # type: ignore[return-value]
+
+        try:
+            in_flight.result = func()
+        except BaseException as ex:
+            in_flight.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+        return in_flight.result
@@ -0,0 +1,172 @@
+import gzip
+import zlib
+
+from collections.abc import Callable, Iterable, Iterator
+from threading import Lock
+from typing import NamedTuple
+
+from flask import Response, request
+
+from aquila.metrics import response_compressed_total, response_compression_ratio
+from aquila.settings import (
+    COMPRESSION_BROTLI_QUALITY,
+    COMPRESSION_ENABLED,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_MIN_SIZE,
+)
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# strongest settings, only used for the pages compressed once and then served many times
+PRECOMPRESSION_GZIP_LEVEL = 9
+PRECOMPRESSION_BROTLI_QUALITY = 11
+
+
+def available_encodings() -> tuple[str, ...]:
+    """Supported content encodings, in order of preference."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(body: bytes, encoding: str, *, precompress: bool = False) -> bytes:
+    if encoding == "br":
+        quality = PRECOMPRESSION_BROTLI_QUALITY if precompress else COMPRESSION_BROTLI_QUALITY
+        return brotli.compress(body, quality=quality)
+
+    return gzip.compress(body, compresslevel=PRECOMPRESSION_GZIP_LEVEL if precompress else COMPRESSION_GZIP_LEVEL)
+
+
+def compress_chunks(chunks: Iterable[str | bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a streamed body, flushing the compressor after each chunk so that it is sent straight away."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk.encode("utf-8") if isinstance(chunk, str) else chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+
+    # wbits 31: gzip header and trailer
+    compressobj = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        yield compressobj.compress(data) + compressobj.flush(zlib.Z_SYNC_FLUSH)
+    yield compressobj.flush()
+
+
+def negotiate_encoding() -> str | None:
+    """Preferred encoding among the ones accepted by the request's Accept-Encoding, None for identity."""
+    if not COMPRESSION_ENABLED:
+        return None
+
+    accepted = [encoding for encoding in available_encodings() if request.accept_encodings.quality(encoding) > 0]
+    return max(accepted, key=request.accept_encodings.quality, default=None)
+
+
+def observe_compression_ratio(encoding: str, size: int, compressed_size: int) -> None:
+    response_compression_ratio.labels(encoding=encoding).observe(compressed_size / size)
+
+
+def _set_encoding(response: Response, encoding: str | None) -> None:
+    response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+        # the strong etag of the identity body does not hold for its encoded bytes
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress a rendered html page with the encoding negotiated from Accept-Encoding.
+
+    Responses smaller than COMPRESSION_MIN_SIZE, not html or already negotiated are left as they are. Streamed
+    responses are compressed chunk by chunk as they are sent, whatever their size. A 304 gets the Vary header of
+    the 200 it stands for.
+    """
+    if response.status_code == 304:
+        response.vary.add("Accept-Encoding")
+        return response
+
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.mimetype != "text/html"
+        or "Content-Encoding" in response.headers
+        or "Accept-Encoding" in response.vary
+    ):
+        return response
+
+    if response.is_streamed:
+        if (encoding := negotiate_encoding()) is not None:
+            response.response = compress_chunks(response.response, encoding)
+            response_compressed_total.labels(encoding=encoding, source="streamed").inc()
+        _set_encoding(response, encoding)
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_SIZE or (encoding := negotiate_encoding()) is None:
+        response.vary.add("Accept-Encoding")
+        return response
+
+    compressed = compress(body, encoding)
+    observe_compression_ratio(encoding, len(body), len(compressed))
+    response_compressed_total.labels(encoding=encoding, source="dynamic").inc()
+    response.set_data(compressed)
+    _set_encoding(response, encoding)
+    return response
+
+
+class StaticPage(NamedTuple):
+    version: str
+    body: bytes
+    # encoding -> body compressed with it, only for pages of at least COMPRESSION_MIN_SIZE bytes
+    encoded: dict[str, bytes]
+
+
+class StaticPages:
+    """
+    Pages without per-request content (error pages), rendered and precompressed once per template version.
+
+    Pages are kept by name, a page is rendered again when its template version changes.
+    """
+
+    def __init__(self) -> None:
+        self._pages: dict[tuple[str, ...], StaticPage] = {}
+        self._lock = Lock()
+
+    def _build(self, version: str, render: Callable[[], str]) -> StaticPage:
+        body = render().encode("utf-8")
+        encoded = {}
+        if COMPRESSION_ENABLED and len(body) >= COMPRESSION_MIN_SIZE:
+            for encoding in available_encodings():
+                encoded[encoding] = compress(body, encoding, precompress=True)
+                observe_compression_ratio(encoding, len(body), len(encoded[encoding]))
+
+        return StaticPage(version=version, body=body, encoded=encoded)
+
+    def get(self, name: tuple[str, ...], version: str, render: Callable[[], str]) -> StaticPage:
+        page = self._pages.get(name)
+        if page is None or page.version != version:
+            with self._lock:
+                page = self._pages.get(name)
+                if page is None or page.version != version:
+                    page = self._pages[name] = self._build(version, render)
+
+        return page
+
+    def response(self, name: tuple[str, ...], version: str, render: Callable[[], str]) -> Response:
+        """Response for the page, in the precompressed encoding negotiated with the request if there is one."""
+        page = self.get(name, version, render)
+        encoding = negotiate_encoding() if page.encoded else None
+        response = Response(page.encoded[encoding] if encoding else page.body, mimetype="text/html")
+        if encoding:
+            response_compressed_total.labels(encoding=encoding, source="precompressed").inc()
+
+        _set_encoding(response, encoding)
+        return response
+
+
+static_pages = StaticPages()
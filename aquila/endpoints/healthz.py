@@ -1,14 +1,8 @@
-from typing import TYPE_CHECKING
-
-import requests
-
-from azure.storage.blob import BlobServiceClient
 from flask import Blueprint
 
-from aquila.settings import BLOB_CONTAINER, BLOB_STORAGE_DSN, POLARIS_HOST
-
-if TYPE_CHECKING:
-    from azure.storage.blob import BlobClient
+from aquila.blob_storage import template_loader
+from aquila.http_client import upstream_clients
+from aquila.readiness import readiness_checker
 
 bp = Blueprint("healthz", __name__)
 
@@ -20,21 +14,19 @@ def livez() -> tuple[dict, int]:
 
 @bp.get("/readyz")
 def readyz() -> tuple[dict, int]:
-    errors: dict = {}
-
-    try:
-        blob_name = "healthz"
-        blob_service_client: BlobServiceClient = BlobServiceClient.from_connection_string(BLOB_STORAGE_DSN)
-        blob: "BlobClient" = blob_service_client.get_blob_client(BLOB_CONTAINER, blob_name)
-        assert blob.exists(), "blob does not exists"  # noqa:  S101
-    except Exception as ex:  # noqa: BLE001
-        errors["azure-blob-storage"] = f"failed to retrieve '{blob_name}' from '{BLOB_CONTAINER}': {ex!r}"
-
-    try:
-        url = f"{POLARIS_HOST}/livez"
-        resp = requests.get(url, timeout=(3.05, 10))
-        resp.raise_for_status()
-    except Exception as ex:  # noqa: BLE001
-        errors["polaris-request"] = f"failed to contact polaris at {url}: {ex!r}"
-
-    return errors, 500 if errors else 200
+    result = readiness_checker.result()
+
+    # an open circuit or cold caches are reported but do not fail the probe, responses are still being served
+    circuit_breakers = {
+        service: client.circuit_breaker.state.name.lower() for service, client in upstream_clients.items()
+    }
+    warm = {
+        "templates": template_loader.is_warm,
+        "idle-connections": {service: client.idle_connections() for service, client in upstream_clients.items()},
+    }
+    return {
+        **result.errors,
+        "checked-seconds-ago": round(result.age, 3),
+        "circuit-breakers": circuit_breakers,
+        "warm": warm,
+    }, 500 if result.errors else 200
@@ -1,17 +1,15 @@
 from flask import Blueprint, Response
-from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 
-from aquila.settings import PROMETHEUS_MULTIPROC_DIR
+from aquila.multiprocess_metrics import MultiprocessMetrics
+from aquila.settings import METRICS_CACHE_SECONDS, PROMETHEUS_MULTIPROC_DIR
 
 bp = Blueprint("metrics", __name__)
+multiprocess_metrics = MultiprocessMetrics(PROMETHEUS_MULTIPROC_DIR or "", METRICS_CACHE_SECONDS)
 
 
 @bp.get("/metrics")
 def metrics() -> Response:
-    registry = REGISTRY
-    if PROMETHEUS_MULTIPROC_DIR:  # pragma: no cover
-        registry = CollectorRegistry()
-        multiprocess.MultiProcessCollector(registry)
-
+    exposition = multiprocess_metrics.exposition() if PROMETHEUS_MULTIPROC_DIR else generate_latest(REGISTRY)
     headers = {"Content-Type": CONTENT_TYPE_LATEST}
-    return Response(generate_latest(registry), status=200, headers=headers)
+    return Response(exposition, status=200, headers=headers)
@@ -1,21 +1,60 @@
+import hashlib
+import json
 import logging
 
 from datetime import datetime, timezone
 
-from flask import Blueprint, abort, render_template, request
-from flask.templating import render_template_string
+from flask import Blueprint, Response, abort, make_response, render_template, request
 
 from aquila.blob_storage import template_loader
-from aquila.fetch_reward import get_reward
-from aquila.metrics import reward_requests_total
+from aquila.compression import compress_response
+from aquila.fetch_reward import DEFAULT_TEMPLATE_VERSION, get_reward, reward_batches
+from aquila.metric_labels import retailer_label
+from aquila.metrics import reward_requests_total, template_render_seconds
+from aquila.settings import BATCH_MAX_REWARDS, REWARD_CACHE_CONTROL
+from aquila.streaming import stream_page, streamed_rendering
 
 bp = Blueprint("rewards", __name__, template_folder="templates")
+bp.after_request(compress_response)
 logger = logging.getLogger(__name__)
 
+# blob template slug of a retailer's reward list page
+REWARD_LIST_TEMPLATE_SLUG = "reward-list"
+# batch endpoint -> single reward endpoint of the same upstream service
+BATCH_REQUEST_PATHS = {"/rs": "/r", "/rewards": "/reward"}
+
+
+def format_expiry_date(expiry_date: str) -> str:
+    return datetime.strptime(expiry_date, "%Y-%m-%d").replace(tzinfo=timezone.utc).strftime("%d/%m/%Y")
+
+
+def reward_etag(reward_data: dict, template_slug: str, template_version: str) -> str:
+    """ETag of a rendered reward page, which only depends on the reward payload and the template rendering it."""
+    fingerprint = json.dumps([template_slug, template_version, reward_data], sort_keys=True, default=str)
+    return hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def cacheable_response(response: Response, etag: str) -> Response:
+    # weak, the etag stands for the rendered page whatever its encoding, so 200s and 304s carry the same one
+    response.set_etag(etag, weak=True)
+    if REWARD_CACHE_CONTROL:
+        response.headers["Cache-Control"] = REWARD_CACHE_CONTROL
+
+    return response
+
+
+@bp.after_request
+def prevent_caching_errors(response: Response) -> Response:
+    # only rendered rewards carry an ETag, error pages and 4xx responses must never be cached
+    if "ETag" not in response.headers:
+        response.headers["Cache-Control"] = "no-store"
+
+    return response
+
 
 @bp.get("/r")
 @bp.get("/reward")
-def reward() -> str:
+def reward() -> Response:
     """
     Fetch reward from either Polaris or Cosmos.
 
@@ -24,36 +63,112 @@ def reward() -> str:
 
     /r -> Fetch reward from Cosmos
     /reward -> Fetch reward from Polaris
+
+    Rendered rewards carry an ETag, a conditional request matching it gets a 304 without rendering the page,
+    and without calling Polaris or Cosmos when the reward is in the reward cache.
     """
     retailer_slug: str | None = request.args.get("retailer")
     reward_id: str | None = request.args.get("reward")
     if not (retailer_slug and reward_id):
         logger.info("Missing required query params. Info: retailer: '%s', reward: '%s'", retailer_slug, reward_id)
         reward_requests_total.labels(
-            retailer_slug=retailer_slug or "N/A",
+            retailer_slug=retailer_label(retailer_slug),
             response_status=400,
             response_template="N/A",
         ).inc()
         abort(400)
 
     reward_data = get_reward(retailer_slug, reward_id, request.path)
-    reward_data.update(
-        {
-            "expiry_date": datetime.strptime(reward_data["expiry_date"], "%Y-%m-%d")
-            .replace(tzinfo=timezone.utc)
-            .strftime("%d/%m/%Y")
-        }
-    )
+    reward_data.update({"expiry_date": format_expiry_date(reward_data["expiry_date"])})
     template_slug: str = reward_data.pop("template_slug", "N/A")
+    blob_template = template_loader.lookup_template(retailer_slug, template_slug)
+    response_template = template_slug if blob_template else "default"
+    etag = reward_etag(
+        reward_data, response_template, blob_template.checksum if blob_template else DEFAULT_TEMPLATE_VERSION
+    )
 
-    if template := template_loader.get_template(retailer_slug, template_slug):
-        logger.debug("rendering template from blob storage")
+    if request.if_none_match.contains_weak(etag):
+        logger.debug("reward not modified, etag: %s", etag)
         reward_requests_total.labels(
-            retailer_slug=retailer_slug, response_status=200, response_template=template_slug
+            retailer_slug=retailer_label(retailer_slug), response_status=304, response_template=response_template
         ).inc()
-        # deepcode ignore XSS: source is a trusted internal tool
-        return render_template_string(template, **reward_data)
+        return cacheable_response(Response(status=304), etag)
+
+    reward_requests_total.labels(
+        retailer_slug=retailer_label(retailer_slug), response_status=200, response_template=response_template
+    ).inc()
+    if blob_template:
+        logger.debug("rendering template from blob storage")
+        template = template_loader.compiled_template(retailer_slug, template_slug, blob_template)
+        if streamed_rendering(retailer_slug):
+            return cacheable_response(
+                stream_page(template, reward_data, source="blob", retailer_slug=retailer_slug), etag
+            )
+
+        with template_render_seconds.labels(source="blob").time():
+            # deepcode ignore XSS: source is a trusted internal tool
+            return cacheable_response(make_response(render_template(template, **reward_data)), etag)
 
     logger.debug("template not found for '%s' falling back to default.html", template_slug)
-    reward_requests_total.labels(retailer_slug=retailer_slug, response_status=200, response_template="default").inc()
-    return render_template("default.html", **reward_data)
+    if streamed_rendering(retailer_slug):
+        return cacheable_response(
+            stream_page("default.html", reward_data, source="default", retailer_slug=retailer_slug), etag
+        )
+
+    with template_render_seconds.labels(source="default").time():
+        return cacheable_response(make_response(render_template("default.html", **reward_data)), etag)
+
+
+@bp.get("/rs")
+@bp.get("/rewards")
+def rewards() -> Response:
+    """
+    Render several rewards of a retailer, given as repeated `reward` query params, in a single page.
+
+    /rs -> Fetch rewards from Cosmos
+    /rewards -> Fetch rewards from Polaris
+
+    The rewards are fetched concurrently with the same caching and error handling as /reward and rendered with the
+    retailer's reward list template, or default_reward_list.html. Rewards which are not found or can not be fetched
+    are listed as unavailable without failing the page.
+    """
+    retailer_slug: str | None = request.args.get("retailer")
+    reward_ids = list(dict.fromkeys(request.args.getlist("reward")))
+    if not (retailer_slug and reward_ids) or len(reward_ids) > BATCH_MAX_REWARDS:
+        logger.info("Invalid batch query params. Info: retailer: '%s', rewards: %d", retailer_slug, len(reward_ids))
+        reward_requests_total.labels(
+            retailer_slug=retailer_label(retailer_slug),
+            response_status=400,
+            response_template="N/A",
+        ).inc()
+        abort(400)
+
+    rewards_data = []
+    unavailable_rewards = []
+    for result in reward_batches.fetch(retailer_slug, reward_ids, BATCH_REQUEST_PATHS[request.path]):
+        if result.payload is None:
+            unavailable_rewards.append(result.reward_id)
+            continue
+
+        reward_data = {key: value for key, value in result.payload.items() if key != "template_slug"}
+        reward_data.update(
+            {"reward_id": result.reward_id, "expiry_date": format_expiry_date(reward_data["expiry_date"])}
+        )
+        rewards_data.append(reward_data)
+
+    list_template = template_loader.lookup_template(retailer_slug, REWARD_LIST_TEMPLATE_SLUG)
+    response_template = REWARD_LIST_TEMPLATE_SLUG if list_template else "default_reward_list"
+    if rewards_data:
+        reward_requests_total.labels(
+            retailer_slug=retailer_label(retailer_slug), response_status=200, response_template=response_template
+        ).inc(len(rewards_data))
+
+    context = {"rewards": rewards_data, "unavailable_rewards": unavailable_rewards}
+    if list_template:
+        template = template_loader.compiled_template(retailer_slug, REWARD_LIST_TEMPLATE_SLUG, list_template)
+        with template_render_seconds.labels(source="blob").time():
+            # deepcode ignore XSS: source is a trusted internal tool
+            return make_response(render_template(template, **context))
+
+    with template_render_seconds.labels(source="default").time():
+        return make_response(render_template("default_reward_list.html", **context))
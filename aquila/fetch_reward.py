@@ -1,32 +1,131 @@
 import logging
 
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from threading import Lock, Semaphore
+from time import monotonic, perf_counter
+from typing import NamedTuple, NoReturn
+
 import requests
 
-from flask import Response, abort, render_template, render_template_string
+from flask import Response, abort, render_template
 
+from aquila._version import __version__
+from aquila.admission import AdmissionRejectedError
 from aquila.blob_storage import template_loader
-from aquila.metrics import reward_requests_total
-from aquila.settings import COSMOS_BASE_URL, POLARIS_BASE_URL
+from aquila.circuit_breaker import CircuitOpenError
+from aquila.coalescing import RequestCoalescer
+from aquila.compression import static_pages
+from aquila.http_client import UpstreamClient, cosmos_client, polaris_client
+from aquila.metric_labels import retailer_label
+from aquila.metrics import (
+    batch_reward_results_total,
+    reward_requests_total,
+    template_render_seconds,
+    upstream_request_seconds,
+)
+from aquila.reward_cache import CachedReward, reward_cache
+from aquila.settings import (
+    ADMISSION_RETRY_AFTER,
+    ADMISSION_SHED_RESPONSE,
+    BATCH_CONCURRENCY,
+    BATCH_TIMEOUT,
+    COSMOS_BASE_URL,
+    POLARIS_BASE_URL,
+    REWARD_REQUEST_COALESCING,
+)
 
 logger = logging.getLogger(__name__)
+# high volume, can be sampled with LOG_SAMPLING
+negative_response_logger = logging.getLogger(f"{__name__}.negative_responses")
+upstream_requests: RequestCoalescer[requests.Response] = RequestCoalescer(enabled=REWARD_REQUEST_COALESCING)
+
+# packaged templates only change with a new release
+DEFAULT_TEMPLATE_VERSION = f"default-{__version__}"
 
 
-def raise_template_error_response(retailer_slug: str) -> None:
-    error_template = template_loader.get_template(retailer_slug, "error")
-    if error_template:
-        resp = Response(render_template_string(error_template))
-        reward_requests_total.labels(retailer_slug=retailer_slug, response_status=200, response_template="error").inc()
+def raise_template_error_response(retailer_slug: str) -> NoReturn:
+    """Abort with the retailer's error page, error pages are rendered and compressed once per template version."""
+    if error_template := template_loader.lookup_template(retailer_slug, "error"):
+        with template_render_seconds.labels(source="blob").time():
+            resp = static_pages.response(
+                ("blob", retailer_slug, "error"),
+                error_template.checksum,
+                lambda: render_template(template_loader.compiled_template(retailer_slug, "error", error_template)),
+            )
+        reward_requests_total.labels(
+            retailer_slug=retailer_label(retailer_slug), response_status=200, response_template="error"
+        ).inc()
     else:
-        resp = Response(render_template("default_error.html"))
+        with template_render_seconds.labels(source="default").time():
+            resp = static_pages.response(
+                ("default_error",), DEFAULT_TEMPLATE_VERSION, lambda: render_template("default_error.html")
+            )
         reward_requests_total.labels(
-            retailer_slug=retailer_slug, response_status=200, response_template="default_error"
+            retailer_slug=retailer_label(retailer_slug), response_status=200, response_template="default_error"
         ).inc()
 
     abort(resp)
 
 
-def get_reward(retailer_slug: str, reward_id: str, request_path: str) -> dict:
+class RewardNotFoundError(Exception):
+    pass
+
+
+class RewardUnavailableError(Exception):
+    """The reward could not be fetched and there is no stale copy of it to serve."""
+
+
+class RewardShedError(RewardUnavailableError):
+    """The request was shed by the admission limit, to be answered with a 503 (ADMISSION_SHED_RESPONSE=unavailable)."""
+
+
+def serve_stale_or_raise(retailer_slug: str, reward_id: str, service: str, cached: CachedReward | None) -> dict:
+    if cached is None:
+        raise RewardUnavailableError(f"reward unavailable from {service}")
+
+    logger.warning("serving stale reward for retailer '%s' after a failed request to %s", retailer_slug, service)
+    reward_cache.served_stale((service, retailer_slug, reward_id))
+    return cached.payload
+
+
+def shed_or_serve_stale(retailer_slug: str, reward_id: str, service: str, cached: CachedReward | None) -> dict:
+    if cached is None and ADMISSION_SHED_RESPONSE == "unavailable":
+        raise RewardShedError(f"request to {service} shed")
+
+    return serve_stale_or_raise(retailer_slug, reward_id, service, cached)
+
+
+def timed_get(client: UpstreamClient, url: str) -> requests.Response:
+    start = perf_counter()
+    status_class = "error"
+    try:
+        response = client.get(url)
+        status_class = f"{response.status_code // 100}xx"
+    finally:
+        upstream_request_seconds.labels(service=client.service, status_class=status_class).observe(
+            perf_counter() - start
+        )
+
+    return response
+
+
+def request_reward(client: UpstreamClient, url: str) -> requests.Response:
+    # a shed request is rejected before reaching the circuit breaker, it does not count as an upstream failure
+    return client.admission.call(
+        lambda: client.circuit_breaker.call(
+            lambda: client.hedger.call(lambda: timed_get(client, url)), lambda response: response.status_code >= 500
+        )
+    )
+
+
+def fetch_reward_payload(retailer_slug: str, reward_id: str, request_path: str) -> dict:
     """
+    Fetch a reward from the reward cache or the upstream service of `request_path`, serving a stale cached
+    reward when the upstream request fails.
+
+    Raises RewardNotFoundError or RewardUnavailableError, nothing is rendered or counted in reward_requests_total.
+
     expected response payload from polaris/cosmos will be:
     ```json
     {
@@ -38,30 +137,145 @@ def get_reward(retailer_slug: str, reward_id: str, request_path: str) -> dict:
     """
     match request_path:
         case "/r":
-            service = "cosmos"
+            client = cosmos_client
             base_url = COSMOS_BASE_URL
         case "/reward":
-            service = "polaris"
+            client = polaris_client
             base_url = POLARIS_BASE_URL
 
+    service = client.service
+    cache_key = (service, retailer_slug, reward_id)
+    cached = reward_cache.get(cache_key)
+    if cached and cached.fresh:
+        return cached.payload
+
+    url = f"{base_url}/{retailer_slug}/reward/{reward_id}"
     try:
-        response = requests.get(f"{base_url}/{retailer_slug}/reward/{reward_id}", timeout=(3.05, 10))
+        response = upstream_requests.call(cache_key, lambda: request_reward(client, url), service)
+    except AdmissionRejectedError:
+        logger.warning("too many concurrent requests to %s, shedding the request", service)
+        return shed_or_serve_stale(retailer_slug, reward_id, service, cached)
+    except CircuitOpenError:
+        logger.warning("circuit for %s is open, not sending the request", service)
+        return serve_stale_or_raise(retailer_slug, reward_id, service, cached)
     except Exception:  # pylint: disable=broad-except
         logger.exception(f"Unable to reach {service}")
-        raise_template_error_response(retailer_slug)
+        return serve_stale_or_raise(retailer_slug, reward_id, service, cached)
 
     if response.status_code != 200:
-        logger.info(
+        negative_response_logger.info(
             f"Received a negative response from {service}. Info: status: %d, response: %s",
             response.status_code,
             response.text,
         )
         if response.status_code == 404:
-            reward_requests_total.labels(
-                retailer_slug=retailer_slug, response_status=404, response_template="N/A"
-            ).inc()
-            abort(404)
+            reward_cache.pop(cache_key)
+            raise RewardNotFoundError(f"reward not found by {service}")
 
+        return serve_stale_or_raise(retailer_slug, reward_id, service, cached)
+
+    payload = response.json()
+    reward_cache.set(cache_key, payload)
+    return payload
+
+
+def get_reward(retailer_slug: str, reward_id: str, request_path: str) -> dict:
+    """Fetch a reward for a reward page, aborting with the response and metrics of a reward that can not be shown."""
+    try:
+        return fetch_reward_payload(retailer_slug, reward_id, request_path)
+    except RewardNotFoundError:
+        reward_requests_total.labels(
+            retailer_slug=retailer_label(retailer_slug), response_status=404, response_template="N/A"
+        ).inc()
+        abort(404)
+    except RewardShedError:
+        reward_requests_total.labels(
+            retailer_slug=retailer_label(retailer_slug), response_status=503, response_template="N/A"
+        ).inc()
+        abort(Response(status=503, headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}))
+    except RewardUnavailableError:
         raise_template_error_response(retailer_slug)
 
-    return response.json()
+
+class RewardResult(NamedTuple):
+    reward_id: str
+    # ok, not_found or error
+    result: str
+    payload: dict | None = None
+
+
+class RewardBatchFetcher:
+    """
+    Fetch several rewards of a retailer concurrently from a thread pool shared by the requests of a worker.
+
+    Each reward goes through `fetch_reward_payload`, with its caching, coalescing and stale rewards, which needs
+    no request context. A reward that is not found or can not be fetched does not fail the others.
+    A batch has at most `max_workers` rewards submitted to the pool at a time, so that it does not queue all of
+    its rewards ahead of the other batches, and rewards not fetched within `timeout` seconds are errors.
+    """
+
+    def __init__(self, max_workers: int, timeout: float) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = Lock()
+
+    def after_fork(self) -> None:
+        """Forget the parent's thread pool, a new one is created by the next batch."""
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="reward-batch")
+
+        return self._executor
+
+    @staticmethod
+    def _fetch_one(retailer_slug: str, reward_id: str, request_path: str) -> RewardResult:
+        try:
+            return RewardResult(reward_id, "ok", fetch_reward_payload(retailer_slug, reward_id, request_path))
+        except RewardNotFoundError:
+            return RewardResult(reward_id, "not_found")
+        except RewardUnavailableError:
+            return RewardResult(reward_id, "error")
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("failed to fetch reward '%s' of retailer '%s'", reward_id, retailer_slug)
+            return RewardResult(reward_id, "error")
+
+    @staticmethod
+    def _result(
+        retailer_slug: str, reward_id: str, future: Future[RewardResult] | None, deadline: float
+    ) -> RewardResult:
+        if future is not None:
+            try:
+                return future.result(timeout=max(deadline - monotonic(), 0))
+            except TimeoutError:
+                # the request is left to finish, or dropped if it has not started yet
+                future.cancel()
+
+        logger.warning("reward '%s' of retailer '%s' not fetched before the batch timeout", reward_id, retailer_slug)
+        return RewardResult(reward_id, "error")
+
+    def fetch(self, retailer_slug: str, reward_ids: list[str], request_path: str) -> list[RewardResult]:
+        executor = self._get_executor()
+        deadline = monotonic() + self.timeout
+        slots = Semaphore(min(self.max_workers, len(reward_ids)))
+        futures: dict[str, Future[RewardResult]] = {}
+        for reward_id in reward_ids:
+            if not slots.acquire(timeout=max(deadline - monotonic(), 0)):
+                break
+
+            future = executor.submit(partial(self._fetch_one, retailer_slug, reward_id, request_path))
+            future.add_done_callback(lambda _: slots.release())
+            futures[reward_id] = future
+
+        results = [self._result(retailer_slug, reward_id, futures.get(reward_id), deadline) for reward_id in reward_ids]
+        for result in results:
+            batch_reward_results_total.labels(retailer_slug=retailer_label(retailer_slug), result=result.result).inc()
+
+        return results
+
+
+reward_batches = RewardBatchFetcher(BATCH_CONCURRENCY, BATCH_TIMEOUT)
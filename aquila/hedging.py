@@ -0,0 +1,155 @@
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from threading import Lock
+from time import perf_counter
+from typing import TypeVar
+
+from aquila.admission import AdmissionLimiter
+from aquila.metrics import upstream_hedges_total
+from aquila.settings import (
+    HEDGE_BUDGET,
+    HEDGE_DELAY,
+    HEDGE_DELAY_PERCENTILE,
+    HEDGE_MAX_WORKERS,
+    HEDGING_ENABLED,
+)
+
+T = TypeVar("T")
+
+# recent latencies of the first attempts the hedge delay percentile is computed from
+LATENCY_WINDOW_SIZE = 200
+# latencies observed before the percentile replaces the configured hedge delay
+MIN_LATENCY_SAMPLES = 20
+
+
+class Hedger:
+    """
+    Hedged calls of an idempotent upstream request.
+
+    The request is sent from a pool of `max_workers` threads, if it has not completed after the hedge delay a second
+    identical request is sent and the first one to succeed wins, the other one is left to finish in the background.
+    A request still queued after the hedge delay is sent from the caller's thread instead, without a hedge. The
+    delay and the latencies run from the start of an attempt, time spent queued in the pool is left out.
+    The delay is the `delay_percentile` percentile of the recent first attempts' latencies, or `delay` until
+    enough of them were observed or if `delay_percentile` is 0. Every call adds `budget` to a budget of hedges,
+    capped to `max_budget`, and every hedge takes 1 from it, so hedges stay under a `budget` fraction of the calls.
+    A hedge also takes a slot of `admission`, held until both attempts finished, so that the attempts left running
+    after the call returned still count against the service's concurrency limit. No hedge is sent without a slot.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        service: str,
+        *,
+        enabled: bool = HEDGING_ENABLED,
+        delay: float = HEDGE_DELAY,
+        delay_percentile: float = HEDGE_DELAY_PERCENTILE,
+        budget: float = HEDGE_BUDGET,
+        max_budget: float = 10,
+        max_workers: int = HEDGE_MAX_WORKERS,
+        admission: AdmissionLimiter | None = None,
+    ) -> None:
+        self.service = service
+        self.enabled = enabled
+        self.delay = delay
+        self.delay_percentile = delay_percentile
+        self.budget = budget
+        self.max_budget = max_budget
+        self.max_workers = max_workers
+        self.admission = admission
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW_SIZE)
+        self._lock = Lock()
+        self._available_budget = 0.0
+        self._executor: ThreadPoolExecutor | None = None
+
+    def after_fork(self) -> None:
+        """Forget the parent's thread pool, a new one is created by the next call."""
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f"hedge-{self.service}")
+
+        return self._executor
+
+    def hedge_delay(self) -> float:
+        if self.delay_percentile <= 0 or len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return self.delay
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.delay_percentile / 100))]
+
+    def _record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._available_budget < 1:
+                return False
+
+            self._available_budget -= 1
+            return True
+
+    def call(self, func: Callable[[], T]) -> T:
+        if not self.enabled:
+            return func()
+
+        with self._lock:
+            self._available_budget = min(self._available_budget + self.budget, self.max_budget)
+
+        started_at: list[float] = []
+
+        def first_attempt() -> T:
+            started_at.append(perf_counter())
+            try:
+                return func()
+            finally:
+                self._record_latency(perf_counter() - started_at[0])
+
+        executor = self._get_executor()
+        delay = self.hedge_delay()
+        first: Future[T] = executor.submit(first_attempt)
+        if wait([first], timeout=delay).done:
+            return first.result()
+
+        if first.cancel():
+            # still queued behind max_workers busy attempts, sent from the caller's thread without hedging
+            upstream_hedges_total.labels(service=self.service, result="no_capacity").inc()
+            return first_attempt()
+
+        # the hedge delay runs from the start of the first attempt, not from its submission to the pool
+        remaining = (started_at[0] if started_at else perf_counter()) + delay - perf_counter()
+        if remaining > 0 and wait([first], timeout=remaining).done:
+            return first.result()
+
+        return self._hedge(executor, func, first)
+
+    def _hedge(self, executor: ThreadPoolExecutor, func: Callable[[], T], first: Future[T]) -> T:
+        # the first attempt is running, waiting for it is bounded by the upstream timeouts
+        if not self._take_budget():
+            upstream_hedges_total.labels(service=self.service, result="no_budget").inc()
+            return first.result()
+
+        if self.admission is not None and not self.admission.try_acquire():
+            upstream_hedges_total.labels(service=self.service, result="no_capacity").inc()
+            return first.result()
+
+        upstream_hedges_total.labels(service=self.service, result="sent").inc()
+        hedge = executor.submit(func)
+        if self.admission is not None:
+            # released once both attempts are done, a callback added to a done future is run at once
+            admission = self.admission
+            hedge.add_done_callback(lambda _: first.add_done_callback(lambda _: admission.release()))
+        for future in as_completed((first, hedge)):
+            if future.exception() is None:
+                if future is hedge:
+                    upstream_hedges_total.labels(service=self.service, result="won").inc()
+                return future.result()
+
+        # both attempts failed
+        return first.result()
@@ -0,0 +1,102 @@
+from typing import Any
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from aquila.admission import AdmissionLimiter
+from aquila.circuit_breaker import CircuitBreaker
+from aquila.hedging import Hedger
+from aquila.metrics import upstream_new_connections_total, upstream_requests_total
+from aquila.settings import (
+    COSMOS_CONNECT_TIMEOUT,
+    COSMOS_MAX_CONCURRENT_REQUESTS,
+    COSMOS_READ_TIMEOUT,
+    HTTP_KEEP_ALIVE,
+    HTTP_POOL_MAXSIZE,
+    POLARIS_CONNECT_TIMEOUT,
+    POLARIS_MAX_CONCURRENT_REQUESTS,
+    POLARIS_READ_TIMEOUT,
+)
+
+
+def _counting_pool_class(base: type[HTTPConnectionPool], service: str) -> type[HTTPConnectionPool]:
+    class CountingConnectionPool(base):  # type: ignore[valid-type, misc]
+        def _new_conn(self) -> Any:  # noqa: ANN401
+            upstream_new_connections_total.labels(service=service).inc()
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that records every new connection opened by its connection pools."""
+
+    def __init__(self, service: str, **kwargs: Any) -> None:  # noqa: ANN401
+        self.service = service
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:  # noqa: ANN401
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.service),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.service),
+        }
+
+
+class UpstreamClient:
+    """
+    Keep-alive http client for a single upstream service.
+
+    One instance is shared by all the threads of a worker, connections are kept in the adapter's
+    urllib3 pool (which is thread-safe) and reused between requests.
+    """
+
+    def __init__(self, service: str, connect_timeout: float, read_timeout: float, max_concurrent: int = 0) -> None:
+        self.service = service
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self._build_session()
+        self.circuit_breaker = CircuitBreaker(service)
+        self.admission = AdmissionLimiter(service, max_concurrent=max_concurrent)
+        self.hedger = Hedger(service, admission=self.admission)
+
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        self.adapter = adapter = PooledHTTPAdapter(self.service, pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not HTTP_KEEP_ALIVE:
+            session.headers["Connection"] = "close"
+
+        return session
+
+    def after_fork(self) -> None:
+        """Replace the session, a forked worker must not reuse the connections opened by its parent."""
+        self.session = self._build_session()
+        self.hedger.after_fork()
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:  # noqa: ANN401
+        kwargs.setdefault("timeout", self.timeout)
+        upstream_requests_total.labels(service=self.service).inc()
+        return self.session.get(url, **kwargs)
+
+    def idle_connections(self) -> int:
+        """Number of open connections currently kept in the pools, ready to be reused."""
+        pools = self.adapter.poolmanager.pools
+        idle = 0
+        for key in pools.keys():  # noqa: SIM118
+            pool = pools.get(key)
+            if pool is not None and pool.pool is not None:
+                # the pool queue is filled with None placeholders for the connections not opened yet
+                idle += sum(conn is not None for conn in list(pool.pool.queue))
+
+        return idle
+
+
+polaris_client = UpstreamClient(
+    "polaris", POLARIS_CONNECT_TIMEOUT, POLARIS_READ_TIMEOUT, POLARIS_MAX_CONCURRENT_REQUESTS
+)
+cosmos_client = UpstreamClient("cosmos", COSMOS_CONNECT_TIMEOUT, COSMOS_READ_TIMEOUT, COSMOS_MAX_CONCURRENT_REQUESTS)
+
+upstream_clients = {client.service: client for client in (polaris_client, cosmos_client)}
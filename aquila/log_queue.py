@@ -0,0 +1,117 @@
+import atexit
+import copy
+import logging
+
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from threading import Lock
+from typing import cast
+
+from aquila.metrics import log_records_dropped_total
+from aquila.settings import LOG_QUEUE_FULL_POLICY, LOG_QUEUE_SIZE
+
+_exception_formatter = logging.Formatter()
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Queue records for a QueueListener, which formats them with the replaced handlers' formatters.
+
+    When the queue is full records are dropped and counted, or with `block` the logging thread waits for room.
+    """
+
+    def __init__(self, queue: Queue, block: bool) -> None:
+        super().__init__(queue)
+        self.block = block
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Return a copy of the record with its message and exception text resolved in the logging thread.
+
+        Unlike QueueHandler.prepare the record is not formatted, the traceback stays out of `msg`, so that the
+        listener's handlers write the same output as without the queue.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            # the traceback holds the frames, and so every local variable, of the logging thread
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        queue = cast(Queue, self.queue)
+        if self.block:
+            queue.put(record)
+            return
+
+        try:
+            queue.put_nowait(record)
+        except Full:
+            log_records_dropped_total.inc()
+
+
+class LogQueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # wait for the listener to make room instead of failing when the queue is full, None is the stop sentinel
+        cast(Queue, self.queue).put(None)
+
+
+class QueueLogging:
+    """
+    Move the formatting and writing of log records to a background thread.
+
+    `start` replaces the handlers of the given loggers, which must share the same handlers, with a LogQueueHandler
+    and starts a listener thread passing the queued records to the replaced handlers. `stop`, also run at exit,
+    writes the queued records and restores the handlers.
+    """
+
+    def __init__(self, logger_names: tuple[str, ...], maxsize: int, block: bool) -> None:
+        self.logger_names = logger_names
+        self.maxsize = maxsize
+        self.block = block
+        self.handler: LogQueueHandler | None = None
+        self._listener: LogQueueListener | None = None
+        self._replaced_handlers: dict[logging.Logger, list[logging.Handler]] = {}
+        self._lock = Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._listener is not None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._listener is not None:
+                return
+
+            queue: Queue[logging.LogRecord] = Queue(self.maxsize)
+            self.handler = LogQueueHandler(queue, block=self.block)
+            targets: dict[logging.Handler, None] = {}
+            for logger_name in self.logger_names:
+                logger = logging.getLogger(logger_name)
+                self._replaced_handlers[logger] = logger.handlers
+                targets.update(dict.fromkeys(logger.handlers))
+                logger.handlers = [self.handler]
+
+            self._listener = LogQueueListener(queue, *targets, respect_handler_level=True)
+            self._listener.start()
+            atexit.register(self.stop)
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._listener is None:
+                return
+
+            for logger, handlers in self._replaced_handlers.items():
+                logger.handlers = handlers
+
+            self._listener.stop()
+            self._listener = None
+            self.handler = None
+            self._replaced_handlers = {}
+            atexit.unregister(self.stop)
+
+
+queue_logging = QueueLogging(("root", "template-loader"), LOG_QUEUE_SIZE, block=LOG_QUEUE_FULL_POLICY == "block")
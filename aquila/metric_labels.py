@@ -0,0 +1,23 @@
+from aquila.blob_storage import template_loader
+from aquila.metrics import metric_label_rejected_total
+from aquila.settings import METRICS_RETAILER_SLUGS
+
+OTHER_LABEL = "other"
+ALLOWED_RETAILER_SLUGS = frozenset(METRICS_RETAILER_SLUGS)
+
+
+def retailer_label(retailer_slug: str | None) -> str:
+    """
+    Return the retailer_slug label value for a retailer slug coming from the request.
+
+    Only retailers with templates in blob storage or listed in METRICS_RETAILER_SLUGS are used as label
+    values, anything else is folded into "other" so that user input can not create new time series.
+    """
+    if not retailer_slug:
+        return "N/A"
+
+    if retailer_slug in ALLOWED_RETAILER_SLUGS or template_loader.has_retailer(retailer_slug):
+        return retailer_slug
+
+    metric_label_rejected_total.labels(label="retailer_slug").inc()
+    return OTHER_LABEL
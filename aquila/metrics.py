@@ -1,4 +1,6 @@
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge, Histogram
+
+from aquila.settings import REQUEST_LATENCY_BUCKETS, TEMPLATE_LATENCY_BUCKETS, UPSTREAM_LATENCY_BUCKETS
 
 METRIC_NAME_PREFIX = "bpl_"
 
@@ -7,3 +9,206 @@ reward_requests_total = Counter(
     documentation="Total /reward http requests by response status, response template, and retailer slug.",
     labelnames=("retailer_slug", "response_status", "response_template"),
 )
+
+reward_cache_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}reward_cache_total",
+    documentation="Total reward cache lookups by service and result (hit, stale, miss), and stale entries served "
+    "because the upstream failed (stale_served).",
+    labelnames=("service", "result"),
+)
+
+template_compile_cache_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}template_compile_cache_total",
+    documentation="Total compiled blob template cache lookups by result (hit or miss).",
+    labelnames=("result",),
+)
+
+template_compile_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}template_compile_seconds",
+    documentation="Time spent compiling blob templates into jinja2 Template objects.",
+    buckets=TEMPLATE_LATENCY_BUCKETS,
+)
+
+template_lookup_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}template_lookup_seconds",
+    documentation="Time spent looking up blob templates, by whether the lookup tried reloading from blob storage.",
+    labelnames=("reload",),
+    buckets=TEMPLATE_LATENCY_BUCKETS,
+)
+
+template_render_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}template_render_seconds",
+    documentation="Time spent rendering reward pages, by template source (blob or default).",
+    labelnames=("source",),
+    buckets=TEMPLATE_LATENCY_BUCKETS,
+)
+
+template_stream_failures_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}template_stream_failures_total",
+    documentation="Total streamed reward pages cut short by an error after their head was sent, by retailer and "
+    "template source (blob or default).",
+    labelnames=("retailer_slug", "source"),
+)
+
+upstream_request_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}upstream_request_seconds",
+    documentation="Time spent on reward requests to upstream services, by service and status class.",
+    labelnames=("service", "status_class"),
+    buckets=UPSTREAM_LATENCY_BUCKETS,
+)
+
+http_request_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}http_request_seconds",
+    documentation="End to end time spent handling http requests, by url rule and response status. Streamed pages are "
+    "timed until their head is rendered, the rest of their rendering is in template_render_seconds.",
+    labelnames=("endpoint", "response_status"),
+    buckets=REQUEST_LATENCY_BUCKETS,
+)
+
+upstream_requests_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}upstream_requests_total",
+    documentation="Total http requests sent to upstream services through the pooled client, by service.",
+    labelnames=("service",),
+)
+
+upstream_new_connections_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}upstream_new_connections_total",
+    documentation="Total new connections opened to upstream services, by service. Requests minus new connections "
+    "are requests served over a reused keep-alive connection.",
+    labelnames=("service",),
+)
+
+template_sync_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}template_sync_seconds",
+    documentation="Time spent syncing templates from blob storage.",
+)
+
+template_sync_blobs_changed_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}template_sync_blobs_changed_total",
+    documentation="Total template blobs downloaded or dropped by template syncs, by change type.",
+    labelnames=("change",),
+)
+
+template_initial_load_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}template_initial_load_seconds",
+    documentation="Time spent loading all templates from blob storage when a worker starts.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+upstream_coalesced_requests_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}upstream_coalesced_requests_total",
+    documentation="Total reward requests that waited on an identical in-flight upstream request, by service.",
+    labelnames=("service",),
+)
+
+circuit_breaker_state = Gauge(
+    name=f"{METRIC_NAME_PREFIX}circuit_breaker_state",
+    documentation="Upstream circuit breaker state by service (0 closed, 1 half-open, 2 open), max across workers.",
+    labelnames=("service",),
+    multiprocess_mode="livemax",
+)
+
+circuit_breaker_rejected_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}circuit_breaker_rejected_total",
+    documentation="Total upstream requests not sent because the service's circuit breaker was open, by service.",
+    labelnames=("service",),
+)
+
+metric_label_rejected_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}metric_label_rejected_total",
+    documentation="Total metric label values replaced with 'other' because they were not allowed, by label name.",
+    labelnames=("label",),
+)
+
+metrics_scrape_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}metrics_scrape_seconds",
+    documentation="Time spent aggregating the multiprocess metrics for /metrics, cached responses excluded.",
+    buckets=REQUEST_LATENCY_BUCKETS,
+)
+
+metrics_compacted_files_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}metrics_compacted_files_total",
+    documentation="Total multiprocess metrics db files of dead workers compacted into the archive files.",
+)
+
+readiness_check_seconds = Histogram(
+    name=f"{METRIC_NAME_PREFIX}readiness_check_seconds",
+    documentation="Time spent by the background readiness checks on each dependency, by check.",
+    labelnames=("check",),
+    buckets=UPSTREAM_LATENCY_BUCKETS,
+)
+
+template_cache_bytes = Gauge(
+    name=f"{METRIC_NAME_PREFIX}template_cache_bytes",
+    documentation="Size of the templates content held by the lazily loaded template cache, summed across workers.",
+    multiprocess_mode="livesum",
+)
+
+template_cache_evictions_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}template_cache_evictions_total",
+    documentation="Total retailers evicted from the lazily loaded template cache to stay within its byte budget.",
+)
+
+template_syncs_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}template_syncs_total",
+    documentation="Total template syncs by source, blob storage or the on-disk snapshot written by another worker.",
+    labelnames=("source",),
+)
+
+template_bytecode_cache_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}template_bytecode_cache_total",
+    documentation="Total blob template compilations by jinja bytecode cache result (hit or miss).",
+    labelnames=("result",),
+)
+
+response_compressed_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}response_compressed_total",
+    documentation="Total compressed html responses by encoding and source (dynamic, streamed or precompressed).",
+    labelnames=("encoding", "source"),
+)
+
+response_compression_ratio = Histogram(
+    name=f"{METRIC_NAME_PREFIX}response_compression_ratio",
+    documentation="Compressed over uncompressed size of compressed pages, precompressed pages counted once.",
+    labelnames=("encoding",),
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0),
+)
+
+log_records_dropped_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}log_records_dropped_total",
+    documentation="Total log records dropped because the background logging queue was full.",
+)
+
+admission_in_flight = Gauge(
+    name=f"{METRIC_NAME_PREFIX}admission_in_flight",
+    documentation="Upstream requests admitted by the per-service concurrency limit and not finished yet, by service.",
+    labelnames=("service",),
+    multiprocess_mode="livesum",
+)
+
+admission_queue_depth = Gauge(
+    name=f"{METRIC_NAME_PREFIX}admission_queue_depth",
+    documentation="Upstream requests waiting for a slot of the per-service concurrency limit, by service.",
+    labelnames=("service",),
+    multiprocess_mode="livesum",
+)
+
+admission_shed_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}admission_shed_total",
+    documentation="Total reward requests shed because the service's concurrency limit was reached, by service.",
+    labelnames=("service",),
+)
+
+upstream_hedges_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}upstream_hedges_total",
+    documentation="Total hedged upstream requests by service and result: sent, won (answered first), no_budget "
+    "(not sent because the hedging budget was used up) and no_capacity (not sent because of the admission limit or "
+    "because the hedging threads were busy).",
+    labelnames=("service", "result"),
+)
+
+batch_reward_results_total = Counter(
+    name=f"{METRIC_NAME_PREFIX}batch_reward_results_total",
+    documentation="Total rewards of /rewards and /rs requests by retailer slug and result (ok, not_found, error).",
+    labelnames=("retailer_slug", "result"),
+)
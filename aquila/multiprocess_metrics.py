@@ -0,0 +1,114 @@
+import fcntl
+import logging
+import os
+
+from collections.abc import Generator
+from contextlib import contextmanager
+from glob import glob
+from threading import Lock
+from time import monotonic, perf_counter
+
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+from prometheus_client.mmap_dict import MmapedDict
+
+from aquila.metrics import metrics_compacted_files_total, metrics_scrape_seconds
+
+logger = logging.getLogger(__name__)
+
+# metric types whose values from dead processes are still part of the aggregated totals
+SUMMABLE_TYPES = frozenset(("counter", "histogram", "summary"))
+LOCK_FILE_NAME = ".aquila-metrics.lock"
+
+
+def _file_pid(path: str) -> int | None:
+    pid = os.path.basename(path)[: -len(".db")].rsplit("_", 1)[-1]
+    return int(pid) if pid.isdigit() else None
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class MultiprocessMetrics:
+    """
+    Aggregated exposition of the metrics written by every worker to PROMETHEUS_MULTIPROC_DIR.
+
+    The aggregated output is cached for `cache_seconds`. Before aggregating, the db files left behind by
+    dead workers are compacted: counters, histograms and summaries are added into one `{type}_archive.db`
+    file per type and live gauges are dropped, so the number of files read by a scrape does not grow
+    with worker restarts. Workers coordinate through a file lock in the multiprocess directory.
+    """
+
+    def __init__(self, path: str, cache_seconds: float) -> None:
+        self.path = path
+        self.cache_seconds = cache_seconds
+        self._lock = Lock()
+        self._exposition: bytes | None = None
+        self._generated_at = 0.0
+
+    @contextmanager
+    def _file_lock(self, operation: int) -> Generator[None, None, None]:
+        with open(os.path.join(self.path, LOCK_FILE_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def exposition(self) -> bytes:
+        with self._lock:
+            if self._exposition is None or monotonic() - self._generated_at >= self.cache_seconds:
+                start = perf_counter()
+                self.compact_dead_processes()
+                with self._file_lock(fcntl.LOCK_SH):
+                    registry = CollectorRegistry()
+                    multiprocess.MultiProcessCollector(registry, path=self.path)
+                    self._exposition = generate_latest(registry)
+
+                self._generated_at = monotonic()
+                metrics_scrape_seconds.observe(perf_counter() - start)
+
+            return self._exposition
+
+    def compact_dead_processes(self) -> int:
+        dead_files = [
+            path
+            for path in glob(os.path.join(self.path, "*.db"))
+            if (pid := _file_pid(path)) is not None and pid != os.getpid() and not _is_alive(pid)
+        ]
+        if not dead_files:
+            return 0
+
+        compacted = 0
+        with self._file_lock(fcntl.LOCK_EX):
+            for path in dead_files:
+                # another worker may have compacted it while we were waiting for the lock
+                if os.path.exists(path) and self._compact_file(path):
+                    compacted += 1
+
+        metrics_compacted_files_total.inc(compacted)
+        logger.info("compacted %d metrics files of dead processes in '%s'", compacted, self.path)
+        return compacted
+
+    def _compact_file(self, path: str) -> bool:
+        metric_type, *parts = os.path.basename(path).split("_")
+        if metric_type in SUMMABLE_TYPES:
+            archive = MmapedDict(os.path.join(self.path, f"{metric_type}_archive.db"))
+            try:
+                for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(path):
+                    archive.write_value(key, archive.read_value(key)[0] + value, timestamp)
+            finally:
+                archive.close()
+        elif not (metric_type == "gauge" and parts[0].startswith("live")):
+            # gauges in the other multiprocess modes keep reporting the last value of dead processes
+            return False
+
+        os.remove(path)
+        return True
@@ -0,0 +1,56 @@
+"""
+Support for gunicorn's --preload mode, enabled with PRELOAD_APP.
+
+The app is created once in the gunicorn master: templates are loaded from blob storage and compiled there and
+shared by the workers copy-on-write. No background thread is started in the master, so no lock can be held
+when a worker is forked. `post_fork` runs in each worker to replace the clients whose connections were opened
+by the master and to start the worker's background threads, `worker_exit` stops them when the worker exits.
+
+Prometheus multiprocess metrics stay per process: values are written to files named after the pid of the
+process writing them, the master's files are kept and the dead workers' ones compacted as usual.
+"""
+
+from typing import TYPE_CHECKING
+
+from aquila.blob_storage import template_loader
+from aquila.fetch_reward import reward_batches
+from aquila.http_client import upstream_clients
+from aquila.log_queue import queue_logging
+from aquila.readiness import readiness_checker
+from aquila.settings import LOG_QUEUE_ENABLED, TESTING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from flask import Flask
+
+
+def warm_templates(app: "Flask") -> None:
+    """Compile the packaged templates and the templates loaded from blob storage."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    template_loader.precompile_templates(app.jinja_env)
+
+
+def start_background_threads() -> None:
+    """Start the process' background threads, when the app is created or in each worker with PRELOAD_APP."""
+    if not TESTING:
+        readiness_checker.start()
+    if LOG_QUEUE_ENABLED:
+        queue_logging.start()
+
+
+def post_fork() -> None:
+    template_loader.after_fork()
+    for client in upstream_clients.values():
+        client.after_fork()
+
+    readiness_checker.after_fork()
+    reward_batches.after_fork()
+    start_background_threads()
+
+
+def worker_exit() -> None:
+    """Stop the worker's background threads when gunicorn stops it, no template sync is started while exiting."""
+    template_loader.stop_sync()
+    readiness_checker.stop()
+    queue_logging.stop()
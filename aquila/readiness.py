@@ -0,0 +1,145 @@
+import logging
+
+from math import ceil
+from threading import Event, Thread
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from azure.storage.blob import BlobServiceClient
+
+from aquila.http_client import polaris_client
+from aquila.metrics import readiness_check_seconds
+from aquila.settings import (
+    BLOB_CONTAINER,
+    BLOB_STORAGE_DSN,
+    POLARIS_HOST,
+    READINESS_CHECK_INTERVAL,
+    READINESS_CHECK_TIMEOUT,
+    READINESS_MAX_AGE,
+)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from azure.storage.blob import BlobClient
+
+HEALTHZ_BLOB_NAME = "healthz"
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessResult(NamedTuple):
+    # check name -> error message, empty if all the dependencies are reachable
+    errors: dict[str, str]
+    checked_at: float
+
+    @property
+    def age(self) -> float:
+        return monotonic() - self.checked_at
+
+
+class ReadinessChecker:
+    """
+    Dependency checks for /readyz, run in a background thread every `interval` seconds.
+
+    Probes only read the last completed result, so they neither hit blob storage and Polaris nor wait on
+    a slow dependency, and report the process as not ready until the first background checks completed.
+    The thread is started by aquila.preload.start_background_threads, with the app or in each worker after the
+    fork with PRELOAD_APP, probes never start it. The blob client is created once and reused between checks.
+    """
+
+    def __init__(self, interval: float, timeout: float, max_age: float) -> None:
+        self.interval = interval
+        self.timeout = timeout
+        self.max_age = max_age
+        self._result: ReadinessResult | None = None
+        self._stop = Event()
+        self._thread: Thread | None = None
+        self._blob_client: BlobClient | None = None
+
+    def _healthz_blob(self) -> "BlobClient":
+        if self._blob_client is None:
+            # type hints are still somewhat broken for BlobServiceClient
+            blob_service_client: Any = BlobServiceClient.from_connection_string(BLOB_STORAGE_DSN)
+            self._blob_client = blob_service_client.get_blob_client(BLOB_CONTAINER, HEALTHZ_BLOB_NAME)
+
+        return self._blob_client
+
+    def _check_blob_storage(self) -> str | None:
+        try:
+            if not self._healthz_blob().exists(timeout=ceil(self.timeout)):
+                return f"blob '{HEALTHZ_BLOB_NAME}' does not exist in '{BLOB_CONTAINER}'"
+        except Exception as ex:  # noqa: BLE001
+            self._blob_client = None
+            return f"failed to retrieve '{HEALTHZ_BLOB_NAME}' from '{BLOB_CONTAINER}': {ex!r}"
+
+        return None
+
+    def _check_polaris(self) -> str | None:
+        url = f"{POLARIS_HOST}/livez"
+        try:
+            # straight through the session: health checks are not reward traffic for upstream_requests_total
+            polaris_client.session.get(url, timeout=self.timeout).raise_for_status()
+        except Exception as ex:  # noqa: BLE001
+            return f"failed to contact polaris at {url}: {ex!r}"
+
+        return None
+
+    def run_checks(self) -> ReadinessResult:
+        errors = {}
+        for name, check in (
+            ("azure-blob-storage", self._check_blob_storage),
+            ("polaris-request", self._check_polaris),
+        ):
+            start = perf_counter()
+            if error := check():
+                errors[name] = error
+            readiness_check_seconds.labels(check=name).observe(perf_counter() - start)
+
+        self._result = ReadinessResult(errors=errors, checked_at=monotonic())
+        return self._result
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+
+        self._stop.clear()
+        self._thread = Thread(target=self._check_forever, name="readiness-checks", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def after_fork(self) -> None:
+        """Forget the parent's blob client, checks thread and result, aquila.preload.post_fork starts a new thread."""
+        self._blob_client = None
+        self._thread = None
+        self._result = None
+
+    def _check_forever(self) -> None:
+        while True:
+            try:
+                self.run_checks()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("readiness checks failed")
+
+            if self._stop.wait(self.interval):
+                return
+
+    def result(self) -> ReadinessResult:
+        """Last completed checks, or the checks run inline if the background checks are disabled."""
+        if self.interval <= 0:
+            return self.run_checks()
+
+        if (result := self._result) is None:
+            return ReadinessResult(
+                errors={"readiness-checks": "dependency checks have not completed yet"}, checked_at=monotonic()
+            )
+
+        if result.age > self.max_age:
+            errors = {**result.errors, "readiness-checks": f"last dependency check ran {result.age:.0f}s ago"}
+            return result._replace(errors=errors)
+
+        return result
+
+
+readiness_checker = ReadinessChecker(READINESS_CHECK_INTERVAL, READINESS_CHECK_TIMEOUT, READINESS_MAX_AGE)
@@ -1,5 +1,25 @@
 import json
 import logging
+import random
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    HAS_ORJSON = False
+else:
+    HAS_ORJSON = True
+
+# compact output, and no circular reference checks as the records' dicts are flat, unserialisable values are
+# written as their str() as orjson does with default=str
+_json_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, check_circular=False, default=str)
+
+
+def json_dumps(data: dict) -> str:
+    """Serialise a log record's dict, with orjson when it is installed."""
+    if HAS_ORJSON:
+        return orjson.dumps(data, default=str).decode()
+
+    return _json_encoder.encode(data)
 
 
 class JSONFormatter(logging.Formatter):
@@ -7,7 +27,7 @@ class JSONFormatter(logging.Formatter):
         pass
 
     def format(self, record: logging.LogRecord) -> str:
-        return json.dumps(
+        return json_dumps(
             {
                 "timestamp": record.created,
                 "level": record.levelno,
@@ -22,3 +42,14 @@ class JSONFormatter(logging.Formatter):
                 "message": record.getMessage(),
             }
         )
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a `rate` fraction of the debug and info records, warnings and errors are always kept."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate  # noqa: S311
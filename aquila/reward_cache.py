@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import NamedTuple
+
+from aquila.metrics import reward_cache_total
+from aquila.settings import REWARD_CACHE_MAX_SIZE, REWARD_CACHE_STALE_TTL, REWARD_CACHE_TTL
+
+# (service, retailer_slug, reward_id)
+RewardKey = tuple[str, str, str]
+
+
+class CachedReward(NamedTuple):
+    payload: dict
+    fresh: bool
+
+
+class RewardCache:
+    """
+    Bounded LRU cache of upstream reward payloads.
+
+    Entries are fresh for `ttl` seconds and then kept as stale for another `stale_ttl` seconds, a stale
+    entry is only meant to be served when the upstream service can not be reached or fails.
+    A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float, stale_ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: OrderedDict[RewardKey, tuple[float, dict]] = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: RewardKey) -> CachedReward | None:
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                reward_cache_total.labels(service=key[0], result="miss").inc()
+                return None
+
+            stored_at, payload = entry
+            age = monotonic() - stored_at
+            if age >= self.ttl + self.stale_ttl:
+                del self._entries[key]
+                reward_cache_total.labels(service=key[0], result="miss").inc()
+                return None
+
+            self._entries.move_to_end(key)
+
+        fresh = age < self.ttl
+        reward_cache_total.labels(service=key[0], result="hit" if fresh else "stale").inc()
+        return CachedReward(payload=dict(payload), fresh=fresh)
+
+    def set(self, key: RewardKey, payload: dict) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (monotonic(), dict(payload))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: RewardKey) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def served_stale(self, key: RewardKey) -> None:
+        reward_cache_total.labels(service=key[0], result="stale_served").inc()
+
+
+reward_cache = RewardCache(REWARD_CACHE_MAX_SIZE, REWARD_CACHE_TTL, REWARD_CACHE_STALE_TTL)
@@ -4,7 +4,7 @@ from logging import NOTSET
 from logging.config import dictConfig
 
 import sentry_sdk
-from decouple import Choices, config
+from decouple import Choices, Csv, config
 from sentry_sdk.integrations.flask import FlaskIntegration
 
 
@@ -19,6 +19,11 @@ def check_testing(value: bool) -> bool:
     return value
 
 
+def log_sample_rate(value: str) -> tuple[str, float]:
+    logger_name, rate = value.rsplit("=", 1)
+    return logger_name.strip(), float(rate)
+
+
 SECRET_KEY = secrets.token_hex()
 ALLOWED_LOG_LEVELS = Choices(["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"])
 
@@ -28,6 +33,18 @@ DEBUG: bool = config("DEBUG", default=False, cast=bool)
 ROOT_LOG_LEVEL: str = config("ROOT_LOG_LEVEL", default="ERROR", cast=ALLOWED_LOG_LEVELS)
 LOG_FORMATTER: str = config("LOG_FORMATTER", default="json", cast=Choices(["brief", "json"]))
 TESTING: bool = check_testing(config("TESTING", default=False, cast=bool))
+# format and write the logs in a background thread, through a queue of at most LOG_QUEUE_SIZE records
+LOG_QUEUE_ENABLED: bool = config("LOG_QUEUE_ENABLED", default=False, cast=bool)
+LOG_QUEUE_SIZE: int = config("LOG_QUEUE_SIZE", default=10000, cast=int)
+# "drop" discards the records logged while the queue is full, "block" waits for the queue to have room
+LOG_QUEUE_FULL_POLICY: str = config("LOG_QUEUE_FULL_POLICY", default="drop", cast=Choices(["drop", "block"]))
+# comma separated logger=rate pairs, only that fraction of the logger's debug and info records is kept,
+# e.g. aquila.fetch_reward.negative_responses=0.1
+LOG_SAMPLING: dict[str, float] = config("LOG_SAMPLING", default="", cast=Csv(cast=log_sample_rate, post_process=dict))
+
+# gunicorn --preload (sync worker mode only): the app is loaded once in the master and
+# aquila.preload.post_fork is run in each worker
+PRELOAD_APP: bool = config("PRELOAD_APP", default=False, cast=bool)
 
 POLARIS_HOST: str = config("POLARIS_HOST", default="http://polaris-api")
 POLARIS_PREFIX: str = config("POLARIS_PREFIX", default="/loyalty")
@@ -36,13 +53,105 @@ COSMOS_HOST: str = config("COSMOS_HOST", default="http://cosmos-public-api")
 COSMOS_PREFIX: str = config("COSMOS_PREFIX", default="/api/public")
 COSMOS_BASE_URL = COSMOS_HOST + COSMOS_PREFIX
 
+POLARIS_CONNECT_TIMEOUT: float = config("POLARIS_CONNECT_TIMEOUT", default=3.05, cast=float)
+POLARIS_READ_TIMEOUT: float = config("POLARIS_READ_TIMEOUT", default=10, cast=float)
+COSMOS_CONNECT_TIMEOUT: float = config("COSMOS_CONNECT_TIMEOUT", default=3.05, cast=float)
+COSMOS_READ_TIMEOUT: float = config("COSMOS_READ_TIMEOUT", default=10, cast=float)
+HTTP_POOL_MAXSIZE: int = config("HTTP_POOL_MAXSIZE", default=10, cast=int)
+HTTP_KEEP_ALIVE: bool = config("HTTP_KEEP_ALIVE", default=True, cast=bool)
+CIRCUIT_BREAKER_ENABLED: bool = config("CIRCUIT_BREAKER_ENABLED", default=True, cast=bool)
+CIRCUIT_BREAKER_WINDOW_SIZE: int = config("CIRCUIT_BREAKER_WINDOW_SIZE", default=50, cast=int)
+CIRCUIT_BREAKER_MIN_CALLS: int = config("CIRCUIT_BREAKER_MIN_CALLS", default=20, cast=int)
+CIRCUIT_BREAKER_FAILURE_RATE: float = config("CIRCUIT_BREAKER_FAILURE_RATE", default=0.5, cast=float)
+CIRCUIT_BREAKER_SLOW_CALL_SECONDS: float = config("CIRCUIT_BREAKER_SLOW_CALL_SECONDS", default=5, cast=float)
+CIRCUIT_BREAKER_SLOW_CALL_RATE: float = config("CIRCUIT_BREAKER_SLOW_CALL_RATE", default=0.5, cast=float)
+CIRCUIT_BREAKER_OPEN_SECONDS: float = config("CIRCUIT_BREAKER_OPEN_SECONDS", default=30, cast=float)
+CIRCUIT_BREAKER_HALF_OPEN_CALLS: int = config("CIRCUIT_BREAKER_HALF_OPEN_CALLS", default=3, cast=int)
+# max concurrent requests to each upstream service per worker, 0 for no limit
+POLARIS_MAX_CONCURRENT_REQUESTS: int = config("POLARIS_MAX_CONCURRENT_REQUESTS", default=0, cast=int)
+COSMOS_MAX_CONCURRENT_REQUESTS: int = config("COSMOS_MAX_CONCURRENT_REQUESTS", default=0, cast=int)
+# seconds a request over the limit waits for a slot before being shed
+ADMISSION_MAX_QUEUE_WAIT: float = config("ADMISSION_MAX_QUEUE_WAIT", default=0.5, cast=float)
+# shed requests get the retailer's error page ("error-template") or a 503 with a Retry-After header ("unavailable")
+ADMISSION_SHED_RESPONSE: str = config(
+    "ADMISSION_SHED_RESPONSE", default="error-template", cast=Choices(["error-template", "unavailable"])
+)
+ADMISSION_RETRY_AFTER: int = config("ADMISSION_RETRY_AFTER", default=5, cast=int)
+# send a second request to Polaris/Cosmos when the first one has not answered after the hedge delay
+HEDGING_ENABLED: bool = config("HEDGING_ENABLED", default=False, cast=bool)
+# seconds, used until enough upstream latencies were observed when HEDGE_DELAY_PERCENTILE is set
+HEDGE_DELAY: float = config("HEDGE_DELAY", default=0.5, cast=float)
+# hedge after this percentile of the recent upstream latencies, 0 to always wait HEDGE_DELAY
+HEDGE_DELAY_PERCENTILE: float = config("HEDGE_DELAY_PERCENTILE", default=95, cast=float)
+# max hedged requests, as a fraction of the upstream requests
+HEDGE_BUDGET: float = config("HEDGE_BUDGET", default=0.05, cast=float)
+# threads per worker and upstream service running hedged requests' attempts, a request finding them all busy for
+# the hedge delay is sent from its own thread without hedging
+HEDGE_MAX_WORKERS: int = config("HEDGE_MAX_WORKERS", default=20, cast=int)
+REWARD_REQUEST_COALESCING: bool = config("REWARD_REQUEST_COALESCING", default=True, cast=bool)
+# max number of cached upstream reward payloads per worker, 0 disables the reward cache
+REWARD_CACHE_MAX_SIZE: int = config("REWARD_CACHE_MAX_SIZE", default=0, cast=int)
+REWARD_CACHE_TTL: float = config("REWARD_CACHE_TTL", default=30, cast=float)
+REWARD_CACHE_STALE_TTL: float = config("REWARD_CACHE_STALE_TTL", default=300, cast=float)
+COMPRESSION_ENABLED: bool = config("COMPRESSION_ENABLED", default=True, cast=bool)
+# pages smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE: int = config("COMPRESSION_MIN_SIZE", default=1024, cast=int)
+COMPRESSION_GZIP_LEVEL: int = config("COMPRESSION_GZIP_LEVEL", default=6, cast=int)
+# brotli is only used when the brotli package is installed
+COMPRESSION_BROTLI_QUALITY: int = config("COMPRESSION_BROTLI_QUALITY", default=5, cast=int)
+# max reward ids of a /rewards or /rs request, and rewards of a batch fetched concurrently by each worker
+BATCH_MAX_REWARDS: int = config("BATCH_MAX_REWARDS", default=20, cast=int)
+BATCH_CONCURRENCY: int = config("BATCH_CONCURRENCY", default=8, cast=int)
+# seconds a batch waits for its rewards, the rewards still being fetched are listed as unavailable
+BATCH_TIMEOUT: float = config("BATCH_TIMEOUT", default=15, cast=float)
+# retailer slugs whose reward pages are streamed as they are rendered, * for every retailer
+STREAMED_RENDERING_RETAILERS: list[str] = config("STREAMED_RENDERING_RETAILERS", default="", cast=Csv())
+# Cache-Control of rendered reward pages, which carry an ETag, the default lets browsers revalidate them with a 304
+REWARD_CACHE_CONTROL: str = config("REWARD_CACHE_CONTROL", default="private, no-cache")
 
 BLOB_STORAGE_DSN: str = config("BLOB_STORAGE_DSN")
 BLOB_CONTAINER: str = config("BLOB_CONTAINER", default="aquila-templates")
 BLOB_LOGGING_LEVEL: str = config("BLOB_LOGGING_LEVEL", default="ERROR", cast=ALLOWED_LOG_LEVELS)
+TEMPLATE_MISS_TTL: float = config("TEMPLATE_MISS_TTL", default=60, cast=float)
+TEMPLATE_RELOAD_MIN_INTERVAL: float = config("TEMPLATE_RELOAD_MIN_INTERVAL", default=10, cast=float)
+TEMPLATE_DOWNLOAD_CONCURRENCY: int = config("TEMPLATE_DOWNLOAD_CONCURRENCY", default=8, cast=int)
+# "eager" loads the whole container when a worker starts, "lazy" loads each retailer's templates on first use
+TEMPLATE_LOADING_MODE: str = config("TEMPLATE_LOADING_MODE", default="eager", cast=Choices(["eager", "lazy"]))
+# lazy loading only, total size of the cached templates above which the least recently used retailers are evicted
+TEMPLATE_CACHE_MAX_BYTES: int = config("TEMPLATE_CACHE_MAX_BYTES", default=64 * 1024 * 1024, cast=int)
+# eager loading only, directory (e.g. on /dev/shm or a volume) holding a templates snapshot shared by the workers
+TEMPLATE_SNAPSHOT_DIR: str | None = config("TEMPLATE_SNAPSHOT_DIR", default=None)
+# seconds after a sync with blob storage during which the workers load the snapshot instead of syncing again
+TEMPLATE_SNAPSHOT_MAX_AGE: float = config("TEMPLATE_SNAPSHOT_MAX_AGE", default=60, cast=float)
+# directory (e.g. on /dev/shm or a volume) of the jinja bytecode cache shared by the workers, unset disables it
+TEMPLATE_BYTECODE_CACHE_DIR: str | None = config("TEMPLATE_BYTECODE_CACHE_DIR", default=None)
+# seconds after which a bytecode cache file is removed when the workers start or resync, to bound the directory
+TEMPLATE_BYTECODE_CACHE_MAX_AGE: float = config("TEMPLATE_BYTECODE_CACHE_MAX_AGE", default=24 * 60 * 60, cast=float)
+# seconds between background template syncs, 0 disables the background sync
+TEMPLATE_SYNC_INTERVAL: float = config("TEMPLATE_SYNC_INTERVAL", default=0, cast=float)
+
+# seconds between the background dependency checks reported by /readyz
+READINESS_CHECK_INTERVAL: float = config("READINESS_CHECK_INTERVAL", default=10, cast=float)
+READINESS_CHECK_TIMEOUT: float = config("READINESS_CHECK_TIMEOUT", default=2, cast=float)
+# /readyz fails once the last completed dependency check is older than this
+READINESS_MAX_AGE: float = config("READINESS_MAX_AGE", default=60, cast=float)
 
 METRICS_DEBUG: bool = config("METRICS_DEBUG", default=False, cast=bool)
 PROMETHEUS_MULTIPROC_DIR: str | None = config("PROMETHEUS_MULTIPROC_DIR", default=None)
+# seconds the aggregated multiprocess metrics are reused for between scrapes
+METRICS_CACHE_SECONDS: float = config("METRICS_CACHE_SECONDS", default=5, cast=float)
+# retailer slugs always allowed as metric labels, on top of the retailers with templates in blob storage
+METRICS_RETAILER_SLUGS: list[str] = config("METRICS_RETAILER_SLUGS", default="", cast=Csv())
+# histogram buckets in seconds, comma separated
+REQUEST_LATENCY_BUCKETS: list[float] = config(
+    "REQUEST_LATENCY_BUCKETS", default="0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,15", cast=Csv(float)
+)
+UPSTREAM_LATENCY_BUCKETS: list[float] = config(
+    "UPSTREAM_LATENCY_BUCKETS", default="0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10", cast=Csv(float)
+)
+TEMPLATE_LATENCY_BUCKETS: list[float] = config(
+    "TEMPLATE_LATENCY_BUCKETS", default="0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,1,5", cast=Csv(float)
+)
 
 SENTRY_DSN: str | None = config("SENTRY_DSN", default=None)
 if SENTRY_DSN:  # pragma: no cover
@@ -54,6 +163,20 @@ if SENTRY_DSN:  # pragma: no cover
     )
 
 
+LOGGERS: dict[str, dict] = {
+    "root": {
+        "level": ROOT_LOG_LEVEL,
+        "handlers": ["stdout"],
+    },
+    "template-loader": {
+        "level": BLOB_LOGGING_LEVEL,
+        "handlers": ["stdout"],
+        "propagate": False,
+    },
+}
+for logger_name in LOG_SAMPLING:
+    LOGGERS.setdefault(logger_name, {})["filters"] = [f"sample:{logger_name}"]
+
 dictConfig(
     {
         "version": 1,
@@ -62,6 +185,10 @@ dictConfig(
             "brief": {"format": "%(levelname)s:     %(asctime)s - %(message)s"},
             "json": {"()": "aquila.reporting.JSONFormatter"},
         },
+        "filters": {
+            f"sample:{logger_name}": {"()": "aquila.reporting.SamplingFilter", "rate": rate}
+            for logger_name, rate in LOG_SAMPLING.items()
+        },
         "handlers": {
             "stderr": {
                 "level": NOTSET,
@@ -76,16 +203,6 @@ dictConfig(
                 "formatter": LOG_FORMATTER,
             },
         },
-        "loggers": {
-            "root": {
-                "level": ROOT_LOG_LEVEL,
-                "handlers": ["stdout"],
-            },
-            "template-loader": {
-                "level": BLOB_LOGGING_LEVEL,
-                "handlers": ["stdout"],
-                "propagate": False,
-            },
-        },
+        "loggers": LOGGERS,
     }
 )
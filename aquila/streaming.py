@@ -0,0 +1,76 @@
+import logging
+
+from collections.abc import Iterable, Iterator
+from itertools import chain
+from time import perf_counter
+
+from flask import Response, stream_template
+from jinja2 import Template
+
+from aquila.metric_labels import retailer_label
+from aquila.metrics import template_render_seconds, template_stream_failures_total
+from aquila.settings import STREAMED_RENDERING_RETAILERS
+
+logger = logging.getLogger(__name__)
+
+ALL_RETAILERS = "*"
+# characters rendered after the page head that are sent together
+STREAM_BUFFER_SIZE = 8192
+
+
+def streamed_rendering(retailer_slug: str) -> bool:
+    return retailer_slug in STREAMED_RENDERING_RETAILERS or ALL_RETAILERS in STREAMED_RENDERING_RETAILERS
+
+
+def _buffered(chunks: Iterator[str], size: int) -> Iterator[str]:
+    buffer: list[str] = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield "".join(buffer)
+            buffer, buffered = [], 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+def _timed(chunks: Iterable[str], source: str, retailer_slug: str) -> Iterator[str]:
+    """
+    Observe the time spent rendering the chunks, leaving out the time spent sending them.
+
+    Errors after the first chunk, once the response status was sent, are logged and counted before being raised
+    again, which aborts the response instead of ending it as if the page was complete.
+    """
+    rendering = 0.0
+    iterator = iter(chunks)
+    started = False
+    while True:
+        start = perf_counter()
+        try:
+            chunk = next(iterator, None)
+        except Exception:
+            if started:
+                template_stream_failures_total.labels(retailer_slug=retailer_label(retailer_slug), source=source).inc()
+                logger.exception("error streaming the %s reward page of retailer '%s'", source, retailer_slug)
+            raise
+        rendering += perf_counter() - start
+        if chunk is None:
+            break
+        started = True
+        yield chunk
+
+    template_render_seconds.labels(source=source).observe(rendering)
+
+
+def stream_page(template: str | Template, context: dict, source: str, retailer_slug: str) -> Response:
+    """
+    Response streaming the rendered template, the page head is sent as soon as it is rendered.
+
+    The start of the template is rendered before returning, so errors rendering it still end in an error response.
+    Errors rendering the rest of the page can only abort the stream, the status has already been sent.
+    """
+    chunks = _timed(stream_template(template, **context), source, retailer_slug)
+    head = next(chunks, "")
+    return Response(chain((head,), _buffered(chunks, STREAM_BUFFER_SIZE)), mimetype="text/html")
@@ -0,0 +1,29 @@
+"""
+wsgi entrypoint for the benchmarks, the real aquila app with blob storage replaced by FakeBlobServiceClient.
+
+The fake container is shaped by the BENCH_RETAILERS, BENCH_TEMPLATE_KB and BENCH_BLOB_LATENCY_MS env vars.
+"""
+
+import os
+
+from typing import Any
+
+from azure.storage.blob import BlobServiceClient
+
+from benchmarks.fakes import FakeBlobServiceClient, FakeContainerClient, build_templates
+
+container_client = FakeContainerClient(
+    build_templates(int(os.getenv("BENCH_RETAILERS", "20")), int(os.getenv("BENCH_TEMPLATE_KB", "4"))),
+    download_latency_ms=float(os.getenv("BENCH_BLOB_LATENCY_MS", "5")),
+)
+
+
+def from_connection_string(*args: Any, **kwargs: Any) -> FakeBlobServiceClient:  # noqa: ANN401, ARG001
+    return FakeBlobServiceClient(container_client)
+
+
+BlobServiceClient.from_connection_string = from_connection_string  # type: ignore[method-assign, assignment]
+
+from aquila import create_app  # noqa: E402
+
+app = create_app()
@@ -0,0 +1,150 @@
+"""Local stand-ins for Polaris, Cosmos and blob storage used by the benchmarks."""
+
+import json
+import random
+
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from types import SimpleNamespace
+from typing import Any
+
+
+@dataclass
+class UpstreamBehaviour:
+    latency_ms: float = 20
+    jitter_ms: float = 10
+    error_rate: float = 0.0
+    not_found_rate: float = 0.0
+
+    def delay(self) -> float:
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000  # noqa: S311
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    """Fake Polaris/Cosmos answering `/livez` and `.../{retailer_slug}/reward/{reward_id}`."""
+
+    daemon_threads = True
+
+    def __init__(self, behaviour: UpstreamBehaviour, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), FakeUpstreamHandler)
+        self.behaviour = behaviour
+        self._thread = Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeUpstreamServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: FakeUpstreamServer
+
+    def do_GET(self) -> None:
+        behaviour = self.server.behaviour
+        if self.path.endswith("/livez"):
+            self._send_json(200, {})
+            return
+
+        sleep(behaviour.delay())
+        roll = random.random()  # noqa: S311
+        if "/reward/" not in self.path or roll < behaviour.not_found_rate:
+            self._send_json(404, {"display_message": "Not found", "code": "NO_REWARD_FOUND"})
+        elif roll < behaviour.not_found_rate + behaviour.error_rate:
+            self._send_json(500, {"display_message": "Internal error", "code": "INTERNAL_ERROR"})
+        else:
+            self._send_json(
+                200, {"code": "BENCHCODE1234", "expiry_date": "2030-12-31", "template_slug": "reward", "pin": "1234"}
+            )
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:  # noqa: ANN401
+        pass
+
+
+def build_templates(retailers: int, template_kb: int) -> dict[str, str]:
+    """Blob name -> content for `retailers` retailers, each with a reward and an error template."""
+    padding = "/* padding */ " * (template_kb * 1024 // 14)
+    head = f"<!DOCTYPE html><html><head><style>{padding}</style></head>"
+    reward = (
+        head + "<body><p>{{ code }}</p><p>{{ expiry_date }}</p>{% if pin %}<p>{{ pin }}</p>{% endif %}</body></html>"
+    )
+    error = head + "<body><p>Oops</p></body></html>"
+
+    blobs = {"healthz": ""}
+    for i in range(retailers):
+        blobs[f"retailer-{i}/reward.html"] = reward
+        blobs[f"retailer-{i}/error.html"] = error
+
+    return blobs
+
+
+class FakeBlobClient:
+    def __init__(self, container: "FakeContainerClient", name: str) -> None:
+        self.container = container
+        self.name = name
+
+    def exists(self, **kwargs: Any) -> bool:  # noqa: ANN401, ARG002
+        return self.name in self.container.blobs
+
+    def download_blob(self) -> SimpleNamespace:
+        sleep(self.container.download_latency_ms / 1000)
+        content = self.container.blobs[self.name].encode("utf-8")
+        return SimpleNamespace(readall=lambda: content)
+
+
+class FakeContainerClient:
+    """In-process replacement for the azure ContainerClient used by TemplateLoader."""
+
+    def __init__(self, blobs: dict[str, str], download_latency_ms: float = 0) -> None:
+        self.blobs = blobs
+        self.download_latency_ms = download_latency_ms
+        self.last_modified = datetime.now(tz=UTC)
+
+    def list_blobs(self, name_starts_with: str | None = None) -> list[SimpleNamespace]:
+        return [
+            SimpleNamespace(
+                name=name,
+                etag=f'"{hash(content)}"',
+                last_modified=self.last_modified,
+                size=len(content.encode("utf-8")),
+            )
+            for name, content in self.blobs.items()
+            if name_starts_with is None or name.startswith(name_starts_with)
+        ]
+
+    def walk_blobs(self, delimiter: str) -> list[SimpleNamespace]:
+        names = {name.split(delimiter)[0] + delimiter if delimiter in name else name for name in self.blobs}
+        return [SimpleNamespace(name=name) for name in sorted(names)]
+
+    def get_blob_client(self, blob: str) -> FakeBlobClient:
+        return FakeBlobClient(self, blob)
+
+
+class FakeBlobServiceClient:
+    def __init__(self, container_client: FakeContainerClient) -> None:
+        self.container_client = container_client
+
+    def get_container_client(self, container: str) -> FakeContainerClient:  # noqa: ARG002
+        return self.container_client
+
+    def get_blob_client(self, container: str, blob: str) -> FakeBlobClient:  # noqa: ARG002
+        return self.container_client.get_blob_client(blob)
@@ -0,0 +1,222 @@
+"""
+Load benchmark for aquila running under gunicorn against local fakes of Polaris, Cosmos and blob storage.
+
+    python -m benchmarks.run --duration 30 --concurrency 16 --output benchmarks/results/run.json
+
+Worker settings come from gunicorn_conf.py and the environment (WORKER_MODE, WORKERS, THREADS, ...), so the
+same command can compare serving modes. Results are printed and written as json to compare runs.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter, sleep
+
+import requests
+
+from benchmarks.fakes import FakeUpstreamServer, UpstreamBehaviour
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_URL = "http://127.0.0.1:9000"
+METRICS_URL = "http://127.0.0.1:9100"
+# endpoint -> share of the generated requests
+DEFAULT_MIX = {"/reward": 0.6, "/r": 0.3, "/readyz": 0.05, "/metrics": 0.05}
+
+# env vars tuning aquila's performance recorded with the results, anything else may hold secrets
+RECORDED_ENV_PREFIXES = ("WORKER", "THREADS", "HTTP_", "REWARD_", "TEMPLATE_", "CIRCUIT_BREAKER_")
+
+Sample = tuple[str, int, float]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load per run")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of load discarded before measuring")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client connections")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help="json endpoint -> weight")
+    parser.add_argument("--rewards", type=int, default=1000, help="distinct reward ids requested")
+    parser.add_argument("--retailers", type=int, default=20)
+    parser.add_argument("--template-kb", type=int, default=4)
+    parser.add_argument("--blob-latency-ms", type=float, default=5)
+    parser.add_argument("--upstream-latency-ms", type=float, default=20)
+    parser.add_argument("--upstream-jitter-ms", type=float, default=10)
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--upstream-not-found-rate", type=float, default=0.0)
+    parser.add_argument("--output", type=Path, help="json file the results are written to")
+    return parser.parse_args()
+
+
+def start_gunicorn(args: argparse.Namespace, polaris: FakeUpstreamServer, cosmos: FakeUpstreamServer) -> tuple:
+    multiproc_dir = tempfile.TemporaryDirectory(prefix="aquila-bench-")
+    env = {
+        **os.environ,
+        "TESTING": "False",
+        "BLOB_STORAGE_DSN": "benchmark",
+        "POLARIS_HOST": polaris.url,
+        "COSMOS_HOST": cosmos.url,
+        "PROMETHEUS_MULTIPROC_DIR": multiproc_dir.name,
+        "BENCH_RETAILERS": str(args.retailers),
+        "BENCH_TEMPLATE_KB": str(args.template_kb),
+        "BENCH_BLOB_LATENCY_MS": str(args.blob_latency_ms),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config=gunicorn_conf.py", "benchmarks.bench_wsgi:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    start = perf_counter()
+    while perf_counter() - start < 60:
+        try:
+            if requests.get(f"{APP_URL}/livez", timeout=1).ok:
+                return process, multiproc_dir, perf_counter() - start
+        # the workers may still be loading the app
+        except (requests.ConnectionError, requests.Timeout):
+            sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("gunicorn did not start within 60 seconds")
+
+
+def request_url(endpoint: str, args: argparse.Namespace) -> str:
+    if endpoint == "/metrics":
+        return f"{METRICS_URL}/metrics"
+
+    if endpoint in {"/reward", "/r"}:
+        retailer = random.randrange(args.retailers)  # noqa: S311
+        reward = random.randrange(args.rewards)  # noqa: S311
+        return f"{APP_URL}{endpoint}?retailer=retailer-{retailer}&reward={reward}"
+
+    return f"{APP_URL}{endpoint}"
+
+
+def client_loop(args: argparse.Namespace, until: float) -> list[Sample]:
+    session = requests.Session()
+    endpoints, weights = zip(*args.mix.items(), strict=True)
+    samples: list[Sample] = []
+    while perf_counter() < until:
+        endpoint = random.choices(endpoints, weights)[0]  # noqa: S311
+        start = perf_counter()
+        try:
+            status = session.get(request_url(endpoint, args), timeout=30).status_code
+        except requests.RequestException:
+            status = 0
+
+        samples.append((endpoint, status, perf_counter() - start))
+
+    return samples
+
+
+def generate_load(args: argparse.Namespace, duration: float) -> tuple[list[Sample], float]:
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(client_loop, args, start + duration) for _ in range(args.concurrency)]
+        samples = [sample for future in futures for sample in future.result()]
+
+    return samples, perf_counter() - start
+
+
+def summarise(samples: list[Sample], elapsed: float) -> dict:
+    by_endpoint: dict[str, list[Sample]] = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[0]].append(sample)
+
+    return {
+        "all": endpoint_stats(samples, elapsed),
+        "endpoints": {endpoint: endpoint_stats(group, elapsed) for endpoint, group in sorted(by_endpoint.items())},
+    }
+
+
+def endpoint_stats(samples: list[Sample], elapsed: float) -> dict:
+    latencies = sorted(latency * 1000 for _, _, latency in samples)
+    percentiles = quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    statuses: dict[str, int] = defaultdict(int)
+    for _, status, _ in samples:
+        statuses[str(status)] += 1
+
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / elapsed, 2),
+        "p50_ms": round(percentiles[49], 2),
+        "p95_ms": round(percentiles[94], 2),
+        "p99_ms": round(percentiles[98], 2),
+        "max_ms": round(latencies[-1], 2),
+        "statuses": dict(statuses),
+    }
+
+
+def worker_memory(master_pid: int) -> dict[str, int]:
+    """Resident memory in KiB of each gunicorn worker, read from /proc (linux only)."""
+    children = Path(f"/proc/{master_pid}/task/{master_pid}/children")
+    if not children.exists():
+        return {}
+
+    memory = {}
+    for pid in children.read_text().split():
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                memory[pid] = int(line.split()[1])
+
+    return memory
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()  # noqa: S607
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    args = parse_args()
+    behaviour = UpstreamBehaviour(
+        latency_ms=args.upstream_latency_ms,
+        jitter_ms=args.upstream_jitter_ms,
+        error_rate=args.upstream_error_rate,
+        not_found_rate=args.upstream_not_found_rate,
+    )
+    polaris = FakeUpstreamServer(behaviour).start()
+    cosmos = FakeUpstreamServer(behaviour).start()
+    process, multiproc_dir, startup_seconds = start_gunicorn(args, polaris, cosmos)
+    try:
+        generate_load(args, args.warmup)
+        samples, elapsed = generate_load(args, args.duration)
+        memory = worker_memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        multiproc_dir.cleanup()
+        polaris.stop()
+        cosmos.stop()
+
+    report = {
+        "timestamp": datetime.now(tz=UTC).isoformat(),
+        "revision": git_revision(),
+        "settings": {key: str(value) for key, value in vars(args).items() if key != "output"},
+        "environment": {
+            key: value for key, value in sorted(os.environ.items()) if key.startswith(RECORDED_ENV_PREFIXES)
+        },
+        "startup_seconds": round(startup_seconds, 3),
+        "worker_rss_kib": memory,
+        "results": summarise(samples, elapsed),
+    }
+    report_json = json.dumps(report, indent=2)
+    print(report_json)  # noqa: T201
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(report_json)
+
+
+if __name__ == "__main__":
+    main()
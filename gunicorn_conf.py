@@ -0,0 +1,66 @@
+"""
+gunicorn settings, used with `gunicorn --config gunicorn_conf.py wsgi:app`.
+
+WORKER_MODE chooses how each worker serves requests:
+- sync: threaded workers, each handling up to THREADS requests at a time.
+- gevent: cooperative workers, each handling up to WORKER_CONNECTIONS requests at a time. The blocking calls
+  to polaris, cosmos and blob storage yield to other requests while waiting, so a worker can hold hundreds of
+  upstream waits. Needs gevent installed, HTTP_POOL_MAXSIZE should be raised to match WORKER_CONNECTIONS.
+
+PRELOAD_APP=True loads the app once in the master (gunicorn --preload): templates are downloaded and compiled
+before forking and shared by the workers copy-on-write, workers start without touching blob storage.
+See aquila.preload for what is recreated in each worker. Not supported with WORKER_MODE=gevent: the gevent
+workers monkey-patch threading after the fork, the locks and threads created by the preloaded app would not be
+cooperative.
+
+This module is kept outside of the aquila package on purpose: importing aquila loads the templates, which
+without PRELOAD_APP must only happen in the workers.
+"""
+
+import gc
+import sys
+
+from importlib import import_module
+from typing import Any
+
+import decouple
+
+WORKER_MODE: str = decouple.config("WORKER_MODE", default="sync", cast=decouple.Choices(["sync", "gevent"]))
+PRELOAD_APP: bool = decouple.config("PRELOAD_APP", default=False, cast=bool)
+
+bind = [f"0.0.0.0:{port}" for port in (9000, 9100)]
+workers: int = decouple.config("WORKERS", default=2, cast=int)
+errorlog = "-"
+accesslog = "-"
+
+if WORKER_MODE == "gevent":
+    worker_class = "gevent"
+    worker_connections: int = decouple.config("WORKER_CONNECTIONS", default=500, cast=int)
+else:
+    worker_class = "gthread"
+    threads: int = decouple.config("THREADS", default=2, cast=int)
+
+if PRELOAD_APP and WORKER_MODE == "gevent":
+    raise ValueError("PRELOAD_APP is not supported with WORKER_MODE=gevent")
+
+preload_app = PRELOAD_APP
+
+
+def when_ready(server: Any) -> None:  # noqa: ANN401, ARG001
+    if PRELOAD_APP:
+        # keep the preloaded objects out of the workers' garbage collections, which would otherwise touch
+        # (and so copy) the memory pages shared with the master
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server: Any, worker: Any) -> None:  # noqa: ANN401, ARG001
+    if PRELOAD_APP:
+        # imported here, the aquila package is already loaded in the master
+        import_module("aquila.preload").post_fork()
+
+
+def worker_exit(server: Any, worker: Any) -> None:  # noqa: ANN401, ARG001
+    # only when the worker loaded the app, a worker which failed to boot has no background threads to stop
+    if (preload := sys.modules.get("aquila.preload")) is not None:
+        preload.worker_exit()
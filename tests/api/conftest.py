@@ -3,7 +3,11 @@ from typing import TYPE_CHECKING
 
 import pytest
 
+from pytest_mock import MockerFixture
+
 from aquila import create_app
+from aquila.circuit_breaker import CircuitBreaker
+from aquila.http_client import upstream_clients
 
 if TYPE_CHECKING:
     from flask.testing import FlaskClient
@@ -14,3 +18,15 @@ def test_client() -> Generator["FlaskClient", None, None]:
     app = create_app()
     with app.app_context(), app.test_request_context():
         yield app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def allowed_retailer_slugs(mocker: MockerFixture) -> None:
+    mocker.patch("aquila.metric_labels.ALLOWED_RETAILER_SLUGS", frozenset({"test-retailer"}))
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breakers(mocker: MockerFixture) -> None:
+    # the upstream clients are module globals, failures recorded by a test must not open a circuit in the next ones
+    for service, client in upstream_clients.items():
+        mocker.patch.object(client, "circuit_breaker", CircuitBreaker(service))
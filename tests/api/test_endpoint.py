@@ -1,11 +1,22 @@
+from threading import Event, Lock
+from time import monotonic
 from typing import TYPE_CHECKING
 from uuid import uuid4
 
 import responses
 
-from flask import render_template, url_for
+from flask import current_app, render_template, url_for
+from prometheus_client import REGISTRY
 from pytest_mock import MockerFixture
 
+from aquila.admission import AdmissionLimiter
+from aquila.blob_storage import BlobTemplate, template_checksum
+from aquila.circuit_breaker import CircuitBreaker
+from aquila.fetch_reward import reward_batches
+from aquila.hedging import Hedger
+from aquila.http_client import upstream_clients
+from aquila.readiness import ReadinessResult
+from aquila.reward_cache import RewardCache
 from aquila.settings import COSMOS_BASE_URL, POLARIS_BASE_URL
 
 if TYPE_CHECKING:
@@ -62,7 +73,8 @@ def test_reward_ok(test_client: "FlaskClient", mocker: MockerFixture) -> None:
             },
         )
         mock_template_loader = mocker.patch("aquila.endpoints.rewards.template_loader")
-        mock_template_loader.get_template.return_value = template
+        mock_template_loader.lookup_template.return_value = BlobTemplate(template, template_checksum(template))
+        mock_template_loader.compiled_template.return_value = current_app.jinja_env.from_string(template)
         resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
         assert resp.text == expected_response
 
@@ -97,7 +109,7 @@ def test_reward_fallback_template(test_client: "FlaskClient", mocker: MockerFixt
             },
         )
         mock_template_loader = mocker.patch("aquila.endpoints.rewards.template_loader")
-        mock_template_loader.get_template.return_value = None
+        mock_template_loader.lookup_template.return_value = None
         resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
         assert resp.text == expected_response
         mock_metric.labels.assert_called_once_with(
@@ -115,7 +127,7 @@ def test_reward_missing_param(test_client: "FlaskClient", mocker: MockerFixture)
 
         resp = test_client.get(f"{endpoint_path}?retailer=stuff")
         assert resp.status_code == 400
-        mock_metric.labels.assert_called_with(retailer_slug="stuff", response_status=400, response_template="N/A")
+        mock_metric.labels.assert_called_with(retailer_slug="other", response_status=400, response_template="N/A")
 
         resp = test_client.get(endpoint_path)
         assert resp.status_code == 400
@@ -173,7 +185,10 @@ def test_reward_negative_response_retailer_error_template(test_client: "FlaskCli
 
         responses.get(f"{base_url}/{retailer_slug}/reward/{reward_id}", json={}, status=500)
         mock_template_loader = mocker.patch("aquila.fetch_reward.template_loader")
-        mock_template_loader.get_template.return_value = retailer_error_template
+        mock_template_loader.lookup_template.return_value = BlobTemplate(
+            retailer_error_template, template_checksum(retailer_error_template)
+        )
+        mock_template_loader.compiled_template.return_value = current_app.jinja_env.from_string(retailer_error_template)
 
         resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
         assert resp.text == retailer_error_template
@@ -183,9 +198,346 @@ def test_reward_negative_response_retailer_error_template(test_client: "FlaskCli
         )
 
 
+@responses.activate
+def test_reward_cache_serves_stale_on_upstream_error(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+    expected_response = render_template("default.html", code="TSTRWDCODE1234", expiry_date="31/12/1999", pin=None)
+
+    for base_url, endpoint_path in REQUEST_MAPPER.items():
+        # a ttl of 0 makes every cached reward immediately stale
+        mocker.patch("aquila.fetch_reward.reward_cache", RewardCache(10, 0, 300))
+        url = f"{base_url}/{retailer_slug}/reward/{reward_id}"
+
+        responses.get(url, json={"code": "TSTRWDCODE1234", "expiry_date": "1999-12-31"})
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.text == expected_response
+
+        responses.get(url, json={}, status=500)
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.text == expected_response
+
+        # a 404 means the reward is gone, stale entries are not served
+        responses.get(url, json={}, status=404)
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.status_code == 404
+
+        responses.get(url, json={}, status=500)
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.text == render_template("default_error.html")
+
+
+@responses.activate
+def test_reward_circuit_open(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+
+    for base_url, endpoint_path in REQUEST_MAPPER.items():
+        mock_metric = mocker.patch("aquila.fetch_reward.reward_requests_total")
+        service = "cosmos" if endpoint_path == "/r" else "polaris"
+        breaker = CircuitBreaker(service, enabled=True, min_calls=1, failure_rate=1)
+        mocker.patch.object(upstream_clients[service], "circuit_breaker", breaker)
+        upstream = responses.get(f"{base_url}/{retailer_slug}/reward/{reward_id}", json={}, status=503)
+
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.text == render_template("default_error.html")
+        assert upstream.call_count == 1
+
+        # the circuit is now open, the error template is served without calling the upstream service
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.text == render_template("default_error.html")
+        assert upstream.call_count == 1
+        mock_metric.labels.assert_called_with(
+            retailer_slug=retailer_slug, response_status=200, response_template="default_error"
+        )
+
+
+@responses.activate
+def test_reward_shed_over_concurrency_limit(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+
+    for base_url, endpoint_path in REQUEST_MAPPER.items():
+        service = "cosmos" if endpoint_path == "/r" else "polaris"
+        limiter = AdmissionLimiter(service, max_concurrent=1, max_queue_wait=0)
+        mocker.patch.object(upstream_clients[service], "admission", limiter)
+        # the only slot is taken by another request
+        limiter._slots.acquire()
+        upstream = responses.get(f"{base_url}/{retailer_slug}/reward/{reward_id}", json={})
+
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.status_code == 200
+        assert resp.text == render_template("default_error.html")
+
+        mocker.patch("aquila.fetch_reward.ADMISSION_SHED_RESPONSE", "unavailable")
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "5"
+        assert resp.headers["Cache-Control"] == "no-store"
+        assert upstream.call_count == 0
+        mocker.patch("aquila.fetch_reward.ADMISSION_SHED_RESPONSE", "error-template")
+
+
+@responses.activate
+def test_reward_hedged_request(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+
+    for base_url, endpoint_path in REQUEST_MAPPER.items():
+        service = "cosmos" if endpoint_path == "/r" else "polaris"
+        mocker.patch.object(upstream_clients[service], "hedger", Hedger(service, enabled=True, delay=5))
+        upstream = responses.get(
+            f"{base_url}/{retailer_slug}/reward/{reward_id}",
+            json={"code": "TSTRWDCODE1234", "expiry_date": "1999-12-31"},
+        )
+
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.text == render_template("default.html", code="TSTRWDCODE1234", expiry_date="31/12/1999", pin=None)
+        assert upstream.call_count == 1
+
+
+@responses.activate
+def test_reward_streamed(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+    mocker.patch("aquila.streaming.STREAMED_RENDERING_RETAILERS", [retailer_slug])
+    mock_metric = mocker.patch("aquila.endpoints.rewards.reward_requests_total")
+
+    for base_url, endpoint_path in REQUEST_MAPPER.items():
+        responses.get(
+            f"{base_url}/{retailer_slug}/reward/{reward_id}",
+            json={"code": "TSTRWDCODE1234", "expiry_date": "1999-12-31"},
+        )
+
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&reward={reward_id}")
+        assert resp.is_streamed
+        assert resp.text == render_template("default.html", code="TSTRWDCODE1234", expiry_date="31/12/1999", pin=None)
+        assert resp.headers["ETag"]
+        mock_metric.labels.assert_called_with(
+            retailer_slug=retailer_slug, response_status=200, response_template="default"
+        )
+
+
+@responses.activate
+def test_rewards_batch(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    retailer_slug = "test-retailer"
+    reward_ids = [str(uuid4()) for _ in range(4)]
+
+    for base_url, endpoint_path in {COSMOS_BASE_URL: "/rs", POLARIS_BASE_URL: "/rewards"}.items():
+        mock_batch_metric = mocker.patch("aquila.fetch_reward.batch_reward_results_total")
+        mock_fetch_metric = mocker.patch("aquila.fetch_reward.reward_requests_total")
+        mock_requests_metric = mocker.patch("aquila.endpoints.rewards.reward_requests_total")
+        for reward_id, code in zip(reward_ids[:2], ("TSTRWDCODE1", "TSTRWDCODE2"), strict=True):
+            responses.get(
+                f"{base_url}/{retailer_slug}/reward/{reward_id}",
+                json={"code": code, "expiry_date": "1999-12-31", "template_slug": "reward"},
+            )
+        responses.get(f"{base_url}/{retailer_slug}/reward/{reward_ids[2]}", json={}, status=404)
+        responses.get(f"{base_url}/{retailer_slug}/reward/{reward_ids[3]}", json={}, status=500)
+
+        query = "&".join(f"reward={reward_id}" for reward_id in [*reward_ids, reward_ids[0]])
+        resp = test_client.get(f"{endpoint_path}?retailer={retailer_slug}&{query}")
+
+        assert resp.status_code == 200
+        assert resp.text == render_template(
+            "default_reward_list.html",
+            rewards=[
+                {"code": "TSTRWDCODE1", "expiry_date": "31/12/1999", "reward_id": reward_ids[0]},
+                {"code": "TSTRWDCODE2", "expiry_date": "31/12/1999", "reward_id": reward_ids[1]},
+            ],
+            unavailable_rewards=reward_ids[2:],
+        )
+        assert "2 of your rewards could not be shown" in resp.text
+        assert [call.kwargs["result"] for call in mock_batch_metric.labels.call_args_list] == [
+            "ok",
+            "ok",
+            "not_found",
+            "error",
+        ]
+        # unavailable rewards render no error page, only the listed rewards are counted
+        mock_fetch_metric.labels.assert_not_called()
+        mock_requests_metric.labels.assert_called_once_with(
+            retailer_slug=retailer_slug, response_status=200, response_template="default_reward_list"
+        )
+        mock_requests_metric.labels.return_value.inc.assert_called_once_with(2)
+
+
+def test_rewards_batch_concurrency_and_timeout(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    mocker.patch.object(reward_batches, "max_workers", 2)
+    mocker.patch.object(reward_batches, "timeout", 0.2)
+    mocker.patch.object(reward_batches, "_executor", None)
+    mock_batch_metric = mocker.patch("aquila.fetch_reward.batch_reward_results_total")
+    release = Event()
+    lock = Lock()
+    in_flight = [0, 0]
+
+    def fetch_reward_payload(retailer_slug: str, reward_id: str, request_path: str) -> dict:
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        try:
+            if reward_id == "slow":
+                release.wait(5)
+            return {"code": f"CODE-{reward_id}", "expiry_date": "1999-12-31"}
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    mocker.patch("aquila.fetch_reward.fetch_reward_payload", side_effect=fetch_reward_payload)
+    try:
+        resp = test_client.get("/rewards?retailer=test-retailer&reward=1&reward=slow&reward=2&reward=3")
+    finally:
+        release.set()
+        if reward_batches._executor is not None:
+            reward_batches._executor.shutdown(wait=True)
+
+    assert resp.status_code == 200
+    assert "CODE-3" in resp.text
+    assert "CODE-slow" not in resp.text
+    # at most max_workers rewards of the batch in flight, the one still being fetched at the timeout is an error
+    assert in_flight[1] == 2
+    assert [call.kwargs["result"] for call in mock_batch_metric.labels.call_args_list] == ["ok", "error", "ok", "ok"]
+
+
+def test_rewards_batch_invalid_params(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    mocker.patch("aquila.endpoints.rewards.BATCH_MAX_REWARDS", 2)
+    mock_fetch = mocker.patch("aquila.endpoints.rewards.reward_batches.fetch")
+
+    for query in ("retailer=test-retailer", "reward=1", "retailer=test-retailer&reward=1&reward=2&reward=3"):
+        resp = test_client.get(f"/rewards?{query}")
+        assert resp.status_code == 400
+
+    mock_fetch.assert_not_called()
+
+
+@responses.activate
+def test_reward_latency_histograms(test_client: "FlaskClient") -> None:
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+
+    def count(name: str, labels: dict) -> float:
+        return REGISTRY.get_sample_value(f"{name}_count", labels) or 0.0
+
+    request_labels = {"endpoint": "/reward", "response_status": "200"}
+    upstream_labels = {"service": "polaris", "status_class": "2xx"}
+    render_labels = {"source": "default"}
+    before = [
+        count("bpl_http_request_seconds", request_labels),
+        count("bpl_upstream_request_seconds", upstream_labels),
+        count("bpl_template_render_seconds", render_labels),
+    ]
+
+    responses.get(
+        f"{POLARIS_BASE_URL}/{retailer_slug}/reward/{reward_id}", json={"code": "CODE", "expiry_date": "1999-12-31"}
+    )
+    resp = test_client.get(f"/reward?retailer={retailer_slug}&reward={reward_id}")
+    assert resp.status_code == 200
+
+    assert [
+        count("bpl_http_request_seconds", request_labels),
+        count("bpl_upstream_request_seconds", upstream_labels),
+        count("bpl_template_render_seconds", render_labels),
+    ] == [value + 1 for value in before]
+
+
 def test_metrics_ok(test_client: "FlaskClient", mocker: MockerFixture) -> None:
     mocker.patch("aquila.METRICS_DEBUG", True)
     mocker.patch("aquila.endpoints.metrics.PROMETHEUS_MULTIPROC_DIR", None)
     resp = test_client.get(url_for("metrics.metrics"))
     assert resp.status_code == 200
     assert "# HELP python_gc_objects_collected_total" in resp.text
+
+
+def test_readyz_serves_cached_result(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    mock_checker = mocker.patch("aquila.endpoints.healthz.readiness_checker")
+    mock_checker.result.return_value = ReadinessResult(errors={}, checked_at=monotonic())
+    resp = test_client.get("/readyz")
+    assert resp.status_code == 200
+    assert resp.json is not None
+    assert resp.json["circuit-breakers"] == {"polaris": "closed", "cosmos": "closed"}
+    assert resp.json["warm"] == {"templates": False, "idle-connections": {"polaris": 0, "cosmos": 0}}
+
+    mock_checker.result.return_value = ReadinessResult(errors={"polaris-request": "boom"}, checked_at=monotonic())
+    resp = test_client.get("/readyz")
+    assert resp.status_code == 500
+    assert resp.json is not None
+    assert resp.json["polaris-request"] == "boom"
+
+
+@responses.activate
+def test_reward_etag_not_modified(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    mocker.patch("aquila.fetch_reward.reward_cache", RewardCache(10, 30, 300))
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+    url = f"/reward?retailer={retailer_slug}&reward={reward_id}"
+    upstream = responses.get(
+        f"{POLARIS_BASE_URL}/{retailer_slug}/reward/{reward_id}", json={"code": "CODE", "expiry_date": "1999-12-31"}
+    )
+
+    resp = test_client.get(url)
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "private, no-cache"
+    etag = resp.headers["ETag"]
+
+    # served from the reward cache, without rendering the page again
+    mock_render = mocker.patch("aquila.endpoints.rewards.render_template")
+    resp = test_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+    assert not resp.data
+    mock_render.assert_not_called()
+    assert upstream.call_count == 1
+
+    # a different template version gives a different etag
+    mocker.patch("aquila.endpoints.rewards.DEFAULT_TEMPLATE_VERSION", "default-new")
+    mock_render.return_value = "<p>new</p>"
+    resp = test_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+@responses.activate
+def test_reward_etag_not_modified_gzip(test_client: "FlaskClient", mocker: MockerFixture) -> None:
+    mocker.patch("aquila.compression.COMPRESSION_MIN_SIZE", 0)
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+    url = f"/reward?retailer={retailer_slug}&reward={reward_id}"
+    responses.get(
+        f"{POLARIS_BASE_URL}/{retailer_slug}/reward/{reward_id}", json={"code": "CODE", "expiry_date": "1999-12-31"}
+    )
+
+    resp = test_client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["Content-Encoding"] == "gzip"
+    etag = resp.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    # the 304 carries the validators of the 200 it stands for
+    for accept_encoding in ("gzip", "identity"):
+        resp = test_client.get(url, headers={"Accept-Encoding": accept_encoding, "If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.headers["ETag"] == etag
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert "Content-Encoding" not in resp.headers
+
+
+@responses.activate
+def test_reward_errors_not_cached(test_client: "FlaskClient") -> None:
+    retailer_slug = "test-retailer"
+    reward_id = str(uuid4())
+    url = f"{POLARIS_BASE_URL}/{retailer_slug}/reward/{reward_id}"
+
+    responses.get(url, status=500)
+    resp = test_client.get(f"/reward?retailer={retailer_slug}&reward={reward_id}")
+    assert resp.status_code == 200
+    assert "ETag" not in resp.headers
+    assert resp.headers["Cache-Control"] == "no-store"
+
+    responses.get(url, status=404)
+    resp = test_client.get(f"/reward?retailer={retailer_slug}&reward={reward_id}")
+    assert resp.status_code == 404
+    assert resp.headers["Cache-Control"] == "no-store"
+
+    resp = test_client.get(f"/reward?retailer={retailer_slug}")
+    assert resp.status_code == 400
+    assert resp.headers["Cache-Control"] == "no-store"
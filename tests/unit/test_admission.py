@@ -0,0 +1,60 @@
+from threading import Event, Thread
+
+import pytest
+
+from aquila.admission import AdmissionLimiter, AdmissionRejectedError
+
+
+def occupy(limiter: AdmissionLimiter) -> tuple[Thread, Event]:
+    """Hold one of the limiter's slots until the returned event is set."""
+    started, release = Event(), Event()
+
+    def hold() -> None:
+        started.set()
+        release.wait(5)
+
+    thread = Thread(target=limiter.call, args=(hold,))
+    thread.start()
+    started.wait(5)
+    return thread, release
+
+
+def test_admission_rejects_over_limit() -> None:
+    limiter = AdmissionLimiter("test-service", max_concurrent=1, max_queue_wait=0)
+    thread, release = occupy(limiter)
+
+    with pytest.raises(AdmissionRejectedError):
+        limiter.call(lambda: "reward")
+
+    release.set()
+    thread.join()
+    assert limiter.call(lambda: "reward") == "reward"
+
+
+def test_admission_waits_for_a_slot() -> None:
+    limiter = AdmissionLimiter("test-service", max_concurrent=1, max_queue_wait=5)
+    thread, release = occupy(limiter)
+
+    Thread(target=release.set).start()
+    assert limiter.call(lambda: "reward") == "reward"
+    thread.join()
+
+
+def test_admission_releases_slot_on_error() -> None:
+    limiter = AdmissionLimiter("test-service", max_concurrent=1, max_queue_wait=0)
+
+    def fail() -> None:
+        raise ValueError("upstream error")
+
+    with pytest.raises(ValueError, match="upstream error"):
+        limiter.call(fail)
+    assert limiter.call(lambda: "reward") == "reward"
+
+
+def test_admission_disabled() -> None:
+    limiter = AdmissionLimiter("test-service", max_concurrent=0, max_queue_wait=0)
+    thread, release = occupy(limiter)
+
+    assert limiter.call(lambda: "reward") == "reward"
+    release.set()
+    thread.join()
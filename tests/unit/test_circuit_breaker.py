@@ -0,0 +1,112 @@
+import pytest
+
+from pytest_mock import MockerFixture
+
+from aquila.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+
+
+def state(breaker: CircuitBreaker) -> CircuitState:
+    # read through a function so mypy does not narrow the state between assertions
+    return breaker.state
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "test-service",
+        enabled=True,
+        window_size=10,
+        min_calls=4,
+        failure_rate=0.5,
+        slow_call_seconds=1,
+        slow_call_rate=0.5,
+        open_seconds=30,
+        half_open_calls=2,
+    )
+
+
+def test_circuit_opens_on_failure_rate(mocker: MockerFixture) -> None:
+    mock_monotonic = mocker.patch("aquila.circuit_breaker.monotonic", return_value=100.0)
+    breaker = make_breaker()
+
+    for failed in (False, True, False):
+        breaker.record(failed=failed, duration=0.1)
+    assert state(breaker) == CircuitState.CLOSED
+
+    breaker.record(failed=True, duration=0.1)
+    assert state(breaker) == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 200, lambda status: status >= 500)
+
+    # after open_seconds a limited number of probes is let through
+    mock_monotonic.return_value = 131.0
+    assert breaker.allow_request()
+    assert state(breaker) == CircuitState.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record(failed=False, duration=0.1)
+    assert state(breaker) == CircuitState.HALF_OPEN
+    breaker.record(failed=False, duration=0.1)
+    assert state(breaker) == CircuitState.CLOSED
+    assert breaker.allow_request()
+
+
+def test_circuit_opens_on_slow_calls(mocker: MockerFixture) -> None:
+    mock_monotonic = mocker.patch("aquila.circuit_breaker.monotonic", return_value=100.0)
+    breaker = make_breaker()
+
+    for duration in (0.1, 2, 0.1, 2):
+        breaker.record(failed=False, duration=duration)
+    assert state(breaker) == CircuitState.OPEN
+
+    # a slow probe opens the circuit again
+    mock_monotonic.return_value = 131.0
+    assert breaker.allow_request()
+    breaker.record(failed=False, duration=2)
+    assert state(breaker) == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+
+def test_circuit_breaker_call_records_outcome() -> None:
+    breaker = make_breaker()
+
+    def fail() -> int:
+        raise ConnectionError("boom")
+
+    for _ in range(2):
+        assert breaker.call(lambda: 500, lambda status: status >= 500) == 500
+        with pytest.raises(ConnectionError):
+            breaker.call(fail, lambda status: status >= 500)
+
+    assert state(breaker) == CircuitState.OPEN
+
+
+def test_circuit_breaker_disabled() -> None:
+    breaker = CircuitBreaker("test-service", enabled=False, min_calls=1)
+    breaker.record(failed=True, duration=100)
+    assert state(breaker) == CircuitState.CLOSED
+    assert breaker.allow_request()
+
+
+def test_circuit_breaker_records_base_exception_probe(mocker: MockerFixture) -> None:
+    mock_monotonic = mocker.patch("aquila.circuit_breaker.monotonic", return_value=100.0)
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(failed=True, duration=0.1)
+
+    class ProbeTimeout(BaseException):
+        pass
+
+    def timeout() -> int:
+        raise ProbeTimeout
+
+    # a probe interrupted by a BaseException reopens the circuit instead of keeping its probe slot forever
+    mock_monotonic.return_value = 131.0
+    with pytest.raises(ProbeTimeout):
+        breaker.call(timeout, lambda status: status >= 500)
+    assert state(breaker) == CircuitState.OPEN
+
+    mock_monotonic.return_value = 162.0
+    assert breaker.call(lambda: 200, lambda status: status >= 500) == 200
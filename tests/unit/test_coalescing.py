@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+
+import pytest
+
+from pytest_mock import MockerFixture
+
+from aquila.coalescing import RequestCoalescer
+
+
+def test_request_coalescer_shares_result(mocker: MockerFixture) -> None:
+    mock_metric = mocker.patch("aquila.coalescing.upstream_coalesced_requests_total")
+    coalescer: RequestCoalescer[int] = RequestCoalescer()
+    release = Event()
+    calls: list[int] = []
+
+    def fetch() -> int:
+        calls.append(1)
+        release.wait(5)
+        return 42
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(coalescer.call, "key", fetch, "polaris") for _ in range(5)]
+        # wait for the four followers to be waiting on the leader's call
+        while mock_metric.labels.return_value.inc.call_count < 4:
+            sleep(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [42] * 5
+    assert len(calls) == 1
+    assert not coalescer._in_flight
+
+
+def test_request_coalescer_shares_error() -> None:
+    coalescer: RequestCoalescer[int] = RequestCoalescer()
+    release = Event()
+
+    def fetch() -> int:
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(coalescer.call, "key", fetch, "cosmos") for _ in range(3)]
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match="upstream failed"):
+                future.result()
+
+    assert not coalescer._in_flight
+
+
+def test_request_coalescer_disabled() -> None:
+    coalescer: RequestCoalescer[int] = RequestCoalescer(enabled=False)
+    assert coalescer.call("key", lambda: 1, "polaris") == 1
+    assert not coalescer._in_flight
+
+
+def test_request_coalescer_counts_upstream_services_only(mocker: MockerFixture) -> None:
+    mock_metric = mocker.patch("aquila.coalescing.upstream_coalesced_requests_total")
+    coalescer: RequestCoalescer[int] = RequestCoalescer()
+    release = Event()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(coalescer.call, "key", lambda: release.wait(5) and 42)
+        while not coalescer._in_flight:
+            sleep(0.01)
+        follower = executor.submit(coalescer.call, "key", lambda: 42)
+        sleep(0.05)
+        release.set()
+        assert leader.result() == follower.result() == 42
+
+    mock_metric.labels.assert_not_called()
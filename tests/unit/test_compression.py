@@ -0,0 +1,147 @@
+import gzip
+
+from collections.abc import Generator
+from types import SimpleNamespace
+
+import pytest
+
+from flask import Flask, Response
+from pytest_mock import MockerFixture
+
+from aquila import create_app
+from aquila.compression import StaticPages, compress_response
+
+PAGE = "<html><body>" + "<p>reward</p>" * 200 + "</body></html>"
+
+
+@pytest.fixture
+def app() -> Generator[Flask, None, None]:
+    app = create_app()
+    with app.app_context():
+        yield app
+
+
+def html_response(body: str = PAGE) -> Response:
+    response = Response(body, mimetype="text/html")
+    response.set_etag("abc")
+    return response
+
+
+def test_compress_response_gzip(app: Flask) -> None:
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, deflate"}):
+        response = compress_response(html_response())
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.vary
+    assert response.get_etag() == ("abc", True)
+    assert gzip.decompress(response.get_data()).decode() == PAGE
+    assert response.content_length == len(response.get_data())
+
+
+def test_compress_response_skipped(app: Flask) -> None:
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        small = compress_response(html_response("<p>small</p>"))
+        not_found = compress_response(Response(PAGE, status=404, mimetype="text/html"))
+        not_html = compress_response(Response(PAGE, mimetype="application/json"))
+
+    with app.test_request_context():
+        identity = compress_response(html_response())
+
+    assert small.get_data(as_text=True) == "<p>small</p>"
+    assert "Accept-Encoding" in small.vary
+    assert identity.get_data(as_text=True) == PAGE
+    assert identity.get_etag() == ("abc", False)
+    for response in (small, not_found, not_html, identity):
+        assert "Content-Encoding" not in response.headers
+
+
+def test_compress_response_not_modified(app: Flask) -> None:
+    not_modified = Response(status=304)
+    not_modified.set_etag("abc", weak=True)
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = compress_response(not_modified)
+
+    assert "Accept-Encoding" in response.vary
+    assert response.get_etag() == ("abc", True)
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compress_response_prefers_brotli(app: Flask, mocker: MockerFixture) -> None:
+    mocker.patch("aquila.compression.brotli", SimpleNamespace(compress=lambda body, **_: b"br:" + body[:10]))
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, br"}):
+        response = compress_response(html_response())
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.get_data() == b"br:" + PAGE.encode()[:10]
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, br;q=0.5"}):
+        response = compress_response(html_response())
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_static_pages_rendered_once_per_version(app: Flask, mocker: MockerFixture) -> None:
+    static_pages = StaticPages()
+    render = mocker.Mock(return_value=PAGE)
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        compressed = static_pages.response(("error",), "v1", render)
+    with app.test_request_context():
+        identity = static_pages.response(("error",), "v1", render)
+
+    render.assert_called_once()
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.get_data()).decode() == PAGE
+    assert identity.get_data(as_text=True) == PAGE
+    assert "Content-Encoding" not in identity.headers
+    # already negotiated, left alone by compress_response
+    assert compress_response(identity) is identity
+    assert "Content-Encoding" not in identity.headers
+
+    with app.test_request_context():
+        static_pages.response(("error",), "v2", render)
+    assert render.call_count == 2
+
+
+def test_compress_streamed_response(app: Flask) -> None:
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        streamed = html_response()
+        streamed.response = iter(["<html><head></head>", "<body>small</body></html>"])
+        response = compress_response(streamed)
+        body = b"".join(response.response)  # type: ignore[arg-type]
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.get_etag() == ("abc", True)
+    assert gzip.decompress(body).decode() == "<html><head></head><body>small</body></html>"
+
+
+def test_compress_streamed_response_brotli(app: Flask, mocker: MockerFixture) -> None:
+    compressor = mocker.Mock(
+        process=lambda data: b"br:" + data, flush=mocker.Mock(return_value=b"|"), finish=lambda: b"end"
+    )
+    mocker.patch("aquila.compression.brotli", SimpleNamespace(Compressor=lambda **_: compressor))
+
+    with app.test_request_context(headers={"Accept-Encoding": "br"}):
+        streamed = html_response()
+        streamed.response = iter(["<head>", "<body>"])
+        response = compress_response(streamed)
+        body = b"".join(response.response)  # type: ignore[arg-type]
+
+    assert response.headers["Content-Encoding"] == "br"
+    assert body == b"br:<head>|br:<body>|end"
+
+
+def test_brotli_compression(app: Flask) -> None:
+    brotli = pytest.importorskip("brotli")
+
+    with app.test_request_context(headers={"Accept-Encoding": "br"}):
+        response = compress_response(html_response())
+        streamed = html_response()
+        streamed.response = iter(["<head>", "<body>"])
+        streamed = compress_response(streamed)
+        body = b"".join(streamed.response)  # type: ignore[arg-type]
+
+    assert response.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(response.get_data()).decode() == PAGE
+    assert streamed.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(body).decode() == "<head><body>"
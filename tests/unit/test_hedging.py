@@ -0,0 +1,190 @@
+from itertools import count
+from threading import Event, current_thread
+
+import pytest
+
+from pytest_mock import MockerFixture
+
+from aquila.admission import AdmissionLimiter
+from aquila.hedging import MIN_LATENCY_SAMPLES, Hedger
+
+
+def make_hedger(
+    delay: float = 0.01,
+    delay_percentile: float = 0,
+    budget: float = 1,
+    admission: AdmissionLimiter | None = None,
+    max_workers: int = 4,
+) -> Hedger:
+    return Hedger(
+        "test-service",
+        enabled=True,
+        delay=delay,
+        delay_percentile=delay_percentile,
+        budget=budget,
+        admission=admission,
+        max_workers=max_workers,
+    )
+
+
+def test_hedge_wins_over_slow_first_attempt(mocker: MockerFixture) -> None:
+    mock_hedges = mocker.patch("aquila.hedging.upstream_hedges_total")
+    hedger = make_hedger()
+    release = Event()
+    calls = count(1)
+
+    def call() -> int:
+        attempt = next(calls)
+        if attempt == 1:
+            release.wait(5)
+        return attempt
+
+    try:
+        assert hedger.call(call) == 2
+    finally:
+        release.set()
+
+    results = [kwargs["result"] for _, kwargs in mock_hedges.labels.call_args_list]
+    assert results == ["sent", "won"]
+
+
+def test_no_hedge_for_fast_calls(mocker: MockerFixture) -> None:
+    mock_hedges = mocker.patch("aquila.hedging.upstream_hedges_total")
+    hedger = make_hedger(delay=5)
+    func = mocker.Mock(return_value="reward")
+
+    assert hedger.call(func) == "reward"
+    func.assert_called_once()
+    mock_hedges.labels.assert_not_called()
+
+
+def test_hedge_budget(mocker: MockerFixture) -> None:
+    mock_hedges = mocker.patch("aquila.hedging.upstream_hedges_total")
+    hedger = make_hedger(budget=0.5)
+    release = Event()
+    calls = count(1)
+
+    def call() -> int:
+        attempt = next(calls)
+        if attempt == 1:
+            release.wait(0.05)
+        return attempt
+
+    # half a hedge of budget after the first call, the first attempt is waited for
+    assert hedger.call(call) == 1
+    mock_hedges.labels.assert_called_once_with(service="test-service", result="no_budget")
+
+
+def test_hedge_succeeds_after_first_attempt_fails(mocker: MockerFixture) -> None:
+    mock_hedges = mocker.patch("aquila.hedging.upstream_hedges_total")
+    hedger = make_hedger()
+    calls = count(1)
+
+    def call() -> int:
+        attempt = next(calls)
+        if attempt == 1:
+            Event().wait(0.05)
+            raise ValueError("upstream error")
+        return attempt
+
+    assert hedger.call(call) == 2
+    results = [kwargs["result"] for _, kwargs in mock_hedges.labels.call_args_list]
+    assert results == ["sent", "won"]
+
+
+def test_hedge_both_attempts_fail(mocker: MockerFixture) -> None:
+    mocker.patch("aquila.hedging.upstream_hedges_total")
+    hedger = make_hedger()
+    calls = count(1)
+
+    def call() -> int:
+        attempt = next(calls)
+        if attempt == 1:
+            Event().wait(0.05)
+            raise ValueError("upstream error")
+        raise TimeoutError("hedge error")
+
+    # both attempts failed, the first attempt's error is raised
+    with pytest.raises(ValueError, match="upstream error"):
+        hedger.call(call)
+
+
+def test_hedge_holds_admission_slot_until_both_attempts_finish(mocker: MockerFixture) -> None:
+    mocker.patch("aquila.hedging.upstream_hedges_total")
+    admission = AdmissionLimiter("test-service", max_concurrent=2, max_queue_wait=0)
+    hedger = make_hedger(admission=admission)
+    release = Event()
+    calls = count(1)
+
+    def call() -> int:
+        attempt = next(calls)
+        if attempt == 1:
+            release.wait(5)
+        return attempt
+
+    try:
+        assert admission.call(lambda: hedger.call(call)) == 2
+        # the slow first attempt still holds the hedge's slot
+        assert admission.try_acquire()
+        assert not admission.try_acquire()
+        admission.release()
+    finally:
+        release.set()
+
+    # the slot is released by the first attempt's thread once it finished
+    assert hedger._executor is not None
+    hedger._executor.shutdown(wait=True)
+    assert admission.try_acquire()
+    assert admission.try_acquire()
+
+
+def test_no_hedge_without_admission_slot(mocker: MockerFixture) -> None:
+    mock_hedges = mocker.patch("aquila.hedging.upstream_hedges_total")
+    admission = AdmissionLimiter("test-service", max_concurrent=1, max_queue_wait=0)
+    hedger = make_hedger(admission=admission)
+    calls = count(1)
+
+    def call() -> int:
+        attempt = next(calls)
+        Event().wait(0.05)
+        return attempt
+
+    assert admission.call(lambda: hedger.call(call)) == 1
+    assert next(calls) == 2
+    mock_hedges.labels.assert_called_once_with(service="test-service", result="no_capacity")
+
+
+def test_queued_first_attempt_sent_from_caller_thread(mocker: MockerFixture) -> None:
+    mock_hedges = mocker.patch("aquila.hedging.upstream_hedges_total")
+    hedger = make_hedger(max_workers=1)
+    release = Event()
+    busy = hedger._get_executor().submit(release.wait, 5)
+
+    try:
+        assert hedger.call(lambda: current_thread().name) == current_thread().name
+    finally:
+        release.set()
+        busy.result()
+
+    mock_hedges.labels.assert_called_once_with(service="test-service", result="no_capacity")
+    # the time spent queued is not an upstream latency
+    assert list(hedger._latencies) == [mocker.ANY]
+    assert hedger._latencies[0] < 0.01
+
+
+def test_hedge_delay_percentile() -> None:
+    hedger = make_hedger(delay=1, delay_percentile=90)
+    for latency in range(MIN_LATENCY_SAMPLES - 1):
+        hedger._record_latency(latency / 100)
+    assert hedger.hedge_delay() == 1
+
+    hedger._record_latency(0.19)
+    assert hedger.hedge_delay() == 0.18
+
+
+def test_hedging_disabled(mocker: MockerFixture) -> None:
+    hedger = Hedger("test-service", enabled=False)
+    func = mocker.Mock(return_value="reward")
+
+    assert hedger.call(func) == "reward"
+    assert hedger._executor is None
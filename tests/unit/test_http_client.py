@@ -0,0 +1,49 @@
+from collections.abc import Generator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+from prometheus_client import REGISTRY
+
+from aquila.http_client import UpstreamClient
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def server_url() -> Generator[str, None, None]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _sample(name: str, service: str) -> float:
+    return REGISTRY.get_sample_value(name, {"service": service}) or 0.0
+
+
+def test_upstream_client_reuses_connections(server_url: str) -> None:
+    service = "test-keep-alive"
+    client = UpstreamClient(service, 1, 1)
+
+    for _ in range(3):
+        assert client.get(f"{server_url}/livez").status_code == 200
+
+    assert _sample("bpl_upstream_requests_total", service) == 3
+    assert _sample("bpl_upstream_new_connections_total", service) == 1
@@ -0,0 +1,19 @@
+from pytest_mock import MockerFixture
+
+from aquila.metric_labels import retailer_label
+
+
+def test_retailer_label(mocker: MockerFixture) -> None:
+    mocker.patch("aquila.metric_labels.ALLOWED_RETAILER_SLUGS", frozenset({"configured-retailer"}))
+    mock_template_loader = mocker.patch("aquila.metric_labels.template_loader")
+    mock_template_loader.has_retailer.side_effect = lambda retailer_slug: retailer_slug == "loaded-retailer"
+    mock_metric = mocker.patch("aquila.metric_labels.metric_label_rejected_total")
+
+    assert retailer_label(None) == "N/A"
+    assert retailer_label("") == "N/A"
+    assert retailer_label("configured-retailer") == "configured-retailer"
+    assert retailer_label("loaded-retailer") == "loaded-retailer"
+    mock_metric.labels.assert_not_called()
+
+    assert retailer_label("<script>") == "other"
+    mock_metric.labels.assert_called_once_with(label="retailer_slug")
@@ -0,0 +1,58 @@
+import os
+import subprocess
+
+from pathlib import Path
+
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+
+from aquila.multiprocess_metrics import MultiprocessMetrics
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen(["true"])  # noqa: S607
+    process.wait()
+    return process.pid
+
+
+def write_value(path: Path, value: float, metric: str = "test_total") -> None:
+    key = mmap_key(metric, metric, ["retailer_slug"], ["test-retailer"], "test metric")
+    values = MmapedDict(str(path))
+    values.write_value(key, value, 0)
+    values.close()
+
+
+def test_compact_dead_processes(tmp_path: Path) -> None:
+    pid = dead_pid()
+    write_value(tmp_path / f"counter_{pid}.db", 3)
+    write_value(tmp_path / f"counter_{os.getpid()}.db", 2)
+    write_value(tmp_path / f"gauge_livemax_{pid}.db", 1, "test_gauge")
+    write_value(tmp_path / f"gauge_all_{pid}.db", 1, "test_gauge")
+
+    multiprocess_metrics = MultiprocessMetrics(str(tmp_path), 60)
+    assert multiprocess_metrics.compact_dead_processes() == 2
+    assert {path.name for path in tmp_path.glob("*.db")} == {
+        "counter_archive.db",
+        f"counter_{os.getpid()}.db",
+        f"gauge_all_{pid}.db",
+    }
+    assert 'test_total{retailer_slug="test-retailer"} 5.0' in multiprocess_metrics.exposition().decode()
+
+    # a second dead worker is added to the same archive
+    write_value(tmp_path / f"counter_{dead_pid()}.db", 4)
+    assert multiprocess_metrics.compact_dead_processes() == 1
+    assert not MultiprocessMetrics(str(tmp_path), 0).compact_dead_processes()
+    assert (
+        'test_total{retailer_slug="test-retailer"} 9.0' in MultiprocessMetrics(str(tmp_path), 0).exposition().decode()
+    )
+
+
+def test_exposition_cache(tmp_path: Path) -> None:
+    write_value(tmp_path / f"counter_{os.getpid()}.db", 1)
+    multiprocess_metrics = MultiprocessMetrics(str(tmp_path), 60)
+    exposition = multiprocess_metrics.exposition()
+
+    write_value(tmp_path / f"counter_{os.getpid()}.db", 2)
+    assert multiprocess_metrics.exposition() is exposition
+
+    multiprocess_metrics.cache_seconds = 0
+    assert 'test_total{retailer_slug="test-retailer"} 2.0' in multiprocess_metrics.exposition().decode()
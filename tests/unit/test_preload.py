@@ -0,0 +1,80 @@
+from pytest_mock import MockerFixture
+
+from aquila import create_app
+from aquila.fetch_reward import reward_batches
+from aquila.http_client import upstream_clients
+from aquila.preload import post_fork, warm_templates, worker_exit
+from aquila.readiness import readiness_checker
+
+
+def test_warm_templates(mocker: MockerFixture) -> None:
+    mock_precompile = mocker.patch("aquila.preload.template_loader.precompile_templates")
+    app = create_app()
+
+    warm_templates(app)
+
+    mock_precompile.assert_called_once_with(app.jinja_env)
+    assert app.jinja_env.cache is not None
+    assert {template.name for template in app.jinja_env.cache.values()} == {
+        "base.html",
+        "default.html",
+        "default_error.html",
+        "default_reward_list.html",
+    }
+
+
+def test_create_app_preload(mocker: MockerFixture) -> None:
+    mock_warm_templates = mocker.patch("aquila.warm_templates")
+    mocker.patch("aquila.PRELOAD_APP", True)
+
+    app = create_app()
+
+    mock_warm_templates.assert_called_once_with(app)
+
+
+def test_post_fork_replaces_inherited_clients(mocker: MockerFixture) -> None:
+    mock_template_loader = mocker.patch("aquila.preload.template_loader")
+    sessions = {service: client.session for service, client in upstream_clients.items()}
+    mocker.patch.object(readiness_checker, "_blob_client", mocker.MagicMock())
+    mocker.patch.object(reward_batches, "_executor", mocker.MagicMock())
+
+    post_fork()
+
+    mock_template_loader.after_fork.assert_called_once()
+    assert all(client.session is not sessions[service] for service, client in upstream_clients.items())
+    assert readiness_checker._blob_client is None
+    assert reward_batches._executor is None
+
+
+def test_background_threads_started_in_workers(mocker: MockerFixture) -> None:
+    mock_queue_logging = mocker.patch("aquila.preload.queue_logging")
+    mock_readiness_checker = mocker.patch("aquila.preload.readiness_checker")
+    mocker.patch("aquila.preload.template_loader")
+    mocker.patch("aquila.preload.LOG_QUEUE_ENABLED", True)
+    mocker.patch("aquila.preload.TESTING", False)
+
+    create_app()
+    mock_queue_logging.start.assert_called_once()
+    mock_readiness_checker.start.assert_called_once()
+
+    mocker.patch("aquila.PRELOAD_APP", True)
+    mocker.patch("aquila.warm_templates")
+    create_app()
+    mock_queue_logging.start.assert_called_once()
+    mock_readiness_checker.start.assert_called_once()
+
+    post_fork()
+    assert mock_queue_logging.start.call_count == 2
+    assert mock_readiness_checker.start.call_count == 2
+
+
+def test_worker_exit_stops_background_threads(mocker: MockerFixture) -> None:
+    mock_template_loader = mocker.patch("aquila.preload.template_loader")
+    mock_readiness_checker = mocker.patch("aquila.preload.readiness_checker")
+    mock_queue_logging = mocker.patch("aquila.preload.queue_logging")
+
+    worker_exit()
+
+    mock_template_loader.stop_sync.assert_called_once()
+    mock_readiness_checker.stop.assert_called_once()
+    mock_queue_logging.stop.assert_called_once()
@@ -0,0 +1,111 @@
+from time import sleep
+
+import responses
+
+from prometheus_client import REGISTRY
+from pytest_mock import MockerFixture
+
+from aquila.readiness import ReadinessChecker
+from aquila.settings import POLARIS_HOST
+
+
+def polaris_requests() -> float:
+    return REGISTRY.get_sample_value("bpl_upstream_requests_total", {"service": "polaris"}) or 0.0
+
+
+def make_checker(mocker: MockerFixture, *, interval: float = 10, max_age: float = 60, exists: bool = True) -> tuple:
+    mock_service_client = mocker.patch("aquila.readiness.BlobServiceClient")
+    mock_blob = mock_service_client.from_connection_string.return_value.get_blob_client.return_value
+    mock_blob.exists.return_value = exists
+    mocker.patch.object(ReadinessChecker, "start")
+    return ReadinessChecker(interval, 1, max_age), mock_service_client, mock_blob
+
+
+@responses.activate
+def test_readiness_result_is_cached_between_probes(mocker: MockerFixture) -> None:
+    livez = responses.get(f"{POLARIS_HOST}/livez")
+    checker, mock_service_client, mock_blob = make_checker(mocker)
+
+    # not ready until the first background checks completed
+    assert list(checker.result().errors) == ["readiness-checks"]
+    assert livez.call_count == 0
+
+    requests_before = polaris_requests()
+    checker.run_checks()
+    first = checker.result()
+    second = checker.result()
+
+    assert first.errors == {}
+    assert second.checked_at == first.checked_at
+    assert livez.call_count == 1
+    assert mock_blob.exists.call_count == 1
+    # health checks are not counted as upstream reward traffic
+    assert polaris_requests() == requests_before
+
+    checker.run_checks()
+    assert livez.call_count == 2
+    assert checker.result().checked_at > first.checked_at
+    # the blob client is reused between checks
+    mock_service_client.from_connection_string.assert_called_once()
+
+
+@responses.activate
+def test_readiness_reports_failed_checks(mocker: MockerFixture) -> None:
+    responses.get(f"{POLARIS_HOST}/livez", status=503)
+    checker, mock_service_client, mock_blob = make_checker(mocker, exists=False)
+
+    checker.run_checks()
+    assert set(checker.result().errors) == {"azure-blob-storage", "polaris-request"}
+
+    mock_blob.exists.side_effect = ConnectionError("boom")
+    checker.run_checks()
+    checker.run_checks()
+    # a failed blob client is built again for the next check
+    assert mock_service_client.from_connection_string.call_count == 2
+
+
+@responses.activate
+def test_readiness_result_too_old(mocker: MockerFixture) -> None:
+    responses.get(f"{POLARIS_HOST}/livez")
+    checker, *_ = make_checker(mocker, max_age=5)
+    mock_monotonic = mocker.patch("aquila.readiness.monotonic", return_value=100.0)
+
+    checker.run_checks()
+    assert checker.result().errors == {}
+
+    mock_monotonic.return_value = 106.0
+    result = checker.result()
+    assert list(result.errors) == ["readiness-checks"]
+    assert result.age == 6
+
+
+@responses.activate
+def test_readiness_checks_inline_when_background_checks_disabled(mocker: MockerFixture) -> None:
+    livez = responses.get(f"{POLARIS_HOST}/livez")
+    checker, *_ = make_checker(mocker, interval=0)
+
+    checker.result()
+    checker.result()
+
+    assert livez.call_count == 2
+
+
+@responses.activate
+def test_readiness_background_checks(mocker: MockerFixture) -> None:
+    livez = responses.get(f"{POLARIS_HOST}/livez")
+    mock_service_client = mocker.patch("aquila.readiness.BlobServiceClient")
+    mock_service_client.from_connection_string.return_value.get_blob_client.return_value.exists.return_value = True
+    checker = ReadinessChecker(60, 1, 120)
+
+    checker.start()
+    try:
+        # the first checks run as soon as the thread starts
+        for _ in range(100):
+            if checker._result is not None:
+                break
+            sleep(0.01)
+        assert checker.result().errors == {}
+    finally:
+        checker.stop()
+
+    assert livez.call_count == 1
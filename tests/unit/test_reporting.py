@@ -0,0 +1,125 @@
+import json
+import logging
+import sys
+
+from decimal import Decimal
+from queue import Queue
+
+import pytest
+
+from pytest_mock import MockerFixture
+
+from aquila.log_queue import LogQueueHandler, QueueLogging
+from aquila.reporting import JSONFormatter, SamplingFilter, json_dumps
+from aquila.settings import log_sample_rate
+
+
+class ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+def make_record(level: int = logging.INFO, msg: str = "reward %s", *args: object) -> logging.LogRecord:
+    return logging.LogRecord("test-logger", level, __file__, 1, msg, args or ("found",), None)
+
+
+@pytest.mark.parametrize("has_orjson", [True, False])
+def test_json_formatter(mocker: MockerFixture, has_orjson: bool) -> None:
+    mocker.patch("aquila.reporting.HAS_ORJSON", has_orjson)
+
+    data = json.loads(JSONFormatter().format(make_record(logging.WARNING, "réward %s", "found")))
+
+    assert data["levelname"] == "WARNING"
+    assert data["name"] == "test-logger"
+    assert data["message"] == "réward found"
+
+
+@pytest.mark.parametrize("has_orjson", [True, False])
+def test_json_dumps_unserialisable_values(mocker: MockerFixture, has_orjson: bool) -> None:
+    mocker.patch("aquila.reporting.HAS_ORJSON", has_orjson)
+
+    assert json_dumps({"amount": Decimal("1.5")}) == '{"amount":"1.5"}'
+
+
+def test_sampling_filter(mocker: MockerFixture) -> None:
+    mocker.patch("aquila.reporting.random.random", side_effect=[0.05, 0.5])
+    sampling_filter = SamplingFilter(0.1)
+
+    assert sampling_filter.filter(make_record())
+    assert not sampling_filter.filter(make_record())
+    assert sampling_filter.filter(make_record(logging.WARNING))
+
+
+def test_log_sample_rate() -> None:
+    assert log_sample_rate(" aquila.fetch_reward.negative_responses=0.25") == (
+        "aquila.fetch_reward.negative_responses",
+        0.25,
+    )
+
+
+def test_log_queue_handler_drops_when_full(mocker: MockerFixture) -> None:
+    mock_dropped = mocker.patch("aquila.log_queue.log_records_dropped_total")
+    queue: Queue[logging.LogRecord] = Queue(1)
+    handler = LogQueueHandler(queue, block=False)
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+
+    assert queue.qsize() == 1
+    mock_dropped.inc.assert_called_once()
+
+
+def test_log_queue_handler_blocks(mocker: MockerFixture) -> None:
+    queue = mocker.MagicMock()
+    handler = LogQueueHandler(queue, block=True)
+
+    handler.handle(make_record())
+
+    queue.put.assert_called_once()
+    queue.put_nowait.assert_not_called()
+
+
+def test_log_queue_handler_prepare() -> None:
+    queue: Queue[logging.LogRecord] = Queue()
+    handler = LogQueueHandler(queue, block=False)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("test-logger", logging.ERROR, __file__, 1, "reward %s", ("failed",), sys.exc_info())
+
+    handler.handle(record)
+    queued = queue.get_nowait()
+
+    assert queued is not record
+    assert (queued.msg, queued.args, queued.exc_info) == ("reward failed", None, None)
+    assert queued.exc_text is not None
+    assert "ValueError: boom" in queued.exc_text
+    # formatted as without the queue: the JSON message has no traceback, text formatters still append it
+    assert json.loads(JSONFormatter().format(queued))["message"] == "reward failed"
+    assert logging.Formatter().format(queued) == logging.Formatter().format(record)
+
+
+def test_queue_logging() -> None:
+    logger = logging.getLogger("test-queue-logging")
+    logger.setLevel(logging.INFO)
+    target = ListHandler()
+    logger.addHandler(target)
+    queue_logging = QueueLogging(("test-queue-logging",), maxsize=10, block=False)
+
+    queue_logging.start()
+    queue_logging.start()
+    assert queue_logging.running
+    assert logger.handlers == [queue_logging.handler]
+
+    try:
+        logger.info("reward %s", "found")
+    finally:
+        queue_logging.stop()
+
+    assert queue_logging.handler is None
+    assert logger.handlers == [target]
+    assert [record.getMessage() for record in target.records] == ["reward found"]
@@ -0,0 +1,44 @@
+from pytest_mock import MockerFixture
+
+from aquila.reward_cache import RewardCache
+
+
+def test_reward_cache_disabled() -> None:
+    cache = RewardCache(0, 30, 300)
+    cache.set(("polaris", "test-retailer", "1"), {"code": "CODE"})
+    assert cache.get(("polaris", "test-retailer", "1")) is None
+
+
+def test_reward_cache_lru() -> None:
+    cache = RewardCache(2, 30, 300)
+    cache.set(("polaris", "test-retailer", "1"), {"code": "1"})
+    cache.set(("polaris", "test-retailer", "2"), {"code": "2"})
+    assert cache.get(("polaris", "test-retailer", "1")) is not None
+
+    cache.set(("polaris", "test-retailer", "3"), {"code": "3"})
+    assert cache.get(("polaris", "test-retailer", "2")) is None
+
+    cached = cache.get(("polaris", "test-retailer", "1"))
+    assert cached is not None
+    assert cached.fresh
+    assert cached.payload == {"code": "1"}
+
+    # callers get their own copy of the payload
+    cached.payload["code"] = "changed"
+    assert cache.get(("polaris", "test-retailer", "1")).payload == {"code": "1"}  # type: ignore[union-attr]
+
+
+def test_reward_cache_expiry(mocker: MockerFixture) -> None:
+    mock_monotonic = mocker.patch("aquila.reward_cache.monotonic", return_value=100.0)
+    cache = RewardCache(10, 30, 300)
+    key = ("cosmos", "test-retailer", "1")
+    cache.set(key, {"code": "1"})
+
+    mock_monotonic.return_value = 129.0
+    assert cache.get(key).fresh  # type: ignore[union-attr]
+
+    mock_monotonic.return_value = 131.0
+    assert not cache.get(key).fresh  # type: ignore[union-attr]
+
+    mock_monotonic.return_value = 431.0
+    assert cache.get(key) is None
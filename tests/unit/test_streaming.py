@@ -0,0 +1,78 @@
+from collections.abc import Generator
+
+import pytest
+
+from flask import Flask, render_template
+from pytest_mock import MockerFixture
+
+from aquila import create_app
+from aquila.streaming import _buffered, stream_page, streamed_rendering
+
+
+@pytest.fixture
+def app() -> Generator[Flask, None, None]:
+    app = create_app()
+    with app.app_context():
+        yield app
+
+
+def test_streamed_rendering(mocker: MockerFixture) -> None:
+    mocker.patch("aquila.streaming.STREAMED_RENDERING_RETAILERS", ["test-retailer"])
+    assert streamed_rendering("test-retailer")
+    assert not streamed_rendering("other-retailer")
+
+    mocker.patch("aquila.streaming.STREAMED_RENDERING_RETAILERS", ["*"])
+    assert streamed_rendering("other-retailer")
+
+
+def test_buffered() -> None:
+    assert list(_buffered(iter(["ab", "c", "defg", "h"]), 3)) == ["abc", "defg", "h"]
+    assert list(_buffered(iter([]), 3)) == []
+
+
+def test_stream_page(app: Flask, mocker: MockerFixture) -> None:
+    mock_metric = mocker.patch("aquila.streaming.template_render_seconds")
+    context = {"code": "TSTRWDCODE1234", "expiry_date": "31/12/1999", "pin": "1234"}
+
+    with app.test_request_context():
+        response = stream_page("default.html", context, source="default", retailer_slug="test-retailer")
+        assert response.is_streamed
+        chunks = [chunk.decode() for chunk in response.iter_encoded()]
+        expected = render_template("default.html", **context)
+
+    # the head of base.html is sent on its own, before the rest of the page is rendered
+    assert len(chunks) == 2
+    assert "<style>" in chunks[0]
+    assert "TSTRWDCODE1234" not in chunks[0]
+    assert "".join(chunks) == expected
+    mock_metric.labels.assert_called_once_with(source="default")
+    mock_metric.labels.return_value.observe.assert_called_once()
+
+
+def test_stream_page_template_error(app: Flask, mocker: MockerFixture) -> None:
+    mock_failures = mocker.patch("aquila.streaming.template_stream_failures_total")
+    template = app.jinja_env.from_string("{{ code.missing() }}<p>reward</p>")
+
+    with app.test_request_context(), pytest.raises(Exception, match="missing"):
+        stream_page(template, {"code": "TSTRWDCODE1234"}, source="blob", retailer_slug="test-retailer")
+    # an error before anything was sent ends in an error response, it is not a stream failure
+    mock_failures.labels.assert_not_called()
+
+
+def test_stream_page_error_after_head(app: Flask, mocker: MockerFixture) -> None:
+    mock_failures = mocker.patch("aquila.streaming.template_stream_failures_total")
+    mock_logger = mocker.patch("aquila.streaming.logger")
+    mocker.patch("aquila.streaming.retailer_label", return_value="test-retailer")
+    template = app.jinja_env.from_string("<head></head>{% for _ in range(2) %}{{ code.missing() }}{% endfor %}")
+    mocker.patch("aquila.streaming.STREAM_BUFFER_SIZE", 1)
+
+    with app.test_request_context():
+        response = stream_page(template, {"code": "TSTRWDCODE1234"}, source="blob", retailer_slug="test-retailer")
+        chunks = response.iter_encoded()
+        assert next(chunks) == b"<head></head>"
+        with pytest.raises(Exception, match="missing"):
+            next(chunks)
+
+    mock_failures.labels.assert_called_once_with(retailer_slug="test-retailer", source="blob")
+    mock_failures.labels.return_value.inc.assert_called_once()
+    mock_logger.exception.assert_called_once()
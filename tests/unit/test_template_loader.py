@@ -1,6 +1,71 @@
+import os
+import subprocess
+import sys
+
+from collections import OrderedDict
+from datetime import UTC, datetime
+from pathlib import Path
+from threading import Event, Thread, current_thread
+from time import monotonic, time
+from types import SimpleNamespace
+from typing import Any
+
 from pytest_mock import MockerFixture
 
-from aquila.blob_storage import template_loader
+from aquila import create_app
+from aquila.blob_storage import (
+    BlobTemplate,
+    TemplateLoader,
+    TemplateSnapshot,
+    compile_template,
+    prune_bytecode_cache,
+    template_checksum,
+    template_loader,
+)
+from aquila.settings import TEMPLATE_RELOAD_MIN_INTERVAL
+
+HOLD_LOCK_SCRIPT = """
+import fcntl, sys
+lock_file = open(sys.argv[1], "a")
+fcntl.flock(lock_file, fcntl.LOCK_EX)
+print("locked", flush=True)
+sys.stdin.readline()
+"""
+
+
+class FakeContainerClient:
+    def __init__(self, blobs: dict[str, tuple[str, str]]) -> None:
+        # blob name -> (etag, content)
+        self.blobs = blobs
+        self.downloaded: list[str] = []
+        self.download_threads: set[str] = set()
+        self.listed_prefixes: list[str | None] = []
+        self.walks = 0
+
+    def list_blobs(self, name_starts_with: str | None = None) -> list[SimpleNamespace]:
+        self.listed_prefixes.append(name_starts_with)
+        return [
+            SimpleNamespace(name=name, etag=etag, last_modified=None)
+            for name, (etag, _) in self.blobs.items()
+            if name.startswith(name_starts_with or "")
+        ]
+
+    def walk_blobs(self, delimiter: str) -> list[SimpleNamespace]:
+        self.walks += 1
+        names = {name.split(delimiter)[0] + delimiter if delimiter in name else name for name in self.blobs}
+        return [SimpleNamespace(name=name) for name in sorted(names)]
+
+    def get_blob_client(self, name: str) -> Any:  # noqa: ANN401
+        def readall() -> bytes:
+            self.downloaded.append(name)
+            self.download_threads.add(current_thread().name)
+            return self.blobs[name][1].encode()
+
+        return SimpleNamespace(download_blob=lambda: SimpleNamespace(readall=readall))
+
+
+def blob_template(content: str) -> BlobTemplate:
+    return BlobTemplate(content=content, checksum=template_checksum(content))
 
 
 def test_template_loader_no_fetch(mocker: MockerFixture) -> None:
@@ -8,3 +73,401 @@ def test_template_loader_no_fetch(mocker: MockerFixture) -> None:
     assert template_loader.dont_fetch_templates
     assert template_loader.get_template("any", "any") is None
     mock_logger.debug.assert_called_with("TESTING set to %s, returning None", True)
+
+
+def test_compiled_template_cache(mocker: MockerFixture) -> None:
+    mocker.patch.object(template_loader, "dont_fetch_templates", False)
+    mocker.patch.object(
+        template_loader, "_templates", {"test-retailer": {"test-template": blob_template("<p>{{ code }}</p>")}}
+    )
+    mocker.patch.object(template_loader, "_compiled_templates", {})
+    mock_metric = mocker.patch("aquila.blob_storage.template_compile_cache_total")
+
+    with create_app().app_context():
+        template = template_loader.lookup_template("test-retailer", "test-template")
+        assert template is not None
+        compiled = template_loader.compiled_template("test-retailer", "test-template", template)
+        assert compiled.render(code="CODE") == "<p>CODE</p>"
+        mock_metric.labels.assert_called_with(result="miss")
+
+        assert template_loader.compiled_template("test-retailer", "test-template", template) is compiled
+        mock_metric.labels.assert_called_with(result="hit")
+
+        # blob content changed, the stale compiled template is dropped and the new content compiled
+        template_loader._templates = {"test-retailer": {"test-template": blob_template("<div>{{ code }}</div>")}}
+        template_loader._drop_stale_compiled_templates()
+        assert not template_loader._compiled_templates
+
+        template = template_loader.lookup_template("test-retailer", "test-template")
+        assert template is not None
+        recompiled = template_loader.compiled_template("test-retailer", "test-template", template)
+        assert recompiled is not compiled
+        assert recompiled.render(code="CODE") == "<div>CODE</div>"
+        mock_metric.labels.assert_called_with(result="miss")
+
+
+def test_get_template_miss_reloads_once(mocker: MockerFixture) -> None:
+    mocker.patch.object(template_loader, "dont_fetch_templates", False)
+    mocker.patch.object(template_loader, "_misses", {})
+    mocker.patch.object(template_loader, "_last_reload", 0.0)
+    mocker.patch.object(template_loader, "_templates", {"test-retailer": {"test-template": blob_template("<p></p>")}})
+    mock_load = mocker.patch.object(template_loader, "_load_templates")
+
+    for _ in range(3):
+        assert template_loader.get_template("test-retailer", "unknown") is None
+
+    mock_load.assert_called_once()
+    assert template_loader._is_known_miss("test-retailer", "unknown")
+
+    # a different missing slug is not reloaded again within TEMPLATE_RELOAD_MIN_INTERVAL
+    assert template_loader.get_template("test-retailer", "other-unknown") is None
+    mock_load.assert_called_once()
+
+    assert template_loader.get_template("test-retailer", "test-template") == "<p></p>"
+
+
+def test_get_template_miss_while_reloading(mocker: MockerFixture) -> None:
+    mocker.patch.object(template_loader, "dont_fetch_templates", False)
+    mocker.patch.object(template_loader, "_misses", {})
+    mocker.patch.object(template_loader, "_templates", {})
+    mock_load = mocker.patch.object(template_loader, "_load_templates")
+
+    with template_loader._reload_lock:
+        assert template_loader.get_template("test-retailer", "unknown") is None
+
+    mock_load.assert_not_called()
+    assert not template_loader._is_known_miss("test-retailer", "unknown")
+
+
+def test_load_templates_incremental(mocker: MockerFixture) -> None:
+    container_client = FakeContainerClient(
+        {
+            "healthz": ("0", ""),
+            "retailer-a/reward.html": ("1", "<p>a</p>"),
+            "retailer-a/error.html": ("1", "<p>a error</p>"),
+            "retailer-b/reward.html": ("1", "<p>b</p>"),
+            "retailer-b/notes.txt": ("1", "not a template"),
+        }
+    )
+    mocker.patch.object(template_loader, "container_client", container_client, create=True)
+    mocker.patch.object(template_loader, "container_name", "test-container", create=True)
+    mocker.patch.object(template_loader, "_templates", {})
+    mocker.patch.object(template_loader, "_compiled_templates", {})
+
+    template_loader._load_templates()
+    assert sorted(container_client.downloaded) == [
+        "retailer-a/error.html",
+        "retailer-a/reward.html",
+        "retailer-b/reward.html",
+    ]
+    assert template_loader.last_sync_changed == 3
+    previous = template_loader._templates
+
+    # only the blob with a new etag is downloaded, deleted blobs are dropped
+    container_client.downloaded.clear()
+    container_client.blobs["retailer-a/reward.html"] = ("2", "<p>a v2</p>")
+    del container_client.blobs["retailer-b/reward.html"]
+    template_loader._load_templates()
+
+    assert container_client.downloaded == ["retailer-a/reward.html"]
+    assert template_loader.last_sync_changed == 2
+    assert template_loader._templates is not previous
+    assert template_loader._get_template("retailer-a", "reward") == BlobTemplate(
+        content="<p>a v2</p>", checksum=template_checksum("<p>a v2</p>"), etag="2"
+    )
+    assert template_loader._templates["retailer-a"]["error"] is previous["retailer-a"]["error"]
+    assert "retailer-b" not in template_loader._templates
+
+
+def test_load_templates_concurrency(mocker: MockerFixture) -> None:
+    container_client = FakeContainerClient({f"retailer-{i}/reward.html": ("1", f"<p>{i}</p>") for i in range(10)})
+    mocker.patch.object(template_loader, "container_client", container_client, create=True)
+    mocker.patch.object(template_loader, "container_name", "test-container", create=True)
+    mocker.patch.object(template_loader, "_templates", {})
+
+    mocker.patch("aquila.blob_storage.TEMPLATE_DOWNLOAD_CONCURRENCY", 4)
+    template_loader._load_templates()
+    assert len(template_loader._templates) == 10
+    assert all(name.startswith("template-download") for name in container_client.download_threads)
+
+    mocker.patch.object(template_loader, "_templates", {})
+    container_client.download_threads.clear()
+    mocker.patch("aquila.blob_storage.TEMPLATE_DOWNLOAD_CONCURRENCY", 1)
+    template_loader._load_templates()
+    assert len(template_loader._templates) == 10
+    assert container_client.download_threads == {current_thread().name}
+
+
+def patch_lazy_loader(mocker: MockerFixture, container_client: FakeContainerClient) -> None:
+    mocker.patch.object(template_loader, "dont_fetch_templates", False)
+    mocker.patch.object(template_loader, "lazy", True)
+    mocker.patch.object(template_loader, "container_client", container_client, create=True)
+    mocker.patch.object(template_loader, "container_name", "test-container", create=True)
+    mocker.patch.object(template_loader, "_templates", {})
+    mocker.patch.object(template_loader, "_retailer_sizes", OrderedDict())
+    mocker.patch.object(template_loader, "_compiled_templates", {})
+    mocker.patch.object(template_loader, "_misses", {})
+    mocker.patch.object(template_loader, "_listed_retailers", frozenset())
+    mocker.patch.object(template_loader, "_retailers_listed_at", None)
+    # misses are not reloaded again within TEMPLATE_RELOAD_MIN_INTERVAL
+    mocker.patch.object(template_loader, "_last_reload", monotonic())
+
+
+def test_lazy_loading_per_retailer(mocker: MockerFixture) -> None:
+    container_client = FakeContainerClient(
+        {
+            "retailer-a/reward.html": ("1", "<p>a</p>"),
+            "retailer-a/error.html": ("1", "<p>a error</p>"),
+            "retailer-b/reward.html": ("1", "<p>b</p>"),
+        }
+    )
+    patch_lazy_loader(mocker, container_client)
+
+    assert template_loader.get_template("retailer-a", "reward") == "<p>a</p>"
+    assert container_client.listed_prefixes == ["retailer-a/"]
+    assert sorted(container_client.downloaded) == ["retailer-a/error.html", "retailer-a/reward.html"]
+
+    assert template_loader.get_template("retailer-a", "error") == "<p>a error</p>"
+    assert template_loader.get_template("retailer-a", "unknown") is None
+    assert container_client.listed_prefixes == ["retailer-a/"]
+
+    # a retailer without a directory in the container is never listed on its own
+    for retailer_slug in ("retailer-c", "retailer-d", "retailer-c"):
+        assert template_loader.get_template(retailer_slug, "reward") is None
+    assert container_client.listed_prefixes == ["retailer-a/"]
+    assert container_client.walks == 1
+    assert list(template_loader._templates) == ["retailer-a"]
+
+
+def test_lazy_loading_lists_unknown_retailers_at_most_once_per_interval(mocker: MockerFixture) -> None:
+    container_client = FakeContainerClient({"retailer-a/reward.html": ("1", "<p>a</p>")})
+    patch_lazy_loader(mocker, container_client)
+    mock_monotonic = mocker.patch("aquila.blob_storage.monotonic", return_value=1000.0)
+
+    for i in range(10):
+        assert template_loader.get_template(f"made-up-{i}", "reward") is None
+    assert container_client.walks == 1
+    assert container_client.listed_prefixes == []
+
+    # a retailer added to the container is found once the retailers are listed again
+    container_client.blobs["retailer-b/reward.html"] = ("1", "<p>b</p>")
+    assert template_loader.get_template("retailer-b", "reward") is None
+    mock_monotonic.return_value = 1000.0 + TEMPLATE_RELOAD_MIN_INTERVAL
+    assert template_loader.get_template("retailer-b", "reward") == "<p>b</p>"
+    assert container_client.walks == 2
+    assert container_client.listed_prefixes == ["retailer-b/"]
+
+
+def test_lazy_loading_evicts_least_recently_used(mocker: MockerFixture) -> None:
+    container_client = FakeContainerClient({f"retailer-{i}/reward.html": ("1", f"<p>{i}</p>") for i in "abc"})
+    patch_lazy_loader(mocker, container_client)
+    # room for the templates of two retailers
+    mocker.patch("aquila.blob_storage.TEMPLATE_CACHE_MAX_BYTES", 2 * len("<p>a</p>"))
+
+    assert template_loader.get_template("retailer-a", "reward") == "<p>a</p>"
+    assert template_loader.get_template("retailer-b", "reward") == "<p>b</p>"
+    assert template_loader.get_template("retailer-a", "reward") == "<p>a</p>"
+    assert template_loader.get_template("retailer-c", "reward") == "<p>c</p>"
+
+    assert set(template_loader._templates) == {"retailer-a", "retailer-c"}
+    assert list(template_loader._retailer_sizes) == ["retailer-a", "retailer-c"]
+    # an evicted retailer is still a retailer with templates in blob storage
+    assert template_loader.has_retailer("retailer-b")
+    assert not template_loader.has_retailer("retailer-d")
+
+    # an evicted retailer is loaded again on its next request
+    assert template_loader.get_template("retailer-b", "reward") == "<p>b</p>"
+    assert container_client.listed_prefixes == ["retailer-a/", "retailer-b/", "retailer-c/", "retailer-b/"]
+
+
+def test_template_snapshot_round_trip(tmp_path: Path) -> None:
+    snapshot = TemplateSnapshot(str(tmp_path))
+    assert snapshot.read() is None
+    assert snapshot.synced_at() is None
+
+    last_modified = datetime(2024, 1, 2, 3, 4, 5, tzinfo=UTC)
+    templates = {
+        "retailer-a": {
+            "reward": BlobTemplate("<p>a</p>", template_checksum("<p>a</p>"), "1", last_modified),
+            "error": BlobTemplate("<p>a</p>", template_checksum("<p>a</p>"), "2"),
+        },
+        "retailer-b": {"reward": blob_template("<p>b</p>")},
+    }
+    with snapshot.lock():
+        snapshot.write(templates)
+
+    assert snapshot.read() == templates
+    assert snapshot.synced_at() is not None
+    # identical contents are stored once
+    assert len(list((tmp_path / "templates").iterdir())) == 2
+
+    # contents no longer referenced are removed, corrupted ones are left out of the snapshot
+    snapshot.write({"retailer-a": templates["retailer-a"], "retailer-c": {"reward": blob_template("<p>c</p>")}})
+    assert len(list((tmp_path / "templates").iterdir())) == 2
+    (tmp_path / "templates" / f"{template_checksum('<p>c</p>')}.html").write_text("<p>changed</p>")
+    assert snapshot.read() == {"retailer-a": templates["retailer-a"]}
+
+    (tmp_path / "manifest.json").write_text("{not json")
+    assert snapshot.read() is None
+
+
+def test_sync_with_snapshot_shared_by_workers(mocker: MockerFixture, tmp_path: Path) -> None:
+    container_client = FakeContainerClient({"retailer-a/reward.html": ("1", "<p>a</p>")})
+    mocker.patch.object(template_loader, "container_client", container_client, create=True)
+    mocker.patch.object(template_loader, "container_name", "test-container", create=True)
+    mocker.patch.object(template_loader, "snapshot", TemplateSnapshot(str(tmp_path)))
+    mocker.patch.object(template_loader, "_templates", {})
+    mocker.patch.object(template_loader, "_compiled_templates", {})
+
+    template_loader._sync_templates()
+    assert container_client.listed_prefixes == [None]
+    assert template_loader._get_template("retailer-a", "reward") == BlobTemplate(
+        content="<p>a</p>", checksum=template_checksum("<p>a</p>"), etag="1"
+    )
+
+    # another worker syncing within TEMPLATE_SNAPSHOT_MAX_AGE loads the snapshot without listing the container
+    template_loader._templates = {}
+    template_loader._sync_templates()
+    assert container_client.listed_prefixes == [None]
+    assert template_loader._get_template("retailer-a", "reward") is not None
+
+    mocker.patch("aquila.blob_storage.TEMPLATE_SNAPSHOT_MAX_AGE", 0)
+    template_loader._sync_templates()
+    assert container_client.listed_prefixes == [None, None]
+    assert container_client.downloaded == ["retailer-a/reward.html"]
+
+
+class SlowContainerClient(FakeContainerClient):
+    def __init__(self, blobs: dict[str, tuple[str, str]]) -> None:
+        super().__init__(blobs)
+        self.listing = Event()
+        self.release = Event()
+
+    def list_blobs(self, name_starts_with: str | None = None) -> list[SimpleNamespace]:
+        self.listing.set()
+        self.release.wait(5)
+        return super().list_blobs(name_starts_with)
+
+
+def test_slow_sync_does_not_block_snapshot_readers(mocker: MockerFixture, tmp_path: Path) -> None:
+    snapshot = TemplateSnapshot(str(tmp_path))
+    with snapshot.lock():
+        snapshot.write({"retailer-a": {"reward": blob_template("<p>old</p>")}})
+
+    container_client = SlowContainerClient({"retailer-a/reward.html": ("1", "<p>new</p>")})
+    mocker.patch.object(template_loader, "container_client", container_client, create=True)
+    mocker.patch.object(template_loader, "container_name", "test-container", create=True)
+    mocker.patch.object(template_loader, "snapshot", snapshot)
+    mocker.patch.object(template_loader, "_templates", {})
+    mocker.patch.object(template_loader, "_compiled_templates", {})
+    mocker.patch("aquila.blob_storage.TEMPLATE_SNAPSHOT_MAX_AGE", 0)
+
+    sync = Thread(target=template_loader._sync_templates)
+    sync.start()
+    try:
+        assert container_client.listing.wait(5)
+
+        # a starting worker loads the snapshot while the sync is still listing the container
+        other_loader = TemplateLoader()
+        other_loader.snapshot = snapshot
+        assert other_loader._load_snapshot()
+        assert other_loader._get_template("retailer-a", "reward") == blob_template("<p>old</p>")
+
+        # a reload in the request path keeps the current templates instead of waiting for the sync
+        other_loader._sync_templates(wait=False)
+        assert other_loader._get_template("retailer-a", "reward") == blob_template("<p>old</p>")
+    finally:
+        container_client.release.set()
+        sync.join(5)
+
+    assert snapshot.read() == {
+        "retailer-a": {"reward": BlobTemplate(content="<p>new</p>", checksum=template_checksum("<p>new</p>"), etag="1")}
+    }
+
+
+def test_sync_lock_wait_keeps_serving_requests(mocker: MockerFixture, tmp_path: Path) -> None:
+    snapshot = TemplateSnapshot(str(tmp_path))
+    container_client = FakeContainerClient({"retailer-a/reward.html": ("1", "<p>a</p>")})
+    mocker.patch.object(template_loader, "container_client", container_client, create=True)
+    mocker.patch.object(template_loader, "container_name", "test-container", create=True)
+    mocker.patch.object(template_loader, "snapshot", snapshot)
+    mocker.patch.object(template_loader, "_templates", {})
+    mocker.patch.object(template_loader, "_compiled_templates", {})
+
+    # another worker syncing the snapshot
+    holder = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-c", HOLD_LOCK_SCRIPT, str(tmp_path / ".sync.lock")],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert holder.stdout is not None
+    assert holder.stdout.readline() == "locked\n"
+    client = create_app().test_client()
+    served: list[int] = []
+
+    def cooperative_sleep(seconds: float) -> None:
+        # where gevent would switch to other greenlets, the waiting worker serves a request then the lock is released
+        if not served:
+            served.append(client.get("/livez").status_code)
+            assert holder.stdin is not None
+            holder.stdin.write("\n")
+            holder.stdin.close()
+            holder.wait(5)
+
+    mocker.patch("aquila.blob_storage.sleep", side_effect=cooperative_sleep)
+    try:
+        template_loader._sync_templates()
+    finally:
+        holder.kill()
+
+    assert served == [200]
+    assert container_client.listed_prefixes == [None]
+    assert template_loader._get_template("retailer-a", "reward") is not None
+
+
+def test_bytecode_cache_shared_across_apps(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch("aquila.TEMPLATE_BYTECODE_CACHE_DIR", str(tmp_path / "bytecode"))
+    mock_metric = mocker.patch("aquila.blob_storage.template_bytecode_cache_total")
+    template = blob_template("<p>{{ code }}</p>")
+
+    first_app = create_app()
+    assert first_app.jinja_env.get_template("default.html")
+    assert compile_template(first_app.jinja_env, template).render(code="CODE") == "<p>CODE</p>"
+    mock_metric.labels.assert_called_with(result="miss")
+    # one cached bytecode file for the packaged template, one for the blob template
+    assert len(list((tmp_path / "bytecode").iterdir())) == 2
+
+    # a new worker loads the bytecode compiled by the first one
+    second_app = create_app()
+    mock_compile = mocker.spy(second_app.jinja_env, "compile")
+    assert second_app.jinja_env.get_template("default.html")
+    assert compile_template(second_app.jinja_env, template).render(code="CODE") == "<p>CODE</p>"
+    mock_metric.labels.assert_called_with(result="hit")
+    mock_compile.assert_not_called()
+
+
+def test_prune_bytecode_cache(tmp_path: Path) -> None:
+    stale = tmp_path / "__jinja2_stale.cache"
+    fresh = tmp_path / "__jinja2_fresh.cache"
+    other = tmp_path / "other.cache"
+    for path in (stale, fresh, other):
+        path.write_bytes(b"bytecode")
+    two_days_ago = time() - 2 * 24 * 60 * 60
+    os.utime(stale, (two_days_ago, two_days_ago))
+    os.utime(other, (two_days_ago, two_days_ago))
+
+    assert prune_bytecode_cache(str(tmp_path), max_age=24 * 60 * 60) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["__jinja2_fresh.cache", "other.cache"]
+    assert prune_bytecode_cache(str(tmp_path / "missing"), max_age=0) == 0
+
+
+def test_background_sync_prunes_bytecode_cache(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch("aquila.blob_storage.TEMPLATE_BYTECODE_CACHE_DIR", str(tmp_path))
+    mock_prune = mocker.patch("aquila.blob_storage.prune_bytecode_cache")
+    loader = TemplateLoader()
+    mocker.patch.object(loader, "_sync_templates")
+
+    loader._sync_once()
+
+    mock_prune.assert_called_once_with(str(tmp_path))